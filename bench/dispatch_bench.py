@@ -0,0 +1,86 @@
+"""
+关键字分发微基准：对比 旧的 "逐个 Regex MessageHandler" 与 新的 "一次字典查找"。
+
+用法:
+    python bench/dispatch_bench.py [--messages 20000] [--sizes 52,200,1000,5000]
+
+关键字数量按原来的 11 个 Handler 平均分组 (模拟 11 个锚定的 Regex)，
+消息以普通群聊为主 (约 90% 不命中任何关键字)。
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+HANDLER_COUNT = 11
+CONTENT = main.read_content_file(os.path.join(ROOT, "content.json"))
+BUILTIN_KEYWORDS = (
+    CONTENT["links"]["universal"] + CONTENT["links"]["android_apk"]
+    + [k for guide in CONTENT["guides"] for k in guide["keywords"]]
+)
+CHATTER = ["今天几点开始", "好的谢谢", "链接打不开怎么办？", "哈哈哈", "在吗", "请问客服在哪里", "收到", "👍", "明天见"]
+
+
+def make_keywords(count: int) -> list:
+    keywords = list(dict.fromkeys(BUILTIN_KEYWORDS))
+    i = 0
+    while len(keywords) < count:
+        keywords.append(f"图片{i}")
+        i += 1
+    return keywords[:count]
+
+
+def make_messages(keywords: list, total: int, hit_ratio: float) -> list:
+    rng = random.Random(42)
+    return [rng.choice(keywords) if rng.random() < hit_ratio else rng.choice(CHATTER) for _ in range(total)]
+
+
+def bench_regex_chain(keywords: list, messages: list) -> float:
+    chunk = max(1, -(-len(keywords) // HANDLER_COUNT))
+    patterns = [
+        re.compile(r"^(" + "|".join(re.escape(k) for k in keywords[i:i + chunk]) + r")$")
+        for i in range(0, len(keywords), chunk)
+    ]
+    started = time.perf_counter()
+    for text in messages:
+        for pattern in patterns:
+            if pattern.search(text):
+                break
+    return time.perf_counter() - started
+
+
+def bench_dict_dispatch(keywords: list, messages: list) -> float:
+    index = {main.normalize_keyword(k): k for k in keywords}
+    normalize = main.normalize_keyword
+    started = time.perf_counter()
+    for text in messages:
+        index.get(normalize(text))
+    return time.perf_counter() - started
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--hit-ratio", type=float, default=0.1)
+    parser.add_argument("--sizes", default="52,200,1000,5000")
+    args = parser.parse_args()
+
+    print(f"{'关键字数':>8} | {'Regex 链 (ns/条)':>16} | {'字典分发 (ns/条)':>16} | {'加速比':>6}")
+    print("-" * 58)
+    for size in (int(x) for x in args.sizes.split(",")):
+        keywords = make_keywords(size)
+        messages = make_messages(keywords, args.messages, args.hit_ratio)
+        regex_ns = bench_regex_chain(keywords, messages) / len(messages) * 1e9
+        dict_ns = bench_dict_dispatch(keywords, messages) / len(messages) * 1e9
+        print(f"{size:>8} | {regex_ns:>16.0f} | {dict_ns:>16.0f} | {regex_ns / dict_ns:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,345 @@
+"""
+端到端压测：在本机启动 main.app，以及它依赖的所有外部服务的本地替身，完全离线运行。
+
+- 假 Telegram Bot API：记录 sendMessage / sendPhoto / sendVideo 调用
+- 假 域名 A 接口：符合 {"code": 0, "data": ...} 约定
+- 本地跳转站点：HTTP 3xx、meta refresh、JS 跳转，以及只有浏览器才能解析的动态 JS 跳转
+
+然后按设定速率回放合成的 Webhook 更新 (关键字、群聊闲聊、重复投递)，
+每个场景输出 p50/p95/p99 延迟、吞吐量和峰值 RSS。
+
+用法:
+    python bench/load_bench.py [--scenario all] [--rate 50] [--duration 10] [--bots 3]
+    python bench/load_bench.py --scenario browser --rate 5   # 需要已安装 Chromium (playwright install chromium)
+
+browser 场景不包含在 all 中：它以 FAST_RESOLVE_ENABLED=0、LINK_CACHE_TTL=0 启动 main，
+所有 Bot 都指向动态 JS 跳转，每个 [通用链接] 请求都会经过 Playwright 页面池。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from collections import Counter as Tally
+from email import policy as email_policy
+from email.parser import BytesParser
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ALLOWED_CHAT_ID = -1001234567890
+GUIDE_KEYWORDS = ["苹果大退", "安卓大退", "安卓浏览器", "苹果浏览器", "窗口上限", "苹果窗口上限"]
+LINK_KEYWORDS = ["链接", "地址", "最新链接"]
+APK_KEYWORDS = ["安卓专用", "提包"]
+IMAGE_KEYWORDS = ["教程图"]
+CHATTER = ["今天几点开始", "好的谢谢", "哈哈哈", "在吗", "收到", "请问客服在哪里", "👍"]
+REDIRECT_KINDS = ["3xx", "meta", "js"] # (HTTP 快速解析都能处理；"browser" 只能由 Playwright 解析)
+UPDATE_IDS = itertools.count(1_000_000) # 所有场景共用，否则后面的场景会被 update_id 去重丢弃
+
+# 场景：每种消息类型的权重，以及重复投递的比例
+SCENARIOS = {
+    "chatter": {"weights": {"chatter": 95, "guide": 5}, "duplicate_ratio": 0.0},
+    "guides": {"weights": {"guide": 80, "apk": 10, "image": 10}, "duplicate_ratio": 0.0},
+    "links": {"weights": {"link": 100}, "duplicate_ratio": 0.0},
+    "duplicates": {"weights": {"guide": 50, "link": 20, "chatter": 30}, "duplicate_ratio": 0.3},
+    "mixed": {"weights": {"chatter": 70, "guide": 15, "link": 10, "apk": 3, "image": 2}, "duplicate_ratio": 0.05},
+    # (env / redirect_kinds 在导入 main 之前生效，所以该场景会影响同一次运行中的其他场景，不包含在 all 中)
+    "browser": {
+        "weights": {"link": 100},
+        "duplicate_ratio": 0.0,
+        "redirect_kinds": ["browser"],
+        # (每个请求都是新的实时解析，且都来自同一个 Chat：关闭令牌桶，只保留全局并发上限)
+        "env": {"FAST_RESOLVE_ENABLED": "0", "LINK_CACHE_TTL": "0", "LINK_CHAT_RATE": "0", "LINK_BOT_RATE": "0"},
+    },
+}
+DEFAULT_SCENARIOS = [name for name, scenario in SCENARIOS.items() if "env" not in scenario]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def current_rss_mb() -> float:
+    """当前进程 RSS (Linux 读 /proc，其他平台退回 ru_maxrss)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --- 本地替身服务 ---
+def build_fake_telegram(calls: Tally) -> FastAPI:
+    fake = FastAPI()
+    message_ids = itertools.count(1)
+
+    async def params(request: Request) -> dict:
+        # 不依赖 python-multipart：手动解析 PTB 发出的三种请求体
+        content_type = request.headers.get("content-type", "")
+        body = await request.body()
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            parsed = BytesParser(policy=email_policy).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            return {part.get_param("name", header="content-disposition"): part.get_content() for part in parsed.iter_parts()}
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    @fake.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str, request: Request):
+        data = await params(request)
+        calls[method] += 1
+        if method == "getMe":
+            bot_id = int(token.split(":")[0])
+            return {"ok": True, "result": {"id": bot_id, "is_bot": True, "first_name": "Bench", "username": f"bench{bot_id}_bot"}}
+        chat_id = int(data.get("chat_id", ALLOWED_CHAT_ID))
+        message = {"message_id": next(message_ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "supergroup"}}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": "bench-photo", "file_unique_id": "p", "width": 1, "height": 1}]
+        elif method == "sendVideo":
+            message["video"] = {"file_id": "bench-video", "file_unique_id": "v", "width": 1, "height": 1, "duration": 1}
+        else:
+            message["text"] = data.get("text", "")
+        return {"ok": True, "result": message}
+
+    return fake
+
+
+def build_fake_sites(site_port: int) -> FastAPI:
+    """同一个端口同时提供 域名 A 接口和跳转站点；127.0.0.1 充当 域名 A，localhost 充当 域名 B"""
+    fake = FastAPI()
+    domain_a = f"http://127.0.0.1:{site_port}"
+    domain_b = f"http://localhost:{site_port}"
+
+    @fake.get("/api/{kind}")
+    async def link_api(kind: str):
+        return JSONResponse({"code": 0, "data": f"{domain_a}/redirect/{kind}"})
+
+    @fake.get("/redirect/3xx")
+    async def redirect_3xx():
+        return RedirectResponse(f"{domain_b}/landing", status_code=302)
+
+    @fake.get("/redirect/meta")
+    async def redirect_meta():
+        return HTMLResponse(f'<html><head><meta http-equiv="refresh" content="0; url={domain_b}/landing"></head></html>')
+
+    @fake.get("/redirect/js")
+    async def redirect_js():
+        return HTMLResponse(f'<html><script>window.location.href = "{domain_b}/landing";</script></html>')
+
+    @fake.get("/redirect/browser")
+    async def redirect_browser():
+        # 目标地址在运行时拼出来，静态分析不出来 (快速解析会转交 Playwright)
+        return HTMLResponse(
+            "<html><script>setTimeout(function () {"
+            f" var target = ['http:', '', 'local' + 'host:{site_port}', 'landing'].join('/');"
+            " window.location.replace(target); }, 50);</script></html>"
+        )
+
+    @fake.get("/landing")
+    async def landing():
+        return HTMLResponse("<html><body>landing</body></html>")
+
+    return fake
+
+
+async def serve(app_instance, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app_instance, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def configure_environment(bots: int, telegram_port: int, site_port: int, scenario_names: list) -> None:
+    """main.py 在导入/启动时读取环境变量，所以必须在导入 main 之前设置"""
+    redirect_kinds = REDIRECT_KINDS
+    for name in scenario_names:
+        for key, value in SCENARIOS[name].get("env", {}).items():
+            os.environ.setdefault(key, value)
+        redirect_kinds = SCENARIOS[name].get("redirect_kinds", redirect_kinds)
+    os.environ["TELEGRAM_API_BASE_URL"] = f"http://127.0.0.1:{telegram_port}"
+    os.environ.setdefault("CONTENT_FILE", os.path.join(ROOT, "content.json"))
+    os.environ["IMAGE_1_KEYS"] = ",".join(IMAGE_KEYWORDS)
+    os.environ["IMAGE_1_URL"] = f"http://127.0.0.1:{site_port}/landing.png"
+    for i in range(1, bots + 1):
+        os.environ[f"BOT_TOKEN_{i}"] = f"{100000 + i}:bench-token-{i}"
+        os.environ[f"BOT_{i}_API_URL"] = f"http://127.0.0.1:{site_port}/api/{redirect_kinds[(i - 1) % len(redirect_kinds)]}"
+        os.environ[f"BOT_{i}_APK_URL"] = "https://*.example.com/app.apk"
+        os.environ[f"BOT_{i}_ALLOWED_CHAT_IDS"] = str(ALLOWED_CHAT_ID)
+
+
+# --- 合成更新 ---
+class UpdateFactory:
+    def __init__(self, bots: int, scenario: dict, seed: int = 7):
+        self.rng = random.Random(seed)
+        self.bots = bots
+        self.kinds = list(scenario["weights"])
+        self.weights = list(scenario["weights"].values())
+        self.duplicate_ratio = scenario["duplicate_ratio"]
+        self.recent: list = []
+
+    def _text(self, kind: str) -> str:
+        pools = {"chatter": CHATTER, "guide": GUIDE_KEYWORDS, "link": LINK_KEYWORDS, "apk": APK_KEYWORDS, "image": IMAGE_KEYWORDS}
+        return self.rng.choice(pools[kind])
+
+    def next(self) -> tuple:
+        """返回 (webhook_path, payload, kind)"""
+        if self.recent and self.rng.random() < self.duplicate_ratio:
+            path, payload, _ = self.rng.choice(self.recent)
+            return path, payload, "duplicate"
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        update_id = next(UPDATE_IDS)
+        payload = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": ALLOWED_CHAT_ID, "type": "supergroup", "title": "bench"},
+                "from": {"id": 42 + self.rng.randrange(1000), "is_bot": False, "first_name": "u"},
+                "text": self._text(kind),
+            },
+        }
+        path = f"bot{self.rng.randrange(self.bots) + 1}_webhook"
+        entry = (path, payload, kind)
+        self.recent = (self.recent + [entry])[-200:]
+        return entry
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, base_url: str, bots: int, rate: float, duration: float) -> dict:
+    factory = UpdateFactory(bots, SCENARIOS[name])
+    latencies: list = []
+    statuses: Tally = Tally()
+    kinds: Tally = Tally()
+    peak_rss = current_rss_mb()
+    interval = 1.0 / rate
+    total = int(rate * duration)
+
+    async def send_one(path: str, payload: dict) -> None:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{base_url}/{path}", content=json.dumps(payload), headers={"content-type": "application/json"})
+            statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - started)
+
+    # 开环负载：按固定节拍发送，不等待上一个请求完成
+    started = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        delay = started + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        path, payload, kind = factory.next()
+        kinds[kind] += 1
+        tasks.append(asyncio.create_task(send_one(path, payload)))
+        if i % 20 == 0:
+            peak_rss = max(peak_rss, current_rss_mb())
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    peak_rss = max(peak_rss, current_rss_mb())
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "peak_rss_mb": round(peak_rss, 1),
+        "statuses": dict(statuses),
+        "mix": dict(kinds),
+    }
+
+
+def browser_runs(main) -> int:
+    """Playwright 实际完成的导航次数 (所有 域名 A 主机合计)"""
+    return sum(stats.browser_runs for stats in main.RESOLVER_HOST_STATS.values())
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    telegram_port, site_port, app_port = free_port(), free_port(), free_port()
+    scenario_names = DEFAULT_SCENARIOS if args.scenario == "all" else args.scenario.split(",")
+    configure_environment(args.bots, telegram_port, site_port, scenario_names)
+
+    import main  # noqa: E402  (必须在设置环境变量之后导入)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    calls: Tally = Tally()
+    servers = [
+        await serve(build_fake_telegram(calls), telegram_port),
+        await serve(build_fake_sites(site_port), site_port),
+    ]
+    startup_started = time.perf_counter()
+    servers.append(await serve(main.app, app_port))
+    print(f"服务已启动 (启动耗时 {time.perf_counter() - startup_started:.2f}s)，{args.bots} 个 Bot，速率 {args.rate}/s，每个场景 {args.duration}s")
+
+    results = []
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+    async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+        for name in scenario_names:
+            before = sum(calls.values())
+            browser_before = browser_runs(main)
+            result = await run_scenario(name, client, f"http://127.0.0.1:{app_port}", args.bots, args.rate, args.duration)
+            await asyncio.sleep(args.drain) # 快速确认模式下，等后台队列把回复发完
+            result["telegram_calls"] = sum(calls.values()) - before
+            result["browser_runs"] = browser_runs(main) - browser_before
+            results.append(result)
+
+    for server in reversed(servers):
+        server.should_exit = True
+    await asyncio.sleep(0.5)
+
+    header = f"{'场景':<12}{'请求':>7}{'吞吐/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}{'RSS MB':>9}{'TG调用':>8}{'浏览器':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<12}{r['requests']:>7}{r['throughput_rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}{r['peak_rss_mb']:>9}{r['telegram_calls']:>8}{r['browser_runs']:>8}")
+    transport = main.TELEGRAM_TRANSPORT_STATS.stats()
+    print(f"Telegram 连接: {'共享' if transport['shared'] else '每个 Bot 独立'}，请求 {transport['requests']}，新建连接 {transport['new_connections']}，"
+          f"复用率 {transport['connection_reuse_ratio']}，平均耗时 {transport['avg_latency_ms']}ms")
+    if args.json:
+        print(json.dumps({"scenarios": results, "telegram_transport": transport}, ensure_ascii=False, indent=2))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", default="all", help=f"all ({','.join(DEFAULT_SCENARIOS)}) 或逗号分隔: {','.join(SCENARIOS)}")
+    parser.add_argument("--rate", type=float, default=50.0, help="每秒发送的 Webhook 更新数")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个场景持续秒数")
+    parser.add_argument("--bots", type=int, default=3)
+    parser.add_argument("--drain", type=float, default=3.0, help="每个场景结束后等待后台处理的秒数")
+    parser.add_argument("--json", action="store_true", help="额外输出 JSON 结果")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,56 @@
+"""
+共享浏览器服务：启动一个常驻的 Chromium 并开放 CDP 端口，
+所有 web worker 通过 BROWSER_CDP_URL 连接它，而不是各自启动 Chromium。
+
+必须和 web worker 运行在同一台机器 / 同一个容器里 (例如用 supervisord 或 honcho
+同时启动两个进程)：CDP 端口没有鉴权，默认只监听 127.0.0.1，而 Procfile 的每种
+进程类型会被平台分配到不同的 dyno，互相访问不到，所以 Procfile 里没有 browser 进程。
+
+    python browser_service.py &                       # BROWSER_SERVICE_HOST / BROWSER_SERVICE_PORT 可配置
+    BROWSER_CDP_URL=http://127.0.0.1:9222 gunicorn main:app ...
+
+BROWSER_GLOBAL_MAX_PAGES 依赖 sqlite 状态后端，同样只在这台机器的 worker 之间生效。
+
+Chromium 意外退出时会自动重新启动 (worker 端会自动重连)。
+"""
+import os
+import asyncio
+import logging
+
+from playwright.async_api import async_playwright
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+BROWSER_SERVICE_HOST = os.getenv("BROWSER_SERVICE_HOST", "127.0.0.1")
+BROWSER_SERVICE_PORT = int(os.getenv("BROWSER_SERVICE_PORT", "9222"))
+RELAUNCH_DELAY_SECONDS = 2
+
+
+async def run_browser_service() -> None:
+    async with async_playwright() as playwright:
+        while True:
+            browser = await playwright.chromium.launch(
+                headless=True,
+                args=[
+                    "--no-sandbox",
+                    "--disable-setuid-sandbox",
+                    f"--remote-debugging-address={BROWSER_SERVICE_HOST}",
+                    f"--remote-debugging-port={BROWSER_SERVICE_PORT}",
+                ],
+            )
+            logger.info(f"🎉 共享 Chromium 已启动 (Version: {browser.version})，CDP: http://{BROWSER_SERVICE_HOST}:{BROWSER_SERVICE_PORT}")
+
+            disconnected = asyncio.Event()
+            browser.on("disconnected", lambda _: disconnected.set())
+            await disconnected.wait()
+
+            logger.error(f"❌ 共享 Chromium 已退出，{RELAUNCH_DELAY_SECONDS} 秒后重新启动...")
+            await asyncio.sleep(RELAUNCH_DELAY_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_browser_service())
@@ -2,18 +2,41 @@ import os
 import logging
 import asyncio
 import re
-import requests # 用于快速获取域名 A
+import httpx # 用于快速获取域名 A (异步 + 连接池)
 import random
 import string
+import unicodedata
 import datetime # <-- 用于定时任务
-from urllib.parse import urlparse, urlunparse
-from typing import List, Dict, Any 
+import time
+import json
+import heapq
+import socket
+import sqlite3
+import threading
+try:
+    import fcntl # (仅 POSIX：多个 worker 合并写入媒体缓存文件时加锁)
+except ImportError:
+    fcntl = None
+import secrets
+from functools import partial
+from html import escape as escape_html
+from html.parser import HTMLParser
+from bisect import bisect_left
+from urllib.parse import urlparse, urlunparse, urljoin
+from typing import List, Dict, Any, Tuple, TYPE_CHECKING
+from dataclasses import dataclass, field
+from collections import deque
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
-from telegram import Update
+from fastapi.responses import PlainTextResponse, JSONResponse
+from telegram import Update, Message
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
 
-# 引入 Playwright
-from playwright.async_api import async_playwright, Playwright, Browser
+# 引入 Playwright (仅用于类型标注；真正的导入推迟到第一次启动浏览器时，见 start_browser)
+if TYPE_CHECKING:
+    from playwright.async_api import Playwright, Browser, BrowserContext, Page
 
 # --- 1. 配置日志记录 (Logging Setup) ---
 logging.basicConfig(
@@ -24,70 +47,429 @@ logger = logging.getLogger(__name__)
 
 # --- 2. 全局状态和数据结构 ---
 BOT_APPLICATIONS: Dict[str, Application] = {}
-BOT_API_URLS: Dict[str, str] = {}
-BOT_APK_URLS: Dict[str, str] = {}
+BOT_CONFIGS: Dict[str, "BotConfig"] = {} # <-- 每个 Bot 的只读配置 (也保存在 bot_data 中)
 BOT_SCHEDULES: Dict[str, Dict[str, Any]] = {} # <-- (保留) 定时任务
-BOT_ALLOWED_CHATS: Dict[str, List[str]] = {} # <-- (保留) 安全白名单
-PLAYWRIGHT_INSTANCE: Playwright | None = None
-BROWSER_INSTANCE: Browser | None = None
+PLAYWRIGHT_INSTANCE: "Playwright | None" = None
+BROWSER_INSTANCE: "Browser | None" = None
+STARTUP_TIMINGS: Dict[str, float] = {} # <-- 启动各阶段耗时 (秒)，见 /ready
+STARTUP_COMPLETE = False
+BOT_INIT_FAILURES: Dict[str, str] = {} # <-- 初始化失败 (getMe) 的 Bot: 路径 -> 错误
 
 # (全局图片功能)
-GLOBAL_IMAGE_MAP: Dict[str, str] = {} 
-GLOBAL_IMAGE_PATTERN: str = "" 
+GLOBAL_IMAGE_MAP: Dict[str, str] = {} # 键为 normalize_keyword() 之后的关键字
 
 # --- ⬇️ 新增：全局视频功能 ⬇️ ---
 GLOBAL_VIDEO_MAP: Dict[str, str] = {} # e.g. {"视频1": "url1", "教程1": "url1"}
-GLOBAL_VIDEO_PATTERN: str = "" # e.g. r"^(视频1|教程1)$"
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：全局异步 HTTP 客户端 (用于 API 请求) ⬇️ ---
+def _env_int(name: str, default: int) -> int:
+    """读取整数环境变量，格式错误时回退到默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"DIAGNOSTIC: 环境变量 {name} 不是有效整数，使用默认值 {default}。")
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点数环境变量，格式错误时回退到默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"DIAGNOSTIC: 环境变量 {name} 不是有效数字，使用默认值 {default}。")
+        return default
+
+HTTP_CONNECT_TIMEOUT = _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_READ_TIMEOUT = _env_float("HTTP_READ_TIMEOUT", 10.0)
+HTTP_MAX_CONNECTIONS = _env_int("HTTP_MAX_CONNECTIONS", 100)
+HTTP_MAX_KEEPALIVE = _env_int("HTTP_MAX_KEEPALIVE", 20)
+HTTP_KEEPALIVE_EXPIRY = _env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+HTTP_PER_HOST_LIMIT = _env_int("HTTP_PER_HOST_LIMIT", 10) # 每个上游主机的最大并发请求数
+
+HTTP_CLIENT: httpx.AsyncClient | None = None
+HTTP_HOST_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：Playwright 页面池配置 ⬇️ ---
+BROWSER_POOL_SIZE = _env_int("BROWSER_POOL_SIZE", 3) # 同时打开的页面上限 (内存硬上限)
+BROWSER_POOL_ACQUIRE_TIMEOUT = _env_float("BROWSER_POOL_ACQUIRE_TIMEOUT", 30.0) # 等待空闲页面的最长秒数
+BROWSER_PAGE_TIMEOUT_MS = 40000 # 40 秒超时
+BROWSER_CDP_URL = os.getenv("BROWSER_CDP_URL") # 设置后连接共享浏览器服务 (browser_service.py，须与 worker 在同一台机器)，不在本进程启动 Chromium
+BROWSER_GLOBAL_MAX_PAGES = _env_int("BROWSER_GLOBAL_MAX_PAGES", 0) # >0 时限制同一台机器上所有 worker 合计同时使用的页面数 (需要 sqlite 状态后端)
+BROWSER_LAUNCH_ARGS = ["--no-sandbox", "--disable-setuid-sandbox"]
+PAGE_POOL: "BrowserPagePool | None" = None
+# (解析时只需要最终 URL：拦截不影响跳转的资源，离开 域名 A 并稳定后立即返回)
+BROWSER_BLOCK_RESOURCES = frozenset(t.strip() for t in os.getenv("BROWSER_BLOCK_RESOURCES", "image,media,font,stylesheet").split(",") if t.strip()) # 留空表示不拦截
+BROWSER_SETTLE_MS = _env_int("BROWSER_SETTLE_MS", 500) # 到达非 域名 A 主机后，这么久没有新的主框架导航即视为最终 URL
+BROWSER_NETWORKIDLE_HOSTS = frozenset(h.strip().lower() for h in os.getenv("BROWSER_NETWORKIDLE_HOSTS", "").split(",") if h.strip()) # 这些 域名 A 主机仍使用 wait_until="networkidle"
+BROWSER_USER_AGENT = os.getenv("BROWSER_USER_AGENT", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36") # 页面池和 HTTP 快速解析使用同一个 UA (按 UA 跳转的页面两条路径结果一致)
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：跨 worker 共享状态 (多 worker / 多进程部署) ⬇️ ---
+WEB_WORKERS = _env_int("WEB_WORKERS", 1) # gunicorn worker 数 (Procfile 使用；不用平台自动设置的 WEB_CONCURRENCY)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite" if WEB_WORKERS > 1 else "memory") # memory = 仅当前进程; sqlite = 同一台机器上的所有 worker 共享
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "bot_state.sqlite3")
+SCHEDULER_LEASE_TTL = _env_float("SCHEDULER_LEASE_TTL", 30.0) # 调度器租约有效期 (秒)，持有者每 1/3 周期续约一次
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class MemoryStateBackend:
+    """默认后端：状态只存在于当前进程 (单 worker 部署)"""
+    shared = False
+    PURGE_EVERY = 500 # 每写入 N 次清理一次已过期的 key
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {} # key -> (value, 过期时间戳或 None)
+        self._writes = 0
+
+    def _wrote(self) -> None:
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge()
+
+    def _purge(self) -> int:
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    async def purge_expired(self) -> int:
+        return self._purge()
+
+    def _live(self, key: str, now: float):
+        item = self._data.get(key)
+        if item is None or (item[1] is not None and item[1] <= now):
+            return None
+        return item
+
+    async def get(self, key: str) -> Any:
+        item = self._live(key, time.time())
+        return item[0] if item else None
+
+    async def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._wrote()
+
+    async def add(self, key: str, value: Any, ttl: float) -> bool:
+        """key 不存在 (或已过期) 时写入并返回 True"""
+        now = time.time()
+        if self._live(key, now):
+            return False
+        self._data[key] = (value, now + ttl)
+        self._wrote()
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return True # 单进程内永远是 leader
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+class SqliteStateBackend:
+    """
+    基于本地 SQLite 文件的共享后端 (WAL 模式)，同一台机器上的多个 worker 共享。
+    所有操作都是单条原子 SQL，在线程池中执行，不阻塞事件循环。
+    每个 worker 每写入 PURGE_EVERY 次顺带删除一次已过期的行 (update_id 去重等 key 写入后就不会再被访问)。
+    """
+    shared = True
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def _run(self, sql: str, params: tuple) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connect().execute(sql, params)
+
+    def _write(self, sql: str, params: tuple) -> sqlite3.Cursor:
+        cursor = self._run(sql, params)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge()
+        return cursor
+
+    def _purge(self) -> int:
+        return self._run("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+
+    async def purge_expired(self) -> int:
+        return await asyncio.to_thread(self._purge)
+
+    async def get(self, key: str) -> Any:
+        def _get():
+            row = self._run("SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())).fetchone()
+            return json.loads(row[0]) if row else None
+        return await asyncio.to_thread(_get)
+
+    async def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        await asyncio.to_thread(self._write, "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), expires_at))
+
+    async def add(self, key: str, value: Any, ttl: float) -> bool:
+        now = time.time()
+        cursor = await asyncio.to_thread(
+            self._write,
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (key, json.dumps(value), now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._run, "DELETE FROM kv WHERE key = ?", (key,))
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续约租约：租约空闲、已过期或本来就属于 owner 时成功"""
+        now = time.time()
+        cursor = await asyncio.to_thread(
+            self._run,
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at <= ? OR kv.value = excluded.value",
+            (f"lease:{name}", json.dumps(owner), now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        await asyncio.to_thread(self._run, "DELETE FROM kv WHERE key = ? AND value = ?", (f"lease:{name}", json.dumps(owner)))
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def create_state_backend():
+    if STATE_BACKEND == "sqlite":
+        return SqliteStateBackend(STATE_SQLITE_PATH)
+    if WEB_WORKERS > 1:
+        # 否则每个 worker 都会各自发送定时消息、各自启动 Chromium
+        raise RuntimeError(f"WEB_WORKERS={WEB_WORKERS} 需要 STATE_BACKEND=sqlite (当前: {STATE_BACKEND})")
+    if STATE_BACKEND != "memory":
+        logger.warning(f"DIAGNOSTIC: 未知的 STATE_BACKEND={STATE_BACKEND}，使用 memory。")
+    return MemoryStateBackend()
+
+STATE = create_state_backend()
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：Prometheus 风格指标 (热路径友好：预分配桶，标签用元组) ⬇️ ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0)
+
+def _escape_label_value(value: Any) -> str:
+    """Prometheus 文本格式要求转义 \\、" 和换行 (标签值可能来自内容文件，例如指南名称)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_names: tuple, labels: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    __slots__ = ("name", "help", "label_names", "_values")
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    __slots__ = ("name", "help", "label_names", "buckets", "_series")
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {} # labels -> [每个桶的计数 (非累计，最后一个是 +Inf), 总和, 总数]
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class Gauge:
+    """抓取时才计算的指标：fn() 返回 [(labels, value), ...]"""
+    __slots__ = ("name", "help", "label_names", "fn")
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, fn):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.fn():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+METRICS: List[Any] = []
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+WEBHOOK_SECONDS = register_metric(Histogram("tgbot_webhook_seconds", "Webhook 请求处理耗时 (到返回 HTTP 响应为止)", ("bot",)))
+UPDATE_SECONDS = register_metric(Histogram("tgbot_update_processing_seconds", "process_update 耗时", ("bot",)))
+HANDLER_SECONDS = register_metric(Histogram("tgbot_handler_seconds", "关键字处理器耗时", ("bot", "handler")))
+LINK_STAGE_SECONDS = register_metric(Histogram("tgbot_link_stage_seconds", "通用链接各阶段耗时 (api_fetch / fast_resolve / page_goto / reply_send)", ("bot", "stage")))
+BROADCAST_SECONDS = register_metric(Histogram("tgbot_broadcast_seconds", "一次定时广播的总耗时", ("bot",), (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)))
+BROADCAST_MESSAGES = register_metric(Counter("tgbot_broadcast_messages_total", "定时广播发送结果", ("bot", "result")))
+TELEGRAM_ERRORS = register_metric(Counter("tgbot_telegram_errors_total", "Telegram API 错误 (按错误类型)", ("bot", "error")))
+EVENT_LOOP_LAG = register_metric(Histogram("tgbot_event_loop_lag_seconds", "事件循环延迟 (定时器唤醒的滞后)", (), (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+def record_telegram_error(bot: str, error: Exception) -> None:
+    """统计 Telegram API 错误 (例如 RetryAfter=429, Forbidden=403, BadRequest=400)"""
+    if isinstance(error, TelegramError):
+        TELEGRAM_ERRORS.inc((bot, type(error).__name__))
+
+async def monitor_event_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - EVENT_LOOP_LAG_INTERVAL))
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
 # --- ⬆️ 新增 ⬆️ ---
 
 # --- 3. 核心功能：获取动态链接 ---
-# (您 21:58 版本的所有关键字)
-UNIVERSAL_COMMAND_PATTERN = r"^(地址|下载地址|下载链接|最新地址|安卓地址|苹果地址|安卓下载地址|苹果下载地址|链接|最新链接|安卓链接|安卓下载链接|最新安卓链接|苹果链接|苹果下载链接|ios链接|最新苹果链接)$"
-ANDROID_SPECIFIC_COMMAND_PATTERN = r"^(提包|安卓专用|安卓专用链接|安卓提包链接|安卓专用地址|安卓提包地址|安卓专用下载|安卓提包)$"
-IOS_QUIT_PATTERN = r"^(苹果大退|苹果重启|苹果大退重启|苹果黑屏|苹果重开)$"
-ANDROID_QUIT_PATTERN = r"^(安卓大退|安卓重启|安卓大退重启|安卓黑屏|安卓重开|大退|重开|闪退|卡了|黑屏)$"
-ANDROID_BROWSER_PATTERN = r"^(安卓浏览器手机版|安卓桌面版|安卓浏览器|浏览器设置)$"
-IOS_BROWSER_PATTERN = r"^(苹果浏览器手机版|苹果浏览器|苹果桌面版)$"
-ANDROID_TAB_LIMIT_PATTERN = r"^(安卓窗口上限|窗口上限|标签上限)$"
-IOS_TAB_LIMIT_PATTERN = r"^(苹果窗口上限|苹果标签上限)$"
-
-# (全局图片/视频关键字现在是动态加载的)
+# (所有关键字、指南文本、全局图片/视频现在都在内容文件中，见 CONTENT_FILE / reload_content)
+KEYWORD_FOLD = os.getenv("KEYWORD_FOLD", "0") == "1" # 1 = 忽略大小写和全角/半角差异
+
+def normalize_keyword(text: str) -> str:
+    """关键字归一化：去除首尾空白，可选大小写/全半角折叠"""
+    text = text.strip()
+    if KEYWORD_FOLD:
+        text = unicodedata.normalize("NFKC", text).casefold()
+    return text
 
 # --- 辅助函数 ---
 
+# --- ⬇️ 新增：每个 Bot 的配置记录 ⬇️ ---
+BOT_CONFIG_KEY = "bot_config" # application.bot_data 中的键
+
+@dataclass(frozen=True, slots=True)
+class RateLimit:
+    """令牌桶参数：每分钟补充 per_minute 个令牌，最多积攒 burst 个；per_minute <= 0 表示不限制"""
+    per_minute: float
+    burst: int
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def __str__(self) -> str:
+        return f"{self.per_minute:g}/分钟 (突发 {self.burst})" if self.enabled else "不限制"
+
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    """单个 Bot 的只读配置，启动时构建一次，处理消息时 O(1) 取用"""
+    index: int
+    webhook_path: str
+    token_end: str
+    token: str = field(repr=False) # (用于按需初始化 Application，不出现在日志/健康检查中)
+    api_url: str | None
+    apk_template: str | None
+    schedule: Dict[str, Any] | None
+    allowed_chat_ids: frozenset # 已同时包含 -100xxx 和 -xxx 两种形式
+    allowed_chats_configured: int # 白名单中配置的原始条目数
+    chat_limit: RateLimit # 每个 Chat 的 [通用链接] 请求速率
+    bot_limit: RateLimit # 整个 Bot 的 [通用链接] 请求速率
+
+def normalize_allowlist(raw_ids: List[str]) -> frozenset:
+    """把白名单预先展开为 int 集合，同时包含超级群组的长/短两种 ID 形式"""
+    normalized = set()
+    for raw_id in raw_ids:
+        raw_id = raw_id.strip()
+        try:
+            chat_id = int(raw_id)
+            variants = {chat_id}
+            if raw_id.startswith("-100"):
+                variants.add(int(f"-{raw_id[4:]}")) # (例如 "-100" 本身会在这里失败)
+            elif raw_id.startswith("-"):
+                variants.add(int(f"-100{raw_id[1:]}"))
+        except ValueError:
+            logger.warning(f"DIAGNOSTIC: 白名单中的 Chat ID [{raw_id}] 不是有效的 Chat ID，已忽略。")
+            continue
+        normalized |= variants
+    return frozenset(normalized)
+
+def get_bot_config(context: ContextTypes.DEFAULT_TYPE) -> BotConfig | None:
+    """取出当前 Bot 的配置记录"""
+    return context.bot_data.get(BOT_CONFIG_KEY)
+
+def record_handler_error(context: ContextTypes.DEFAULT_TYPE, error: Exception) -> None:
+    """处理器自己捕获 (不再向上抛出) 的 Telegram 错误，同样按 Bot 计入 TELEGRAM_ERRORS"""
+    config = get_bot_config(context)
+    record_telegram_error(config.webhook_path if config else "", error)
+
+async def on_handler_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Application 的错误处理器：统计并记录所有从处理器中抛出的异常 (例如 /start 回复失败)"""
+    record_handler_error(context, context.error)
+    logger.error(f"处理更新时发生未捕获的错误: {context.error}", exc_info=context.error)
+# --- ⬆️ 新增 ⬆️ ---
+
 # --- ⬇️ 智能安全检查 (我们最终的修复版) ⬇️ ---
 def is_chat_allowed(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> bool:
     """
     真正的智能安全检查：
-    检查此消息的 Chat ID (及其变体) 是否在当前 Bot 的“白名单”上。
+    检查此消息的 Chat ID 是否在当前 Bot 的“白名单”上 (ID 变体已在启动时展开)。
     """
-    current_app = context.application
-    allowed_list: List[str] = []
-    
-    # 1. 查找当前 Bot 的白名单
-    for path, app_instance in BOT_APPLICATIONS.items():
-        if app_instance is current_app:
-            allowed_list = BOT_ALLOWED_CHATS.get(path, [])
-            break
-            
-    # 2. 创建所有可能的 ID 变体
-    chat_id_str = str(chat_id)
-    possible_ids_to_check = {chat_id_str} 
-
-    if chat_id_str.startswith("-100"):
-        short_id = f"-{chat_id_str[4:]}"
-        possible_ids_to_check.add(short_id)
-    elif chat_id_str.startswith("-"):
-        long_id = f"-100{chat_id_str[1:]}"
-        possible_ids_to_check.add(long_id)
-
-    # 3. 检查任何一个变体是否存在于白名单中
-    for check_id in possible_ids_to_check:
-        if check_id in allowed_list:
-            return True # 匹配成功！
-
-    # 4. 如果所有变体都失败了，则拒绝
-    logger.warning(f"Bot (尾号: {current_app.bot.token[-4:]}) 收到来自 [未授权] Chat ID: {chat_id_str} (已检查 {possible_ids_to_check}) 的请求。已忽略。")
+    config = context.bot_data.get(BOT_CONFIG_KEY)
+    if config is not None and chat_id in config.allowed_chat_ids:
+        return True # 匹配成功！
+
+    logger.warning(f"Bot (尾号: {context.bot.token[-4:]}) 收到来自 [未授权] Chat ID: {chat_id} 的请求。已忽略。")
     return False
 # --- ⬆️ 智能安全检查 ⬆️ ---
 
@@ -118,6 +500,1278 @@ def modify_url_subdomain(url_str: str, new_sub: str) -> str:
         logger.error(f"修改子域名失败: {e} - URL: {url_str}")
         return url_str
 
+# --- ⬇️ 新增：共享 HTTP 客户端 ⬇️ ---
+def create_http_client() -> httpx.AsyncClient:
+    """创建带 keep-alive 连接池的共享异步客户端 (在 startup_event 中调用)"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    if HTTP_CLIENT is None:
+        raise RuntimeError("共享 HTTP 客户端未启动")
+    host = urlparse(url).netloc
+    semaphore = HTTP_HOST_SEMAPHORES.get(host)
+    if semaphore is None:
+        semaphore = HTTP_HOST_SEMAPHORES[host] = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+    return semaphore
+
+async def http_get(url: str, **kwargs: Any) -> httpx.Response:
+    """
+    通过共享客户端发起 GET 请求。
+    每个上游主机有独立的并发上限，慢速的 API 只会拖慢等待它的 Chat。
+    """
+    async with _host_semaphore(url):
+        return await HTTP_CLIENT.get(url, **kwargs)
+
+@asynccontextmanager
+async def http_stream(url: str, **kwargs: Any):
+    """与 http_get 相同的并发上限，但不预先读取响应体 (配合 read_prefix 只读前 N 字节)"""
+    async with _host_semaphore(url):
+        async with HTTP_CLIENT.stream("GET", url, **kwargs) as response:
+            yield response
+
+async def read_prefix(response: httpx.Response, max_bytes: int) -> bytes:
+    """最多读取 max_bytes 字节的响应体，其余部分不再下载"""
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            break
+    return b"".join(chunks)[:max_bytes]
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：Playwright 页面池 ⬇️ ---
+class BrowserPoolTimeout(Exception):
+    """在 acquire_timeout 内没有等到空闲页面"""
+
+class PageSlot:
+    """池中的一个独立上下文 + 页面"""
+    __slots__ = ("context", "page")
+
+    def __init__(self, context: "BrowserContext", page: "Page"):
+        self.context = context
+        self.page = page
+
+class BrowserPagePool:
+    """
+    固定大小的 Playwright 页面池：
+    预先创建相互隔离的上下文/页面，按需租借给 get_universal_link。
+    每次租借都使用全新的上下文：归还后关闭它并在后台补一个新的，
+    Cookie、localStorage / sessionStorage、IndexedDB 等不会带到下一次租借。
+    """
+
+    def __init__(self, browser: "Browser", size: int, acquire_timeout: float):
+        self.browser = browser
+        self.size = max(1, size)
+        self.acquire_timeout = acquire_timeout
+        self._idle: deque = deque()
+        self._available = asyncio.Event() # 有空闲槽位，或有槽位被丢弃 (可以新建) 时触发
+        self._live = 0 # 已创建的槽位 (空闲 + 已租出 + 正在创建)
+        self._closed = False
+        self.leased = 0
+        self.waiting = 0
+        self.pages_served = 0
+        self.recycled = 0
+        self.acquire_timeouts = 0
+
+    async def _new_slot(self) -> PageSlot:
+        context = await self.browser.new_context(user_agent=BROWSER_USER_AGENT)
+        if BROWSER_BLOCK_RESOURCES:
+            await context.route("**/*", self._route)
+        page = await context.new_page()
+        page.set_default_timeout(BROWSER_PAGE_TIMEOUT_MS)
+        return PageSlot(context, page)
+
+    async def _route(self, route) -> None:
+        """拦截图片/媒体/字体/样式表等请求 (它们不影响跳转，只消耗带宽和时间)"""
+        resource_type = route.request.resource_type
+        try:
+            if resource_type in BROWSER_BLOCK_RESOURCES:
+                BROWSER_BLOCKED_REQUESTS.inc((resource_type,))
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception as e: # (页面已关闭或已跳走)
+            logger.debug(f"页面池：处理请求拦截失败: {e}")
+
+    async def start(self) -> None:
+        """预热：一次性创建 size 个槽位"""
+        for _ in range(self.size):
+            self._live += 1
+            try:
+                self._idle.append(await self._new_slot())
+            except Exception:
+                self._live -= 1
+                raise
+
+    def _notify(self) -> None:
+        self._available.set()
+
+    async def _acquire(self) -> PageSlot:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+        self.waiting += 1
+        try:
+            while True:
+                if self._closed:
+                    raise RuntimeError("页面池已关闭")
+                if self._idle:
+                    return self._idle.popleft()
+                if self._live < self.size:
+                    # 有槽位被丢弃 / 重建失败，按需补齐
+                    self._live += 1
+                    try:
+                        return await self._new_slot()
+                    except Exception:
+                        self._live -= 1
+                        self._notify()
+                        raise
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.acquire_timeouts += 1
+                    raise BrowserPoolTimeout(f"等待空闲页面超过 {self.acquire_timeout} 秒")
+                self._available.clear()
+                try:
+                    await asyncio.wait_for(self._available.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting -= 1
+
+    async def _replace(self, slot: PageSlot) -> None:
+        """关闭用过的上下文，再补一个新的 (在后台进行，不占用请求的时间)"""
+        await self._discard(slot)
+        if self._closed or self._live >= self.size:
+            self._notify()
+            return
+        self.recycled += 1
+        self._live += 1
+        try:
+            slot = await self._new_slot()
+        except Exception as e:
+            self._live -= 1
+            if not self._closed:
+                logger.error(f"页面池：重建上下文失败: {e}")
+            self._notify() # (等待者会自己尝试新建)
+            return
+        if self._closed:
+            await self._discard(slot)
+            return
+        self._idle.append(slot)
+        self._notify()
+
+    async def _discard(self, slot: PageSlot) -> None:
+        self._live -= 1
+        try:
+            await slot.context.close()
+        except Exception as e:
+            logger.warning(f"页面池：关闭上下文失败: {e}")
+
+    async def _acquire_global_slot(self) -> str | None:
+        """共享浏览器模式：在所有 worker 之间限制同时打开的页面数"""
+        if BROWSER_GLOBAL_MAX_PAGES <= 0 or not STATE.shared:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+        ttl = BROWSER_PAGE_TIMEOUT_MS / 1000 * 2 # worker 崩溃时，名额最多被占用这么久
+        while True:
+            start = random.randrange(BROWSER_GLOBAL_MAX_PAGES)
+            for i in range(BROWSER_GLOBAL_MAX_PAGES):
+                key = f"browser_slot:{(start + i) % BROWSER_GLOBAL_MAX_PAGES}"
+                if await STATE.add(key, WORKER_ID, ttl=ttl):
+                    return key
+            if loop.time() >= deadline:
+                self.acquire_timeouts += 1
+                raise BrowserPoolTimeout(f"等待共享浏览器名额超过 {self.acquire_timeout} 秒")
+            await asyncio.sleep(0.2)
+
+    @asynccontextmanager
+    async def lease(self):
+        """租借一个页面：async with PAGE_POOL.lease() as page: ..."""
+        global_slot = await self._acquire_global_slot()
+        try:
+            slot = await self._acquire()
+            self.leased += 1
+            self.pages_served += 1
+            try:
+                yield slot.page
+            finally:
+                self.leased -= 1
+                spawn_background(self._replace(slot))
+        finally:
+            if global_slot:
+                await STATE.delete(global_slot)
+
+    async def drain(self, timeout: float) -> bool:
+        """等待已租出的页面全部归还 (调用前应先把全局 PAGE_POOL 切换到新池，不再有新的租借)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.leased or self.waiting) and loop.time() < deadline:
+            await asyncio.sleep(0.2)
+        return not (self.leased or self.waiting)
+
+    async def close(self) -> None:
+        self._closed = True
+        self._notify()
+        while self._idle:
+            await self._discard(self._idle.popleft())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "leased": self.leased,
+            "waiting": self.waiting,
+            "pages_served": self.pages_served,
+            "contexts_recycled": self.recycled,
+            "acquire_timeouts": self.acquire_timeouts,
+        }
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：浏览器启动 / 连接共享浏览器服务 (自动重连) ⬇️ ---
+SHUTTING_DOWN = False
+BROWSER_RECONNECTING = False
+BROWSER_RECONNECTS = 0
+
+async def open_browser() -> "Browser":
+    """本地启动 Chromium，或通过 CDP 连接到共享浏览器服务"""
+    if BROWSER_CDP_URL:
+        return await PLAYWRIGHT_INSTANCE.chromium.connect_over_cdp(BROWSER_CDP_URL)
+    return await PLAYWRIGHT_INSTANCE.chromium.launch(headless=True, args=BROWSER_LAUNCH_ARGS)
+
+async def install_browser() -> tuple:
+    """
+    打开浏览器并为它预热一个新的页面池，然后替换全局实例。
+    返回被替换下来的 (浏览器, 页面池)，由调用方交给 retire_browser 退役。
+    """
+    global BROWSER_INSTANCE, PAGE_POOL
+    browser = await open_browser()
+    pool = BrowserPagePool(browser, BROWSER_POOL_SIZE, BROWSER_POOL_ACQUIRE_TIMEOUT)
+    try:
+        await pool.start()
+    except Exception:
+        await browser.close()
+        raise
+    old_browser, old_pool = BROWSER_INSTANCE, PAGE_POOL
+    BROWSER_INSTANCE, PAGE_POOL = browser, pool
+    app.state.browser = browser
+    browser.on("disconnected", _on_browser_disconnected)
+    return old_browser, old_pool
+
+async def retire_browser(browser: "Browser | None", pool: BrowserPagePool | None) -> None:
+    """等待旧页面池上已租出的页面归还 (最多 BROWSER_DRAIN_TIMEOUT 秒)，然后关闭旧池和旧浏览器"""
+    if pool is not None:
+        if not await pool.drain(BROWSER_DRAIN_TIMEOUT):
+            logger.warning(f"旧浏览器仍有 {pool.leased} 个页面未归还 (已等待 {BROWSER_DRAIN_TIMEOUT:.0f}s)，强制关闭。")
+        await pool.close()
+    if browser is not None and browser.is_connected():
+        try:
+            await browser.close() # (CDP 模式下只断开连接)
+        except Exception as e:
+            logger.warning(f"关闭旧浏览器失败: {e}")
+
+def _on_browser_disconnected(browser: "Browser") -> None:
+    if SHUTTING_DOWN or browser is not BROWSER_INSTANCE or BROWSER_RECONNECTING:
+        return
+    logger.error("❌ 浏览器连接已断开，正在后台重新连接/启动...")
+    spawn_background(reconnect_browser())
+
+async def reconnect_browser(reason: str = "disconnected") -> None:
+    """指数退避重试，直到重新拿到可用的浏览器"""
+    global BROWSER_RECONNECTING, BROWSER_RECONNECTS
+    BROWSER_RECONNECTING = True
+    delay = 1.0
+    started = time.perf_counter()
+    try:
+        while not SHUTTING_DOWN:
+            try:
+                old_browser, old_pool = await install_browser()
+                spawn_background(retire_browser(old_browser, old_pool))
+                BROWSER_RECONNECTS += 1
+                record_browser_relaunch(reason, started, True)
+                logger.info(f"🎉 浏览器已重新就绪 ({'CDP: ' + BROWSER_CDP_URL if BROWSER_CDP_URL else '本地 Chromium'})。")
+                return
+            except Exception as e:
+                logger.error(f"重新连接浏览器失败，{delay:.0f} 秒后重试: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+    finally:
+        BROWSER_RECONNECTING = False
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：延迟启动浏览器 (不阻塞服务启动) ⬇️ ---
+BROWSER_STARTUP = os.getenv("BROWSER_STARTUP", "background").strip().lower() # eager=启动时等待 | background=启动后后台预热 | lazy=首次需要时启动
+BROWSER_STATE = "not_started" # not_started | starting | ready | failed
+BROWSER_START_ERROR: str | None = None
+BROWSER_START_LOCK = asyncio.Lock()
+
+def browser_ready() -> bool:
+    return PAGE_POOL is not None and BROWSER_INSTANCE is not None and BROWSER_INSTANCE.is_connected()
+
+async def start_browser() -> bool:
+    """启动 Playwright + 浏览器 + 页面池；并发调用者共用同一次启动，失败后下次调用会重试"""
+    global PLAYWRIGHT_INSTANCE, BROWSER_STATE, BROWSER_START_ERROR
+    if browser_ready():
+        return True
+    async with BROWSER_START_LOCK:
+        if browser_ready():
+            return True
+        if BROWSER_RECONNECTING or SHUTTING_DOWN:
+            return False
+        BROWSER_STATE = "starting"
+        started = time.perf_counter()
+        logger.info("正在启动全局 Playwright 实例...")
+        try:
+            if PLAYWRIGHT_INSTANCE is None:
+                from playwright.async_api import async_playwright # (延迟导入，只处理静态指令的进程无需加载)
+                PLAYWRIGHT_INSTANCE = await async_playwright().start()
+            # (设置 BROWSER_CDP_URL 时连接共享浏览器服务，否则在本进程启动 Chromium；同时预热页面池)
+            old_browser, old_pool = await install_browser()
+            if old_browser is not None or old_pool is not None:
+                spawn_background(retire_browser(old_browser, old_pool))
+        except Exception as e:
+            BROWSER_STATE, BROWSER_START_ERROR = "failed", str(e)
+            logger.error(f"❌ 启动 Playwright 失败: {e}")
+            logger.error("服务继续运行，但 Playwright 功能将无法工作 (下次需要时会重试)！")
+            return False
+        BROWSER_STATE, BROWSER_START_ERROR = "ready", None
+        STARTUP_TIMINGS["browser_seconds"] = round(time.perf_counter() - started, 3)
+        if BROWSER_CDP_URL:
+            logger.info(f"🎉 已连接共享浏览器服务: {BROWSER_CDP_URL}")
+        else:
+            logger.info("🎉 全局 Playwright Chromium 浏览器启动成功！")
+        logger.info(f"🎉 页面池已就绪: {BROWSER_POOL_SIZE} 个隔离上下文 (每次租借使用全新上下文)，耗时 {STARTUP_TIMINGS['browser_seconds']}s。")
+        return True
+
+def browser_startup_status() -> Dict[str, Any]:
+    if browser_ready():
+        state = "ready"
+    elif BROWSER_RECONNECTING:
+        state = "reconnecting"
+    else:
+        state = BROWSER_STATE
+    return {"state": state, "startup_mode": BROWSER_STARTUP, "error": BROWSER_START_ERROR}
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：浏览器守护 (健康检查、崩溃重启、按内存/页数回收) ⬇️ ---
+BROWSER_WATCHDOG_INTERVAL = _env_float("BROWSER_WATCHDOG_INTERVAL", 15.0) # 检查间隔 (秒)，0 表示关闭守护
+BROWSER_MAX_MEMORY_MB = _env_float("BROWSER_MAX_MEMORY_MB", 1024.0) # 本地 Chromium 进程内存 (PSS) 总和超过该值时回收，0 表示不检查
+BROWSER_RECYCLE_PAGES = _env_int("BROWSER_RECYCLE_PAGES", 5000) # 一个浏览器实例累计服务多少个页面后回收，0 表示不限
+BROWSER_DRAIN_TIMEOUT = _env_float("BROWSER_DRAIN_TIMEOUT", 60.0) # 回收时等待旧浏览器上已租出页面归还的最长时间 (秒)
+
+BROWSER_RELAUNCH_SECONDS = register_metric(Histogram("tgbot_browser_relaunch_seconds", "浏览器重启/回收耗时 (到新浏览器可用为止)", ("reason",), (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)))
+BROWSER_BLOCKED_REQUESTS = register_metric(Counter("tgbot_browser_blocked_requests_total", "解析时被拦截的浏览器请求 (按资源类型)", ("resource_type",)))
+BROWSER_RELAUNCHES = register_metric(Counter("tgbot_browser_relaunches_total", "浏览器重启/回收次数", ("reason", "result")))
+BROWSER_RELAUNCH_EVENTS: deque = deque(maxlen=20) # 最近的重启事件 (见健康检查)
+BROWSER_RECYCLING = False
+BROWSER_MEMORY: Dict[str, Any] = {"bytes": None, "processes": 0} # 最近一次采样
+
+def record_browser_relaunch(reason: str, started: float, ok: bool, detail: str | None = None) -> None:
+    elapsed = time.perf_counter() - started
+    BROWSER_RELAUNCH_SECONDS.observe(elapsed, (reason,))
+    BROWSER_RELAUNCHES.inc((reason, "ok" if ok else "failed"))
+    BROWSER_RELAUNCH_EVENTS.append({
+        "at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "reason": reason,
+        "ok": ok,
+        "seconds": round(elapsed, 2),
+        "detail": detail,
+    })
+
+def _process_memory_bytes(pid: int) -> int:
+    """优先使用 PSS (共享内存按比例分摊，多个 Chromium 进程相加不会重复计算)，否则退回 RSS"""
+    for path, field_name in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field_name):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return 0
+
+def browser_process_memory() -> Tuple[int, int] | None:
+    """本进程派生的 Chromium 进程 (浏览器 + 渲染进程) 的内存总和和进程数；非 Linux 返回 None"""
+    if not os.path.isdir("/proc"):
+        return None
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, count = 0, 0
+    stack = list(children.get(os.getpid(), []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                executable = f.read().split(b"\0", 1)[0].lower()
+        except OSError:
+            continue
+        if b"chrom" in executable or b"headless_shell" in executable:
+            total += _process_memory_bytes(pid)
+            count += 1
+    return total, count
+
+async def recycle_browser(reason: str, detail: str) -> None:
+    """先启动替换浏览器并切换过去 (新请求立即使用新浏览器)，再等待旧浏览器的页面归还后关闭它"""
+    global BROWSER_RECYCLING
+    if BROWSER_RECYCLING or BROWSER_RECONNECTING or SHUTTING_DOWN:
+        return
+    BROWSER_RECYCLING = True
+    started = time.perf_counter()
+    logger.warning(f"浏览器守护：{detail}，正在回收浏览器...")
+    try:
+        old_browser, old_pool = await install_browser()
+    except Exception as e:
+        record_browser_relaunch(reason, started, False, f"{detail}; 启动替换浏览器失败: {e}")
+        logger.error(f"浏览器守护：启动替换浏览器失败，继续使用旧浏览器: {e}")
+        return
+    finally:
+        BROWSER_RECYCLING = False
+    record_browser_relaunch(reason, started, True, detail)
+    logger.info(f"浏览器守护：新浏览器已接管 (耗时 {time.perf_counter() - started:.1f}s)，旧浏览器在页面归还后关闭。")
+    await retire_browser(old_browser, old_pool)
+
+async def supervise_browser() -> None:
+    """
+    定期检查浏览器：
+    - 已断开但没有在重连 (例如断开事件丢失) -> 重连
+    - 启动失败 -> 按指数退避重试启动
+    - 内存或累计页数超过阈值 -> 回收 (先切换到新浏览器，再排空旧浏览器)
+    """
+    retry_delay = BROWSER_WATCHDOG_INTERVAL
+    next_retry = 0.0
+    loop = asyncio.get_running_loop()
+    while not SHUTTING_DOWN:
+        await asyncio.sleep(BROWSER_WATCHDOG_INTERVAL)
+        if BROWSER_RECONNECTING or BROWSER_RECYCLING or BROWSER_STATE in ("not_started", "starting"):
+            continue
+        if BROWSER_STATE == "failed":
+            if loop.time() >= next_retry:
+                logger.info("浏览器守护：重试启动浏览器...")
+                started = time.perf_counter()
+                ok = await start_browser()
+                record_browser_relaunch("start_retry", started, ok, None if ok else BROWSER_START_ERROR)
+                if ok:
+                    retry_delay = BROWSER_WATCHDOG_INTERVAL
+                else:
+                    retry_delay = min(retry_delay * 2, 300.0)
+                    next_retry = loop.time() + retry_delay
+            continue
+        if BROWSER_INSTANCE is None or not BROWSER_INSTANCE.is_connected():
+            logger.error("浏览器守护：浏览器已断开且没有重连任务，正在重新连接/启动...")
+            spawn_background(reconnect_browser("watchdog"))
+            continue
+
+        if not BROWSER_CDP_URL: # (共享浏览器服务的进程不属于本 worker，无法测量)
+            memory = await asyncio.to_thread(browser_process_memory)
+            if memory is not None:
+                BROWSER_MEMORY["bytes"], BROWSER_MEMORY["processes"] = memory
+                memory_mb = memory[0] / 1024 / 1024
+                if BROWSER_MAX_MEMORY_MB > 0 and memory_mb > BROWSER_MAX_MEMORY_MB:
+                    await recycle_browser("memory", f"Chromium 内存 {memory_mb:.0f}MB 超过 {BROWSER_MAX_MEMORY_MB:.0f}MB")
+                    continue
+        if BROWSER_RECYCLE_PAGES > 0 and PAGE_POOL is not None and PAGE_POOL.pages_served >= BROWSER_RECYCLE_PAGES:
+            await recycle_browser("pages", f"已服务 {PAGE_POOL.pages_served} 个页面 (上限 {BROWSER_RECYCLE_PAGES})")
+
+def browser_supervisor_stats() -> Dict[str, Any]:
+    return {
+        "watchdog_interval_seconds": BROWSER_WATCHDOG_INTERVAL,
+        "memory_mb": round(BROWSER_MEMORY["bytes"] / 1024 / 1024, 1) if BROWSER_MEMORY["bytes"] is not None else None,
+        "processes": BROWSER_MEMORY["processes"],
+        "max_memory_mb": BROWSER_MAX_MEMORY_MB,
+        "pages_served": PAGE_POOL.pages_served if PAGE_POOL else 0,
+        "recycle_after_pages": BROWSER_RECYCLE_PAGES,
+        "recycling": BROWSER_RECYCLING,
+        "recent_relaunches": list(BROWSER_RELAUNCH_EVENTS),
+    }
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：域名 B 解析 (API -> 域名 A -> Playwright -> 域名 B) ⬇️ ---
+class LinkResolveError(Exception):
+    """解析失败，异常信息可以直接展示给用户"""
+
+LINK_RESOLVE_TIMEOUT = _env_float("LINK_RESOLVE_TIMEOUT", 60.0) # 一次完整解析的总超时 (秒)
+
+class SingleFlight:
+    """
+    并发请求合并：同一个 key 同时只执行一次，
+    所有等待者共享同一个结果 (或同一个异常)。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: Any) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Any, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # shield: 某个等待者被取消时，不影响共享任务和其他等待者
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Any, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception() # 标记异常已读取，避免所有等待者都取消时的告警
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), "executions": self.executions, "coalesced": self.coalesced}
+
+RESOLVE_FLIGHTS = SingleFlight() # key: webhook 路径
+NAVIGATION_FLIGHTS = SingleFlight() # key: 域名 A
+
+API_REQUEST_HEADERS = {
+    'User-Agent': BROWSER_USER_AGENT
+}
+
+# --- ⬇️ 新增：无浏览器快速解析 (HTTP 3xx / meta refresh / 简单 JS 跳转) ⬇️ ---
+FAST_RESOLVE_ENABLED = os.getenv("FAST_RESOLVE_ENABLED", "1") != "0"
+FAST_RESOLVE_MAX_HOPS = _env_int("FAST_RESOLVE_MAX_HOPS", 5) # 最多跟随几次 meta/JS 跳转
+FAST_RESOLVE_SKIP_AFTER = _env_int("FAST_RESOLVE_SKIP_AFTER", 3) # 某主机连续 N 次无法判定后，直接走浏览器
+FAST_RESOLVE_REPROBE_AFTER = _env_float("FAST_RESOLVE_REPROBE_AFTER", 600.0) # 直接走浏览器的主机每隔 N 秒重新试一次 HTTP 快速解析
+FAST_RESOLVE_BUDGET = _env_float("FAST_RESOLVE_BUDGET", 5.0) # 整条快速解析链的总时限 (秒)，超时后转交 Playwright
+FAST_RESOLVE_MAX_BODY = 256 * 1024 # 只检查页面前 256KB
+
+META_TAG_RE = re.compile(r"<meta\b[^>]*>", re.IGNORECASE)
+META_REFRESH_URL_RE = re.compile(r"content\s*=\s*[\"']?\s*\d*\s*[;,]\s*url\s*=\s*['\"]?([^\"'>\s]+)", re.IGNORECASE)
+JS_LOCATION_RE = re.compile(
+    r"(?:window\.|document\.|top\.|self\.)?location(?:\.href)?\s*=\s*[\"']([^\"']+)[\"']"
+    r"|location\.(?:replace|assign)\(\s*[\"']([^\"']+)[\"']\s*\)",
+    re.IGNORECASE,
+)
+
+class HostResolveStats:
+    """记录某个 域名 A 主机的解析方式与耗时"""
+    __slots__ = ("http_ok", "escalations", "consecutive_escalations", "pinned_at", "reprobes", "browser_runs", "browser_early_exits", "http_ms", "browser_ms")
+
+    def __init__(self):
+        self.http_ok = 0
+        self.escalations = 0
+        self.consecutive_escalations = 0
+        self.pinned_at = 0.0 # 最近一次判定为 "browser" 的时间 (time.monotonic)
+        self.reprobes = 0
+        self.browser_runs = 0
+        self.browser_early_exits = 0
+        self.http_ms = 0.0
+        self.browser_ms = 0.0
+
+    @property
+    def strategy(self) -> str:
+        """连续多次无法用 HTTP 判定的主机直接走浏览器"""
+        return "browser" if self.consecutive_escalations >= FAST_RESOLVE_SKIP_AFTER else "http"
+
+    def try_http(self) -> bool:
+        """
+        是否先尝试 HTTP 快速解析。
+        已判定为 "browser" 的主机每隔 FAST_RESOLVE_REPROBE_AFTER 秒放行一次探测 (主机的跳转方式可能已经变了)；
+        探测成功则恢复 "http"，失败则重新计时。
+        """
+        if self.strategy == "http":
+            return True
+        now = time.monotonic()
+        if FAST_RESOLVE_REPROBE_AFTER > 0 and now - self.pinned_at >= FAST_RESOLVE_REPROBE_AFTER:
+            self.pinned_at = now # (同一时间只放行一次探测)
+            self.reprobes += 1
+            return True
+        return False
+
+    def record_http(self, elapsed_ms: float) -> None:
+        self.http_ok += 1
+        self.consecutive_escalations = 0
+        self.http_ms += elapsed_ms
+
+    def record_escalation(self, elapsed_ms: float) -> None:
+        self.escalations += 1
+        self.consecutive_escalations += 1
+        self.http_ms += elapsed_ms
+        if self.consecutive_escalations >= FAST_RESOLVE_SKIP_AFTER:
+            self.pinned_at = time.monotonic()
+
+    def record_browser(self, elapsed_ms: float, early_exit: bool) -> None:
+        self.browser_runs += 1
+        self.browser_early_exits += early_exit
+        self.browser_ms += elapsed_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        http_attempts = self.http_ok + self.escalations
+        return {
+            "strategy": self.strategy,
+            "http_ok": self.http_ok,
+            "escalated_to_browser": self.escalations,
+            "http_reprobes": self.reprobes,
+            "browser_runs": self.browser_runs,
+            "browser_early_exits": self.browser_early_exits,
+            "avg_http_ms": round(self.http_ms / http_attempts, 1) if http_attempts else None,
+            "avg_browser_ms": round(self.browser_ms / self.browser_runs, 1) if self.browser_runs else None,
+        }
+
+RESOLVER_HOST_STATS: Dict[str, HostResolveStats] = {}
+
+def url_host(url: str) -> str:
+    """比较主机用的键：小写、不含端口 (与 Chromium 的 page.url 一致)"""
+    return urlparse(url).hostname or ""
+
+def html_redirect_targets(html: str, base_url: str) -> set:
+    """页面中所有 meta refresh / JS location 跳转目标 (已转换为绝对 URL，去重)"""
+    targets = set()
+    for tag in META_TAG_RE.findall(html):
+        if re.search(r"http-equiv\s*=\s*[\"']?refresh", tag, re.IGNORECASE):
+            match = META_REFRESH_URL_RE.search(tag)
+            if match:
+                targets.add(urljoin(base_url, match.group(1)))
+    for assigned, called in JS_LOCATION_RE.findall(html):
+        targets.add(urljoin(base_url, assigned or called))
+    return targets
+
+def find_html_redirect(html: str, base_url: str) -> str | None:
+    """
+    页面只有一个确定的跳转目标时返回它。
+    有多个不同目标 (例如按 UA / 条件选择) 时无法静态判断，返回 None。
+    """
+    targets = html_redirect_targets(html, base_url)
+    return targets.pop() if len(targets) == 1 else None
+
+async def fast_resolve_redirect(domain_a: str) -> str | None:
+    """
+    用普通 HTTP 客户端解析跳转链。
+    返回 域名 B；无法确定时返回 None (交给 Playwright)。
+    """
+    host_a = url_host(domain_a)
+    url = domain_a
+    for _ in range(FAST_RESOLVE_MAX_HOPS + 1):
+        async with http_stream(url, headers=API_REQUEST_HEADERS, follow_redirects=True) as response:
+            final_url = str(response.url)
+            if response.status_code >= 400 or "html" not in response.headers.get("content-type", "html"):
+                return None
+            body = await read_prefix(response, FAST_RESOLVE_MAX_BODY)
+        try:
+            html = body.decode(response.charset_encoding or "utf-8", errors="replace")
+        except LookupError: # (未知的 charset)
+            html = body.decode("utf-8", errors="replace")
+        targets = html_redirect_targets(html, final_url)
+        if len(targets) == 1:
+            url = targets.pop()
+            continue
+        if targets or "location" in html.lower():
+            return None # 多个候选目标，或页面里有无法静态判断的跳转脚本
+        if url_host(final_url) == host_a:
+            return None # 仍停留在 域名 A，可能需要执行 JS
+        return final_url
+    return None
+# --- ⬆️ 新增 ⬆️ ---
+
+async def resolve_domain_b(api_url: str, bot: str = "", coalesce: bool = True) -> str:
+    """完整执行一次解析链，返回未修改的 域名 B (coalesce=False 时不与同一 域名 A 的其他导航合并)"""
+    # --- 步骤 1: [HTTPX] 访问 API 获取 域名 A ---
+    logger.info(f"步骤 1: (HTTPX) 正在从 API [{api_url}] 获取 域名 A...")
+    started = time.perf_counter()
+    response_api = await http_get(api_url, headers=API_REQUEST_HEADERS)
+    LINK_STAGE_SECONDS.observe(time.perf_counter() - started, (bot, "api_fetch"))
+    response_api.raise_for_status() 
+
+    api_data = response_api.json() 
+    
+    if api_data.get("code") != 0 or "data" not in api_data or not api_data["data"]:
+        logger.error(f"API 返回了错误或无效的数据: {api_data}")
+        raise LinkResolveError("API 未返回有效链接")
+
+    domain_a = api_data["data"].strip() 
+
+    if not domain_a.startswith(('http://', 'https://')):
+        domain_a = 'http://' + domain_a
+        
+    logger.info(f"步骤 1 成功: 获取到 域名 A -> {domain_a}") 
+
+    # --- 步骤 2: 访问 域名 A 获取 域名 B (相同 域名 A 的并发导航合并为一次) ---
+    if not coalesce:
+        return await resolve_domain_a_target(domain_a, bot)
+    return await NAVIGATION_FLIGHTS.do(domain_a, lambda: resolve_domain_a_target(domain_a, bot))
+
+async def resolve_domain_a_target(domain_a: str, bot: str = "") -> str:
+    """访问 域名 A 获取 域名 B (先尝试无浏览器快速解析)"""
+    host_a = url_host(domain_a)
+    host_stats = RESOLVER_HOST_STATS.get(host_a)
+    if host_stats is None:
+        host_stats = RESOLVER_HOST_STATS[host_a] = HostResolveStats()
+
+    if FAST_RESOLVE_ENABLED and host_stats.try_http():
+        started = time.perf_counter()
+        domain_b = None
+        try:
+            domain_b = await asyncio.wait_for(fast_resolve_redirect(domain_a), timeout=FAST_RESOLVE_BUDGET)
+        except asyncio.TimeoutError:
+            logger.warning(f"步骤 2: (HTTP 快速解析) {host_a} 超过 {FAST_RESOLVE_BUDGET:.0f} 秒，转交 Playwright")
+        except Exception as e:
+            logger.warning(f"步骤 2: (HTTP 快速解析) {host_a} 失败，转交 Playwright: {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        LINK_STAGE_SECONDS.observe(elapsed_ms / 1000, (bot, "fast_resolve"))
+        if domain_b:
+            host_stats.record_http(elapsed_ms)
+            logger.info(f"步骤 2 成功: (HTTP 快速解析, {elapsed_ms:.0f}ms) 获取到 域名 B (完整): {domain_b}")
+            return domain_b
+        host_stats.record_escalation(elapsed_ms)
+
+    # --- [Playwright] 兜底 (BROWSER_STARTUP=lazy 时在这里首次启动浏览器) ---
+    if not browser_ready() and not await start_browser():
+        raise LinkResolveError("浏览器未启动")
+    logger.info(f"步骤 2: (Playwright) 正在从页面池租借页面访问 {domain_a}...")
+    
+    started = time.perf_counter()
+    early_exit = False
+    async with PAGE_POOL.lease() as page:
+        if host_a in BROWSER_NETWORKIDLE_HOSTS:
+            await page.goto(domain_a, wait_until="networkidle") 
+            domain_b = page.url 
+        else:
+            domain_b, early_exit = await navigate_until_settled(page, domain_a, host_a)
+    elapsed = time.perf_counter() - started
+    LINK_STAGE_SECONDS.observe(elapsed, (bot, "page_goto"))
+    host_stats.record_browser(elapsed * 1000, early_exit)
+    logger.info(f"步骤 2 成功: ({'提前返回' if early_exit else '等待页面加载'}, {elapsed * 1000:.0f}ms) 获取到 域名 B (完整): {domain_b}")
+    return domain_b
+
+async def navigate_until_settled(page: "Page", domain_a: str, host_a: str) -> Tuple[str, bool]:
+    """
+    只为拿到最终 URL 的导航：不等待 networkidle。
+    页面到达非 域名 A 的主机后，BROWSER_SETTLE_MS 内没有新的主框架导航就立即返回 (early_exit=True)；
+    一直停留在 域名 A 时，退回到原来的行为：等到 networkidle 再读取 page.url。
+    """
+    loop = asyncio.get_running_loop()
+    navigated = asyncio.Event()
+
+    def on_navigated(frame) -> None:
+        if frame == page.main_frame:
+            navigated.set()
+
+    page.on("framenavigated", on_navigated)
+    goto = asyncio.ensure_future(page.goto(domain_a, wait_until="commit"))
+    idle = None
+    deadline = loop.time() + BROWSER_PAGE_TIMEOUT_MS / 1000
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise LinkResolveError(f"目标网页加载超时（超过 {BROWSER_PAGE_TIMEOUT_MS // 1000} 秒）")
+            if goto.done():
+                goto.result() # (导航本身失败时在这里抛出)
+                if idle is None:
+                    idle = asyncio.ensure_future(page.wait_for_load_state("networkidle"))
+                host = url_host(page.url)
+                if host and host != host_a:
+                    # 已离开 域名 A：稳定窗口内没有再次跳转，就是最终 URL
+                    navigated.clear()
+                    try:
+                        await asyncio.wait_for(navigated.wait(), timeout=min(BROWSER_SETTLE_MS / 1000, remaining))
+                    except asyncio.TimeoutError:
+                        return page.url, True
+                    continue
+                if idle.done():
+                    idle.result()
+                    return page.url, False
+            navigated.clear()
+            nav_wait = asyncio.ensure_future(navigated.wait())
+            await asyncio.wait({nav_wait, idle or goto}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            nav_wait.cancel()
+    finally:
+        page.remove_listener("framenavigated", on_navigated)
+        for task in (goto, idle):
+            if task is not None and not task.done():
+                task.cancel()
+                task.add_done_callback(lambda t: t.cancelled() or t.exception()) # (页面归还时会跳到 about:blank，忽略被打断的导航)
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：域名 B 解析缓存 (TTL + stale-while-revalidate) ⬇️ ---
+LINK_CACHE_TTL = _env_float("LINK_CACHE_TTL", 300.0) # 新鲜期 (秒)，0 表示关闭缓存
+LINK_CACHE_STALE_TTL = _env_float("LINK_CACHE_STALE_TTL", 600.0) # 过期后仍可返回旧值并后台刷新的时长 (秒)
+LINK_CACHE_REFRESH_AHEAD = _env_float("LINK_CACHE_REFRESH_AHEAD", 60.0) # 距离过期不足 N 秒的条目会被后台提前刷新
+
+BACKGROUND_TASKS: set = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """启动后台任务并保留引用，防止任务被垃圾回收"""
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+class CachedLink:
+    __slots__ = ("domain_b", "resolved_at", "last_hit")
+
+    def __init__(self, domain_b: str, resolved_at: float):
+        self.domain_b = domain_b
+        self.resolved_at = resolved_at
+        self.last_hit = resolved_at
+
+class LinkResolutionCache:
+    """按 webhook 路径缓存已解析的 域名 B"""
+
+    def __init__(self, ttl: float, stale_ttl: float, refresh_ahead: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self._entries: Dict[str, CachedLink] = {}
+        self._refreshing: set = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _local(self, webhook_path: str) -> tuple[str | None, bool] | None:
+        """本进程的条目：返回 (域名 B, 是否需要后台刷新)；不存在或已完全过期时返回 None (不计为未命中)"""
+        entry = self._entries.get(webhook_path)
+        now = asyncio.get_running_loop().time()
+        if entry is None or now - entry.resolved_at >= self.ttl + self.stale_ttl:
+            return None
+        entry.last_hit = now
+        if now - entry.resolved_at < self.ttl:
+            self.hits += 1
+            return entry.domain_b, False
+        self.stale_hits += 1
+        return entry.domain_b, True
+
+    def get(self, webhook_path: str) -> tuple[str | None, bool]:
+        """只查本进程：返回 (域名 B 或 None, 是否需要后台刷新)"""
+        local = self._local(webhook_path)
+        if local is None:
+            self.misses += 1
+            return None, False
+        return local
+
+    def set(self, webhook_path: str, domain_b: str) -> None:
+        self._entries[webhook_path] = CachedLink(domain_b, asyncio.get_running_loop().time())
+        if STATE.shared:
+            value = {"domain_b": domain_b, "resolved_at": time.time()}
+            spawn_background(STATE.set(f"linkcache:{webhook_path}", value, ttl=self.ttl + self.stale_ttl))
+
+    async def lookup(self, webhook_path: str) -> tuple[str | None, bool]:
+        """先查本进程，未命中时再查共享后端 (其他 worker 解析过的结果)；两处都没有才计为未命中"""
+        local = self._local(webhook_path)
+        if local is not None:
+            return local
+        if STATE.shared:
+            shared = await STATE.get(f"linkcache:{webhook_path}")
+            if shared:
+                age = time.time() - shared["resolved_at"]
+                if age < self.ttl + self.stale_ttl:
+                    entry = CachedLink(shared["domain_b"], asyncio.get_running_loop().time() - age)
+                    entry.last_hit = asyncio.get_running_loop().time()
+                    self._entries[webhook_path] = entry
+                    self.shared_hits += 1
+                    return shared["domain_b"], age >= self.ttl
+        self.misses += 1
+        return None, False
+
+    def revalidate(self, webhook_path: str, api_url: str) -> None:
+        """后台刷新某个路径 (同一路径同时只刷新一次)"""
+        if webhook_path in self._refreshing or RESOLVE_FLIGHTS.in_flight(webhook_path):
+            return
+        self._refreshing.add(webhook_path)
+        spawn_background(self._refresh(webhook_path, api_url))
+
+    async def _refresh(self, webhook_path: str, api_url: str) -> None:
+        try:
+            await resolve_for_path(webhook_path, api_url)
+            self.refreshes += 1
+            logger.info(f"解析缓存：已后台刷新 (路径: {webhook_path})")
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"解析缓存：后台刷新失败 (路径: {webhook_path}): {e}")
+        finally:
+            self._refreshing.discard(webhook_path)
+
+    async def run_refresher(self) -> None:
+        """定期提前刷新即将过期、且最近仍被使用的条目；清除完全过期的条目"""
+        interval = max(5.0, min(self.ttl / 4, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            now = asyncio.get_running_loop().time()
+            for path, entry in list(self._entries.items()):
+                age = now - entry.resolved_at
+                if age >= self.ttl + self.stale_ttl:
+                    del self._entries[path]
+                elif age >= self.ttl - self.refresh_ahead and entry.last_hit > entry.resolved_at:
+                    config = BOT_CONFIGS.get(path)
+                    if config and config.api_url:
+                        self.revalidate(path, config.api_url)
+
+    def stats(self) -> Dict[str, Any]:
+        now = asyncio.get_running_loop().time()
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "background_refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "entries_age_seconds": {path: round(now - e.resolved_at, 1) for path, e in self._entries.items()},
+        }
+
+LINK_CACHE = LinkResolutionCache(LINK_CACHE_TTL, LINK_CACHE_STALE_TTL, LINK_CACHE_REFRESH_AHEAD)
+
+async def resolve_for_path(webhook_path: str, api_url: str) -> str:
+    """
+    为某个 Bot 解析 域名 B 并写入缓存。
+    同一路径的并发请求只会执行一次解析，超时/错误会一致地传给所有等待者。
+    """
+    async def _resolve() -> str:
+        domain_b = await asyncio.wait_for(resolve_domain_b(api_url, webhook_path), timeout=LINK_RESOLVE_TIMEOUT)
+        if LINK_CACHE.enabled:
+            LINK_CACHE.set(webhook_path, domain_b)
+        return domain_b
+    return await RESOLVE_FLIGHTS.do(webhook_path, _resolve)
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：预先解析好的 域名 B 库存 (后台补货，用户取用时无需等待解析) ⬇️ ---
+LINK_INVENTORY_SIZE = _env_int("LINK_INVENTORY_SIZE", 0) # 每个 Bot 预先解析的 域名 B 数量，0 表示关闭
+LINK_INVENTORY_LOW_WATER = _env_int("LINK_INVENTORY_LOW_WATER", max(1, LINK_INVENTORY_SIZE // 2)) # 库存低于该值时开始补货 (补满为止)
+LINK_INVENTORY_TTL = _env_float("LINK_INVENTORY_TTL", 600.0) # 解析后超过 N 秒仍未被取用的条目会被丢弃
+LINK_INVENTORY_IDLE_STOP = _env_float("LINK_INVENTORY_IDLE_STOP", 1800.0) # 超过 N 秒无人取用时停止补货 (下次取用时重新开始)
+LINK_INVENTORY_REFILL_INTERVAL = _env_float("LINK_INVENTORY_REFILL_INTERVAL", 0.0) # 两次补货解析之间的最小间隔 (秒)，用于限制对 API 的请求速率
+
+INVENTORY_EVENTS = register_metric(Counter("tgbot_link_inventory_total", "链接库存事件 (served / miss / expired / refilled / refill_failed)", ("bot", "result")))
+INVENTORY_AGE = register_metric(Histogram("tgbot_link_inventory_age_seconds", "从库存取出的 域名 B 距解析完成的时间", ("bot",), (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)))
+
+class InventoryShelf:
+    """某个 Bot 的库存：(域名 B, 解析完成时间) 的队列 + 补货任务"""
+
+    def __init__(self, now: float):
+        self.items: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.producer: asyncio.Task | None = None
+        self.last_take = now
+        self.served = 0
+        self.misses = 0
+        self.expired = 0
+        self.refilled = 0
+        self.refill_failures = 0
+        self.served_age_total = 0.0
+        self.refill_times: deque = deque(maxlen=256)
+
+class LinkInventory:
+    """
+    每个 Bot 一个有界队列，保存后台预先解析好的 域名 B。
+    取用时直接出队 (最早解析的先出)；低于低水位时唤醒补货任务补满；超过 TTL 的条目直接丢弃。
+    库存为空时由调用方回退到缓存/实时解析。
+    """
+
+    def __init__(self, capacity: int, low_water: int, ttl: float, idle_stop: float, refill_interval: float):
+        self.capacity = max(0, capacity)
+        self.low_water = min(max(1, low_water), self.capacity) if self.capacity else 0
+        self.ttl = ttl
+        self.idle_stop = idle_stop
+        self.refill_interval = refill_interval
+        self._shelves: Dict[str, InventoryShelf] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _shelf(self, webhook_path: str) -> InventoryShelf:
+        shelf = self._shelves.get(webhook_path)
+        if shelf is None:
+            shelf = self._shelves[webhook_path] = InventoryShelf(asyncio.get_running_loop().time())
+        return shelf
+
+    def _expire(self, webhook_path: str, shelf: InventoryShelf, now: float) -> None:
+        while shelf.items and now - shelf.items[0][1] >= self.ttl:
+            shelf.items.popleft()
+            shelf.expired += 1
+            INVENTORY_EVENTS.inc((webhook_path, "expired"))
+
+    def ensure_producer(self, webhook_path: str) -> None:
+        """该 Bot 的补货任务未运行时启动它"""
+        shelf = self._shelf(webhook_path)
+        if shelf.producer is None and not SHUTTING_DOWN:
+            shelf.producer = spawn_background(self._produce(webhook_path, shelf))
+
+    def take(self, webhook_path: str) -> str | None:
+        """取出一个未过期的 域名 B；库存为空时返回 None (并唤醒补货任务)"""
+        shelf = self._shelf(webhook_path)
+        now = asyncio.get_running_loop().time()
+        shelf.last_take = now
+        self.ensure_producer(webhook_path)
+        self._expire(webhook_path, shelf, now)
+        if not shelf.items:
+            shelf.misses += 1
+            INVENTORY_EVENTS.inc((webhook_path, "miss"))
+            shelf.wakeup.set()
+            return None
+        domain_b, resolved_at = shelf.items.popleft()
+        shelf.served += 1
+        shelf.served_age_total += now - resolved_at
+        INVENTORY_EVENTS.inc((webhook_path, "served"))
+        INVENTORY_AGE.observe(now - resolved_at, (webhook_path,))
+        if len(shelf.items) < self.low_water:
+            shelf.wakeup.set()
+        return domain_b
+
+    @staticmethod
+    async def _resolve_one(api_url: str, webhook_path: str) -> str:
+        """
+        一次独立的解析：不经过 RESOLVE_FLIGHTS / NAVIGATION_FLIGHTS (不会与用户请求共享结果，库存中不会出现重复条目)，
+        但计入 LinkAdmission 的全局实时解析并发。
+        """
+        LINK_ADMISSION.background_in_flight += 1
+        try:
+            return await asyncio.wait_for(resolve_domain_b(api_url, webhook_path, coalesce=False), timeout=LINK_RESOLVE_TIMEOUT)
+        finally:
+            LINK_ADMISSION.background_in_flight -= 1
+
+    async def _produce(self, webhook_path: str, shelf: InventoryShelf) -> None:
+        loop = asyncio.get_running_loop()
+        backoff = 1.0
+        logger.info(f"链接库存：开始为 {webhook_path} 补货 (容量 {self.capacity}, 低水位 {self.low_water})")
+        try:
+            while not SHUTTING_DOWN:
+                now = loop.time()
+                if now - shelf.last_take > self.idle_stop:
+                    logger.info(f"链接库存：{webhook_path} 已 {self.idle_stop:.0f}s 无人取用，停止补货")
+                    return
+                self._expire(webhook_path, shelf, now)
+                if len(shelf.items) < self.low_water:
+                    config = BOT_CONFIGS.get(webhook_path)
+                    if config is None or not config.api_url:
+                        return
+                    while len(shelf.items) < self.capacity and not SHUTTING_DOWN:
+                        if not LINK_ADMISSION.background_allowed():
+                            await asyncio.sleep(1.0) # (实时解析已接近并发上限：让给用户请求)
+                            continue
+                        try:
+                            domain_b = await self._resolve_one(config.api_url, webhook_path)
+                        except Exception as e:
+                            shelf.refill_failures += 1
+                            INVENTORY_EVENTS.inc((webhook_path, "refill_failed"))
+                            logger.warning(f"链接库存：{webhook_path} 补货失败 ({type(e).__name__}: {e})，{backoff:.0f}s 后重试")
+                            await asyncio.sleep(backoff)
+                            backoff = min(backoff * 2, 60.0)
+                            break
+                        backoff = 1.0
+                        resolved_at = loop.time()
+                        shelf.items.append((domain_b, resolved_at))
+                        shelf.refilled += 1
+                        shelf.refill_times.append(resolved_at)
+                        INVENTORY_EVENTS.inc((webhook_path, "refilled"))
+                        if self.refill_interval > 0:
+                            await asyncio.sleep(self.refill_interval)
+                    continue
+                # 库存充足：等待被取用 (低于低水位) 或最早的条目过期
+                shelf.wakeup.clear()
+                timeout = self.ttl - (loop.time() - shelf.items[0][1]) if shelf.items else self.idle_stop
+                try:
+                    await asyncio.wait_for(shelf.wakeup.wait(), timeout=max(0.1, timeout))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            shelf.producer = None
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        now = asyncio.get_running_loop().time()
+        by_bot = {}
+        for path, shelf in self._shelves.items():
+            recent = [t for t in shelf.refill_times if now - t <= 600]
+            by_bot[path] = {
+                "depth": len(shelf.items),
+                "refilling": shelf.producer is not None,
+                "oldest_age_seconds": round(now - shelf.items[0][1], 1) if shelf.items else None,
+                "served": shelf.served,
+                "misses": shelf.misses,
+                "expired": shelf.expired,
+                "refilled": shelf.refilled,
+                "refill_failures": shelf.refill_failures,
+                "refills_per_minute": round(len(recent) / 10, 2),
+                "avg_served_age_seconds": round(shelf.served_age_total / shelf.served, 1) if shelf.served else None,
+            }
+        return {
+            "enabled": True,
+            "capacity": self.capacity,
+            "low_water": self.low_water,
+            "ttl_seconds": self.ttl,
+            "idle_stop_seconds": self.idle_stop,
+            "refill_interval_seconds": self.refill_interval,
+            "by_bot": by_bot,
+        }
+
+    def depths(self) -> List[Tuple[Tuple[str], int]]:
+        return [((path,), len(shelf.items)) for path, shelf in self._shelves.items()]
+
+LINK_INVENTORY = LinkInventory(LINK_INVENTORY_SIZE, LINK_INVENTORY_LOW_WATER, LINK_INVENTORY_TTL, LINK_INVENTORY_IDLE_STOP, LINK_INVENTORY_REFILL_INTERVAL)
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：[通用链接] 准入控制 (令牌桶限流 + 全局并发上限，防止关键字刷屏拖垮浏览器) ⬇️ ---
+LINK_CHAT_RATE = _env_float("LINK_CHAT_RATE", 30.0) # 每个 Chat 每分钟新开始的 [通用链接] 实时解析数 (库存/缓存命中不计)，0 表示不限制 (可用 BOT_n_CHAT_RATE 单独设置)
+LINK_CHAT_BURST = _env_int("LINK_CHAT_BURST", 10) # 每个 Chat 允许的突发请求数 (BOT_n_CHAT_BURST)
+LINK_BOT_RATE = _env_float("LINK_BOT_RATE", 120.0) # 每个 Bot 每分钟新开始的 [通用链接] 实时解析数，0 表示不限制 (BOT_n_RATE)
+LINK_BOT_BURST = _env_int("LINK_BOT_BURST", 30) # 每个 Bot 允许的突发请求数 (BOT_n_BURST)
+LINK_MAX_IN_FLIGHT = _env_int("LINK_MAX_IN_FLIGHT", BROWSER_POOL_SIZE * 2) # 所有 Bot 同时进行的实时解析上限，0 表示不限制
+LINK_BUSY_NOTICE_INTERVAL = _env_float("LINK_BUSY_NOTICE_INTERVAL", 10.0) # 同一个 Chat 在 N 秒内最多收到一次 "已在处理中" 提示
+
+LINK_THROTTLED = register_metric(Counter("tgbot_link_throttled_total", "被拒绝的 [通用链接] 请求 (user_in_flight / chat_rate / bot_rate / global_in_flight)", ("bot", "reason")))
+
+class LinkAdmission:
+    """
+    [通用链接] 请求的准入控制：
+    - 同一个用户在同一个 Chat 的上一个请求还没完成时，不再开始新的解析 (admit，在库存/缓存查找之前)；
+    - 需要新的实时解析时 (admit_resolution)：按 (Bot, Chat) 和按 Bot 的令牌桶限速，
+      且同时进行的实时解析不超过 LINK_MAX_IN_FLIGHT。库存/缓存命中和加入已有解析的请求不消耗令牌。
+    被拒绝的请求只会收到一条 (合并的) "已在处理中" 提示，不会产生新的浏览器工作。
+    """
+
+    PRUNE_EVERY = 1024
+
+    def __init__(self, max_in_flight: int, notice_interval: float):
+        self.max_in_flight = max_in_flight
+        self.notice_interval = notice_interval
+        self._chat_buckets: Dict[Tuple[str, int], "TokenBucket"] = {} # (TokenBucket 与定时广播共用，见下文)
+        self._bot_buckets: Dict[str, "TokenBucket"] = {}
+        self._pending: set = set() # (Bot, Chat, 用户) 正在处理中的请求
+        self._last_notice: Dict[Tuple[str, int], float] = {}
+        self._admits = 0
+        self.background_in_flight = 0 # 库存补货中的解析 (不经过 RESOLVE_FLIGHTS)
+        self.admitted = 0
+        self.resolutions_admitted = 0
+        self.throttled: Dict[str, int] = {}
+
+    @staticmethod
+    def _bucket(buckets: Dict[Any, "TokenBucket"], key: Any, limit: RateLimit) -> "TokenBucket":
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(limit.per_minute / 60.0, max(1, limit.burst))
+        return bucket
+
+    def _prune(self) -> None:
+        """丢弃已经补满的令牌桶 (与新建的桶等价)，避免 Chat 数量无限增长"""
+        now = asyncio.get_running_loop().time()
+        for key, bucket in list(self._chat_buckets.items()):
+            if bucket.is_full():
+                del self._chat_buckets[key]
+        for key, sent_at in list(self._last_notice.items()):
+            if now - sent_at >= self.notice_interval:
+                del self._last_notice[key]
+
+    def admit(self, config: BotConfig, chat_id: int, user_id: int | None) -> str | None:
+        """返回拒绝原因；返回 None 表示放行 (之后必须调用 finish)。只拦截同一用户未完成的重复请求"""
+        path = config.webhook_path
+        self._admits += 1
+        if self._admits % self.PRUNE_EVERY == 0:
+            self._prune()
+        if (path, chat_id, user_id) in self._pending:
+            return self._reject(path, "user_in_flight")
+        self._pending.add((path, chat_id, user_id))
+        self.admitted += 1
+        return None
+
+    def finish(self, config: BotConfig, chat_id: int, user_id: int | None) -> None:
+        self._pending.discard((config.webhook_path, chat_id, user_id))
+
+    def in_flight(self) -> int:
+        """正在进行的实时解析数 (用户请求 + 库存补货)"""
+        return len(RESOLVE_FLIGHTS) + self.background_in_flight
+
+    def admit_resolution(self, config: BotConfig, chat_id: int) -> str | None:
+        """
+        库存/缓存都未命中、需要实时解析时调用：加入已有解析不受限制；
+        新的解析先检查全局并发上限，再扣除 Chat / Bot 令牌。
+        """
+        path = config.webhook_path
+        if RESOLVE_FLIGHTS.in_flight(path):
+            return None
+        if self.max_in_flight > 0 and self.in_flight() >= self.max_in_flight:
+            return self._reject(path, "global_in_flight")
+        chat_bucket = self._bucket(self._chat_buckets, (path, chat_id), config.chat_limit) if config.chat_limit.enabled else None
+        if chat_bucket is not None and not chat_bucket.try_acquire():
+            return self._reject(path, "chat_rate")
+        if config.bot_limit.enabled and not self._bucket(self._bot_buckets, path, config.bot_limit).try_acquire():
+            if chat_bucket is not None:
+                chat_bucket.tokens += 1 # (退还：被 Bot 级限流拒绝的请求不占用 Chat 的额度)
+            return self._reject(path, "bot_rate")
+        self.resolutions_admitted += 1
+        return None
+
+    def background_allowed(self) -> bool:
+        """库存补货最多占用全局上限的一半，并且尽量给用户请求留一个名额 (上限为 1 时只在空闲时补货)"""
+        if self.max_in_flight <= 0:
+            return True
+        return self.background_in_flight < max(1, self.max_in_flight // 2) and self.in_flight() < max(1, self.max_in_flight - 1)
+
+    def _reject(self, webhook_path: str, reason: str) -> str:
+        self.throttled[reason] = self.throttled.get(reason, 0) + 1
+        LINK_THROTTLED.inc((webhook_path, reason))
+        return reason
+
+    def should_notify(self, webhook_path: str, chat_id: int) -> bool:
+        """同一个 Chat 的 "已在处理中" 提示合并为 notice_interval 内一条"""
+        now = asyncio.get_running_loop().time()
+        last = self._last_notice.get((webhook_path, chat_id))
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self._last_notice[(webhook_path, chat_id)] = now
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "resolutions_in_flight": len(RESOLVE_FLIGHTS),
+            "inventory_resolutions_in_flight": self.background_in_flight,
+            "requests_in_flight": len(self._pending),
+            "admitted": self.admitted,
+            "resolutions_admitted": self.resolutions_admitted,
+            "throttled": dict(self.throttled),
+            "tracked_chats": len(self._chat_buckets),
+        }
+
+LINK_ADMISSION = LinkAdmission(LINK_MAX_IN_FLIGHT, LINK_BUSY_NOTICE_INTERVAL)
+
+async def reply_link_busy(update: Update, webhook_path: str, reason: str) -> None:
+    """被限流时的廉价回复 (同一个 Chat 短时间内只回复一次，其余直接忽略)"""
+    logger.info(f"[通用链接] 请求被限流 (路径: {webhook_path}, Chat: {update.message.chat_id}, 原因: {reason})")
+    if not LINK_ADMISSION.should_notify(webhook_path, update.message.chat_id):
+        return
+    try:
+        await update.message.reply_text("⏳ 已在处理中，请稍候，无需重复发送。")
+    except Exception as e:
+        record_telegram_error(webhook_path, e)
+        logger.warning(f"发送“已在处理中”消息失败: {e}")
+# --- ⬆️ 新增 ⬆️ ---
+
 # --- 核心处理器 1 (Playwright - 通用链接) ---
 async def get_universal_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ (需求 1) - Playwright 动态链接 """
@@ -130,68 +1784,56 @@ async def get_universal_link(update: Update, context: ContextTypes.DEFAULT_TYPE)
     bot_token_end = context.application.bot.token[-4:]
     logger.info(f"Bot {bot_token_end} 收到 [通用链接] 关键字，开始执行 [Playwright] 链接获取...")
 
-    # 1. 检查浏览器
-    fastapi_app = context.bot_data.get("fastapi_app")
-    if not fastapi_app or not hasattr(fastapi_app.state, 'browser') or not fastapi_app.state.browser or not fastapi_app.state.browser.is_connected():
-        logger.error("全局浏览器实例未运行或未连接！Playwright 无法工作。")
-        await update.message.reply_text("❌ 服务内部错误：浏览器未启动。")
-        return
-
-    # 2. 查找此 Bot 专属的 API URL
-    current_app = context.application
-    api_url_for_this_bot = None
-    for path, app_instance in BOT_APPLICATIONS.items():
-        if app_instance is current_app:
-            api_url_for_this_bot = BOT_API_URLS.get(path)
-            break
+    # 1. 查找此 Bot 专属的 API URL
+    config = get_bot_config(context)
+    api_url_for_this_bot = config.api_url if config else None
+    webhook_path = config.webhook_path if config else None
     
     if not api_url_for_this_bot:
         logger.error(f"Bot (尾号: {bot_token_end}) 无法找到其配置的 API URL！")
         await update.message.reply_text("❌ 服务配置错误：未找到此 Bot 的 API 地址。")
         return
 
-    # 3. 发送“处理中”提示 (您修改后的)
-    try:
-        await update.message.reply_text("正在为您获取专属通用下载链接，请稍候 ...")
-    except Exception as e:
-        logger.warning(f"发送“处理中”消息失败: {e}")
+    # --- ⬇️ 新增：准入控制 ⬇️ ---
+    chat_id = update.message.chat_id
+    user_id = update.message.from_user.id if update.message.from_user else None
+    reject_reason = LINK_ADMISSION.admit(config, chat_id, user_id)
+    if reject_reason is not None:
+        await reply_link_busy(update, webhook_path, reject_reason)
+        return
+    # --- ⬆️ 新增 ⬆️ ---
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    page = None 
-    
     try:
-        # --- 步骤 1: [Requests] 访问 API 获取 域名 A ---
-        logger.info(f"步骤 1: (Requests) 正在从 API [{api_url_for_this_bot}] 获取 域名 A...")
-        response_api = requests.get(api_url_for_this_bot, headers=headers, timeout=10)
-        response_api.raise_for_status() 
-
-        api_data = response_api.json() 
-        
-        if api_data.get("code") != 0 or "data" not in api_data or not api_data["data"]:
-            logger.error(f"API 返回了错误或无效的数据: {api_data}")
-            await update.message.reply_text("❌ 链接获取失败：API 未返回有效链接。")
-            return
-
-        domain_a = api_data["data"].strip() 
-
-        if not domain_a.startswith(('http://', 'https://')):
-            domain_a = 'http://' + domain_a
-            
-        logger.info(f"步骤 1 成功: 获取到 域名 A -> {domain_a}") 
-
-        # --- 步骤 2: [Playwright] 访问 域名 A 获取 域名 B ---
-        logger.info(f"步骤 2: (Playwright) 正在启动新页面访问 {domain_a}...")
-        
-        page = await fastapi_app.state.browser.new_page()
-        page.set_default_timeout(40000) # 40 秒超时
-
-        await page.goto(domain_a, wait_until="networkidle") 
-        
-        domain_b = page.url 
-        logger.info(f"步骤 2 成功: 获取到 域名 B (完整): {domain_b}")
+        # 2. 优先使用库存中预先解析好的 域名 B
+        domain_b = None
+        if LINK_INVENTORY.enabled:
+            domain_b = LINK_INVENTORY.take(webhook_path)
+            if domain_b:
+                logger.info(f"步骤 1-2 命中库存: 域名 B -> {domain_b}")
+
+        # 2b. 其次使用缓存的 域名 B (过期但仍在 stale 窗口内时，先返回旧值并后台刷新)
+        if not domain_b and LINK_CACHE.enabled:
+            domain_b, needs_refresh = await LINK_CACHE.lookup(webhook_path)
+            if needs_refresh:
+                LINK_CACHE.revalidate(webhook_path, api_url_for_this_bot)
+            if domain_b:
+                logger.info(f"步骤 1-2 命中缓存: 域名 B -> {domain_b}")
+
+        if not domain_b:
+            reject_reason = LINK_ADMISSION.admit_resolution(config, chat_id)
+            if reject_reason is not None:
+                await reply_link_busy(update, webhook_path, reject_reason)
+                return
+
+            # 3. 发送“处理中”提示 (您修改后的)
+            # (浏览器只在 HTTP 快速解析失败时才需要，届时按需启动，见 resolve_domain_a_target)
+            try:
+                await update.message.reply_text("正在为您获取专属通用下载链接，请稍候 ...")
+            except Exception as e:
+                record_telegram_error(webhook_path, e)
+                logger.warning(f"发送“处理中”消息失败: {e}")
+
+            domain_b = await resolve_for_path(webhook_path, api_url_for_this_bot)
 
         # --- 步骤 3: 修改 域名 B 的二级域名 (您修改后的 4-7位) ---
         logger.info(f"步骤 3: 正在为 {domain_b} 生成 4-7 位随机二级域名...")
@@ -200,18 +1842,28 @@ async def get_universal_link(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.info(f"步骤 3 成功: 最终 URL -> {final_modified_url}")
 
         # --- 步骤 4: 发送最终 URL (您修改后的) ---
+        started = time.perf_counter()
         await update.message.reply_text(f"✅ 您的专属通用下载链接已生成：\n{final_modified_url}")
-
+        LINK_STAGE_SECONDS.observe(time.perf_counter() - started, (webhook_path, "reply_send"))
+
+    except LinkResolveError as e:
+        logger.error(f"处理 get_universal_link (Playwright) 时解析失败: {e}")
+        await update.message.reply_text(f"❌ 链接获取失败：{e}。")
+    except asyncio.TimeoutError:
+        logger.error(f"处理 get_universal_link (Playwright) 时整体解析超时 ({LINK_RESOLVE_TIMEOUT} 秒)")
+        await update.message.reply_text(f"❌ 链接获取失败：处理超时（超过 {LINK_RESOLVE_TIMEOUT:.0f} 秒）。")
+    except BrowserPoolTimeout as e:
+        logger.error(f"处理 get_universal_link (Playwright) 时页面池繁忙: {e}")
+        await update.message.reply_text("❌ 链接获取失败：当前请求过多，请稍后再试。")
     except Exception as e:
+        record_telegram_error(webhook_path, e)
         logger.error(f"处理 get_universal_link (Playwright) 时发生错误: {e}")
         if "Timeout" in str(e):
             await update.message.reply_text("❌ 链接获取失败：目标网页加载超时（超过 40 秒）。")
         else:
             await update.message.reply_text(f"❌ 链接获取失败：{type(e).__name__}。")
     finally:
-        if page:
-            await page.close() 
-            logger.info("Playwright 页面已关闭。")
+        LINK_ADMISSION.finish(config, chat_id, user_id)
 
 # --- 核心处理器 2 (安卓专用链接) ---
 async def get_android_specific_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -226,12 +1878,8 @@ async def get_android_specific_link(update: Update, context: ContextTypes.DEFAUL
     logger.info(f"Bot {bot_token_end} 收到 [安卓专用] 关键字，开始生成 APK 链接...")
     
     # 1. 查找此 Bot 专属的 APK URL 模板
-    current_app = context.application
-    apk_template = None
-    for path, app_instance in BOT_APPLICATIONS.items():
-        if app_instance is current_app:
-            apk_template = BOT_APK_URLS.get(path) # 从新字典中查找
-            break
+    config = get_bot_config(context)
+    apk_template = config.apk_template if config else None
             
     if not apk_template:
         logger.error(f"Bot (尾号: {bot_token_end}) 无法找到其配置的 BOT_..._APK_URL！")
@@ -249,143 +1897,193 @@ async def get_android_specific_link(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text(f"✅ 您的专属安卓专用下载链接已生成：\n{final_url}")
         
     except Exception as e:
+        record_handler_error(context, e)
         logger.error(f"处理 get_android_specific_link 时发生错误: {e}")
         await update.message.reply_text(f"❌ 处理安卓链接时发生内部错误。")
 
-# --- (指南 处理器 3, 4, 5, 6, 7, 8) ---
-# ... (所有 6 个指南处理器: send_ios_quit_guide, send_android_quit_guide, 等等... 保持不变)
-# ... (为节省篇幅，我在这里省略了它们，但它们在下面的完整代码中)
+# --- 核心处理器 3 - 8 (静态指南，文本来自内容文件) ---
+@dataclass(frozen=True, slots=True)
+class GuideReply:
+    name: str
+    html: str # 预先校验过的 Telegram HTML
 
-# --- 核心处理器 3 (苹果重启指南) ---
-async def send_ios_quit_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 3 - 静态回复 iOS) """
+async def send_guide(guide: GuideReply, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """ (需求 3 - 8 - 静态回复指南) """
     if not update.message or not is_chat_allowed(context, update.message.chat_id): return
     bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [苹果大退] 关键字，发送 iOS 重启指南...")
-    message = """📱 <b>苹果手机APP大退重新打开步骤</b>
-
-<b>1. 关闭App:</b> 在主屏幕上，从屏幕底部向上轻扫并在中间稍作停留，调出后台多任务界面。
-
-<b>2. 找到并关闭:</b> 向左或向右滑动卡片找到要关闭的App，然后在该App的卡片上向上轻扫。
-
-<b>3. 重新打开:</b> 返回主屏幕，点击该App图标重新打开。"""
-    try:
-        await update.message.reply_html(message)
-    except Exception as e:
-        logger.error(f"发送 [苹果大退] 指南时失败: {e}")
-
-# --- 核心处理器 4 (安卓重启指南) ---
-async def send_android_quit_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 4 - 静态回复 Android) """
-    if not update.message or not is_chat_allowed(context, update.message.chat_id): return
-    bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [安卓大退] 关键字，发送 Android 重启指南...")
-    message = """🤖 <b>安卓手机APP大退重新打开步骤</b>
-
-<b>1. 关闭App:</b>
-   • <b>方法一:</b> 从屏幕底部向上滑动并保持，即可进入后台多任务界面。
-   • <b>方法二:</b> 点击屏幕底部的多任务/最近应用按钮 (通常是<code>□</code>或<code>≡</code>图标)。
-
-<b>2. 找到并关闭:</b> 在后台列表中，向上滑动要关闭的App卡片。
-
-<b>3. 重新打开:</b> 返回主屏幕或应用抽屉，点击该App图标重新打开。"""
-    try:
-        await update.message.reply_html(message)
-    except Exception as e:
-        logger.error(f"发送 [安卓大退] 指南时失败: {e}")
-
-# --- 核心处理器 5 (安卓浏览器指南) ---
-async def send_android_browser_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 5 - 静态回复 Android 浏览器) """
-    if not update.message or not is_chat_allowed(context, update.message.chat_id): return
-    bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [安卓浏览器] 关键字，发送浏览器指南...")
-    message = """🤖 <b>安卓手机浏览器设置为手机版模式步骤</b>
-
-核心操作就是找到并关闭“桌面版”模式。
-
-<b>1. 打开浏览器:</b> 启动您手机自带的浏览器 App (如“华为浏览器”、“小米浏览器”)。
-
-<b>2. 进入菜单:</b> 点击浏览器界面右下角或右上角的三条横线(<code>≡</code>)或三个点图标(<code>⋮</code>)。
-
-<b>3. 关闭“桌面模式”:</b> 在弹出的菜单列表中，找到“桌面版”、“桌面网站”或“电脑版”选项。
-
-<b>4. 取消勾选:</b> 确保该选项<b>没有</b>被勾选 (开关处于关闭状态)。
-
-<b>5. 刷新页面:</b> 页面会自动刷新，恢复为手机版的 UA 标识和显示界面。"""
-    try:
-        await update.message.reply_html(message)
-    except Exception as e:
-        logger.error(f"发送 [安卓浏览器] 指南时失败: {e}")
-
-# --- 核心处理器 6 (苹果浏览器指南) ---
-async def send_ios_browser_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 6 - 静态回复 Apple 浏览器) """
-    if not update.message or not is_chat_allowed(context, update.message.chat_id): return
-    bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [苹果浏览器] 关键字，发送浏览器指南...")
-    message = """📱 <b>苹果手机浏览器设置为手机版移动网站步骤</b>
-
-在苹果设备上，使用 Safari 或其他浏览器时：
-
-<b>1. 打开浏览器:</b> (例如 Safari)。
-
-<b>2. 点击地址栏:</b> 点击屏幕顶部或底部的网址栏。
-
-<b>3. 选择“网站设置”:</b> 在弹出的选项中，找到并点击“网站设置”或“大小” (如果显示 <code>AA</code> 图标)。
-
-<b>4. 查找“请求桌面网站”:</b> 在菜单中，找到“请求桌面网站”选项。
-
-<b>5. 取消勾选/关闭:</b> 确保该选项处于<b>未勾选</b>或<b>关闭</b>状态。
-
-<b>6. 刷新页面:</b> 页面会自动加载手机版界面。"""
+    logger.info(f"Bot {bot_token_end} 收到 [{guide.name}] 关键字，发送指南...")
     try:
-        await update.message.reply_html(message)
+        await update.message.reply_html(guide.html)
     except Exception as e:
-        logger.error(f"发送 [苹果浏览器] 指南时失败: {e}")
-        
-# --- 核心处理器 7 (安卓窗口上限指南) ---
-async def send_android_tab_limit_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 7 - 静态回复 Android 窗口上限) """
-    if not update.message or not is_chat_allowed(context, update.message.chat_id): return
-    bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [安卓窗口上限] 关键字，发送窗口指南...")
-    message = """🤖 <b>安卓/平板浏览器窗口上限解决步骤</b>
+        record_handler_error(context, e)
+        logger.error(f"发送 [{guide.name}] 指南时失败: {e}")
 
-<b>1. 打开浏览器:</b> 启动您使用的浏览器 App (如 Chrome、华为浏览器、小米浏览器等)。
 
-<b>2. 点击标签页图标:</b> 通常在地址栏旁边，会有一个显示数字的小方块图标 (例如 <code>100+</code> 或一个数字)，表示当前打开的标签页数量。
+# --- ⬇️ 新增：Telegram file_id 缓存 (全局图片/视频) ⬇️ ---
+MEDIA_CACHE_FILE = os.getenv("MEDIA_CACHE_FILE", "media_file_ids.json")
+MEDIA_CACHE_CHAT_ID = os.getenv("MEDIA_CACHE_CHAT_ID") # 设置后，启动时会把所有图片/视频预先上传到这个 Chat
+MEDIA_CACHE_SAVE_DELAY = _env_float("MEDIA_CACHE_SAVE_DELAY", 2.0) # 合并 N 秒内的新 file_id 后再写文件
 
-<b>3. 管理标签页:</b> 进入标签页管理界面。
+class MediaFileIdCache:
+    """
+    缓存首次发送成功后 Telegram 返回的 file_id，之后直接复用，不再让 Telegram 重新拉取远程文件。
+    file_id 只对上传它的 Bot 有效，所以按 Bot ID 分开保存；映射持久化到本地 JSON 文件。
+    写入是批量的，在线程中执行：加文件锁后把本进程的变更合并进磁盘上的文件再原子替换，
+    同一台机器上的多个 worker 不会覆盖彼此的 file_id (合并后也会读到其他 worker 的 file_id)。
+    """
 
-<b>4. 批量关闭:</b> 寻找“关闭所有标签页”或类似的选项。多数浏览器在右上角或菜单中提供此功能。
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Dict[str, Dict[str, str]] = {} # bot_id -> {"photo|url": file_id}
+        self._pending: Dict[Tuple[str, str], str | None] = {} # 尚未写入文件的变更 (None 表示删除)
+        self._flush_task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
 
-<b>5. 或手动关闭:</b> 您也可以通过向上滑动或点击每个标签页的“x”按钮逐个关闭。"""
-    try:
-        await update.message.reply_html(message)
-    except Exception as e:
-        logger.error(f"发送 [安卓窗口上限] 指南时失败: {e}")
+    @staticmethod
+    def _key(kind: str, url: str) -> str:
+        return f"{kind}|{url}"
 
-# --- 核心处理器 8 (苹果窗口上限指南) ---
-async def send_ios_tab_limit_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """ (需求 8 - 静态回复 Apple 窗口上限) """
-    if not update.message or not is_chat_allowed(context, update.message.chat_id): return
-    bot_token_end = context.application.bot.token[-4:]
-    logger.info(f"Bot {bot_token_end} 收到 [苹果窗口上限] 关键字，发送窗口指南...")
-    message = """📱 <b>苹果/平板浏览器窗口上限解决步骤</b>
+    def _read_file(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
 
-<b>1. 打开 Safari 浏览器。</b>
+    def load(self) -> None:
+        try:
+            self._data = self._read_file()
+            if self._data:
+                logger.info(f"媒体缓存：已从 {self.path} 加载 {sum(len(v) for v in self._data.values())} 个 file_id。")
+        except Exception as e:
+            logger.warning(f"媒体缓存：读取 {self.path} 失败，将重新上传: {e}")
+            self._data = {}
 
-<b>2. 点击标签页图标:</b> 在屏幕底部 (iPhone 横屏或 iPad) 或右下角 (iPhone 竖屏底部) 找到两个重叠方块的图标。
+    def _merge_into_file(self, pending: Dict[Tuple[str, str], str | None]) -> Dict[str, Dict[str, str]] | None:
+        """(在线程中执行) 加锁读取磁盘上的最新内容，应用本进程的变更后原子替换；返回合并后的内容"""
+        try:
+            with open(f"{self.path}.lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX) # (文件关闭时自动释放)
+                try:
+                    data = self._read_file()
+                except ValueError: # (文件损坏：以本进程的内容为准重新写入)
+                    data = {}
+                for (bot_id, key), file_id in pending.items():
+                    if file_id is None:
+                        data.get(bot_id, {}).pop(key, None)
+                    else:
+                        data.setdefault(bot_id, {})[key] = file_id
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path) # 原子替换，避免写到一半的文件
+            return data
+        except Exception as e:
+            logger.warning(f"媒体缓存：写入 {self.path} 失败: {e}")
+            return None
 
-<b>3. 批量关闭:</b> <b>长按</b>该标签页图标，会弹出一个菜单。选择“关闭[数字]个标签页”或“关闭所有标签页”。
+    async def flush(self) -> None:
+        """把积攒的变更写入文件 (不阻塞事件循环)"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        merged = await asyncio.to_thread(self._merge_into_file, pending)
+        if merged is None:
+            for change, file_id in pending.items(): # (写入失败：下次再试，期间更新的变更优先)
+                self._pending.setdefault(change, file_id)
+            return
+        for (bot_id, key), file_id in self._pending.items(): # (写入期间新增的变更)
+            if file_id is None:
+                merged.get(bot_id, {}).pop(key, None)
+            else:
+                merged.setdefault(bot_id, {})[key] = file_id
+        self._data = merged
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(MEDIA_CACHE_SAVE_DELAY)
+        self._flush_task = None
+        await self.flush()
+
+    def _changed(self, bot_id: str, key: str, file_id: str | None) -> None:
+        self._pending[(bot_id, key)] = file_id
+        if self._flush_task is None:
+            self._flush_task = spawn_background(self._flush_later())
+
+    def get(self, bot_id: str, kind: str, url: str) -> str | None:
+        return self._data.get(bot_id, {}).get(self._key(kind, url))
+
+    def put(self, bot_id: str, kind: str, url: str, file_id: str) -> None:
+        key = self._key(kind, url)
+        self._data.setdefault(bot_id, {})[key] = file_id
+        self._changed(bot_id, key, file_id)
+
+    def drop(self, bot_id: str, kind: str, url: str) -> None:
+        key = self._key(kind, url)
+        if self._data.get(bot_id, {}).pop(key, None) is not None:
+            self.invalidated += 1
+            self._changed(bot_id, key, None)
+
+    def remember(self, bot_id: str, kind: str, url: str, message: Message) -> None:
+        """从发送结果中取出 file_id 并缓存"""
+        if kind == "photo":
+            file_id = message.photo[-1].file_id if message.photo else None
+        else:
+            media = message.video or message.animation or message.document
+            file_id = media.file_id if media else None
+        if file_id:
+            self.put(bot_id, kind, url, file_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached_file_ids": {bot_id: len(v) for bot_id, v in self._data.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "unsaved_changes": len(self._pending),
+        }
 
-<b>4. 或手动关闭:</b> 进入标签页管理界面后，向左滑动每个标签页，或者点击左上角的“X”来关闭。"""
-    try:
-        await update.message.reply_html(message)
-    except Exception as e:
-        logger.error(f"发送 [苹果窗口上限] 指南时失败: {e}")
+MEDIA_CACHE = MediaFileIdCache(MEDIA_CACHE_FILE)
 
+async def reply_cached_media(message: Message, bot_id: str, kind: str, url: str) -> None:
+    """优先用缓存的 file_id 回复；file_id 失效时退回原始 URL 并重新缓存"""
+    send = message.reply_photo if kind == "photo" else message.reply_video
+    file_id = MEDIA_CACHE.get(bot_id, kind, url)
+    if file_id:
+        try:
+            await send(file_id)
+            MEDIA_CACHE.hits += 1
+            return
+        except BadRequest as e:
+            logger.warning(f"媒体缓存：file_id 已失效，改用原始 URL 重新发送: {e}")
+            MEDIA_CACHE.drop(bot_id, kind, url)
+    MEDIA_CACHE.misses += 1
+    sent = await send(url)
+    MEDIA_CACHE.remember(bot_id, kind, url, sent)
+
+async def prewarm_media_cache(application: Application) -> None:
+    """把尚未缓存的全局图片/视频上传到 MEDIA_CACHE_CHAT_ID，提前拿到此 Bot 的 file_id"""
+    bot = application.bot
+    bot_id = str(bot.id)
+    uploads = [("photo", url) for url in dict.fromkeys(GLOBAL_IMAGE_MAP.values())]
+    uploads += [("video", url) for url in dict.fromkeys(GLOBAL_VIDEO_MAP.values())]
+    warmed = 0
+    for kind, url in uploads:
+        if MEDIA_CACHE.get(bot_id, kind, url):
+            continue
+        try:
+            if kind == "photo":
+                sent = await bot.send_photo(chat_id=MEDIA_CACHE_CHAT_ID, photo=url, disable_notification=True)
+            else:
+                sent = await bot.send_video(chat_id=MEDIA_CACHE_CHAT_ID, video=url, disable_notification=True)
+            MEDIA_CACHE.remember(bot_id, kind, url, sent)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"媒体缓存：Bot (尾号: {bot.token[-4:]}) 预热 {url} 失败: {e}")
+    logger.info(f"媒体缓存：Bot (尾号: {bot.token[-4:]}) 预热完成，新上传 {warmed} 个文件。")
+# --- ⬆️ 新增 ⬆️ ---
 
 # --- ⬇️ 新增：核心处理器 9 (全局图片) ⬇️ ---
 async def send_global_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -401,18 +2099,19 @@ async def send_global_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"Bot {bot_token_end} 收到 [全局图片] 关键字: {keyword}，发送图片...")
 
     # 1. 查找此关键字对应的全局 URL
-    image_url = GLOBAL_IMAGE_MAP.get(keyword)
+    image_url = GLOBAL_IMAGE_MAP.get(normalize_keyword(keyword))
             
     if not image_url:
-        # 这种情况不应该发生，因为 Regex 已经匹配了
+        # 这种情况不应该发生，因为关键字索引已经匹配了
         logger.error(f"Bot (尾号: {bot_token_end}) 匹配了关键字 {keyword}，但在全局图片 MAP 中未找到 URL！")
         return
         
     try:
-        # 2. 发送图片
-        await update.message.reply_photo(photo=image_url)
+        # 2. 发送图片 (优先复用 file_id)
+        await reply_cached_media(update.message, str(context.bot.id), "photo", image_url)
         
     except Exception as e:
+        record_handler_error(context, e)
         logger.error(f"发送 [全局图片] ({keyword}) 时失败: {e}")
         await update.message.reply_text(f"❌ 发送图片时发生内部错误。")
 # --- ⬆️ 新增 ⬆️ ---
@@ -431,54 +2130,276 @@ async def send_global_video(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"Bot {bot_token_end} 收到 [全局视频] 关键字: {keyword}，发送视频...")
 
     # 1. 查找此关键字对应的全局 URL
-    video_url = GLOBAL_VIDEO_MAP.get(keyword)
+    video_url = GLOBAL_VIDEO_MAP.get(normalize_keyword(keyword))
             
     if not video_url:
         logger.error(f"Bot (尾号: {bot_token_end}) 匹配了关键字 {keyword}，但在全局视频 MAP 中未找到 URL！")
         return
         
     try:
-        # 2. 发送视频
-        await update.message.reply_video(video=video_url)
+        # 2. 发送视频 (优先复用 file_id)
+        await reply_cached_media(update.message, str(context.bot.id), "video", video_url)
         
     except Exception as e:
+        record_handler_error(context, e)
         logger.error(f"发送 [全局视频] ({keyword}) 时失败: {e}")
         await update.message.reply_text(f"❌ 发送视频时发生内部错误。")
 # --- ⬆️ 新增 ⬆️ ---
 
 
+# --- ⬇️ 新增：关键字分发器 (替代 11 个 Regex MessageHandler) ⬇️ ---
+@dataclass(frozen=True, slots=True)
+class KeywordAction:
+    name: str
+    callback: Any # async def (update, context) -> None
+
+KEYWORD_INDEX: Dict[str, KeywordAction] = {}
+
+def build_keyword_index(groups: List[Tuple[KeywordAction, List[str]]]) -> Dict[str, KeywordAction]:
+    """
+    构建 关键字 -> 动作 的索引。
+    顺序与原先 Handler 的注册顺序一致：冲突时先注册的动作生效，并在加载时报告冲突。
+    """
+    index: Dict[str, KeywordAction] = {}
+    for action, keywords in groups:
+        for keyword in keywords:
+            key = normalize_keyword(keyword)
+            existing = index.get(key)
+            if existing is None:
+                index[key] = action
+            elif existing is not action:
+                logger.error(f"⚠️ 关键字冲突: [{keyword}] 同时属于 [{existing.name}] 和 [{action.name}]，将使用 [{existing.name}]。")
+    return index
+
+async def dispatch_keyword(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """归一化一次文本，然后通过一次字典查找分发到对应的处理器"""
+    if not update.message or not update.message.text:
+        return
+    action = KEYWORD_INDEX.get(normalize_keyword(update.message.text))
+    if action is not None:
+        config = context.bot_data.get(BOT_CONFIG_KEY)
+        bot = config.webhook_path if config else ""
+        started = time.perf_counter()
+        try:
+            await action.callback(update, context) # (抛出的异常由 on_handler_error 统计)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, (bot, action.name))
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：内容注册表 (关键字 / 指南 / 全局图片 / 全局视频，来自文件，支持热重载) ⬇️ ---
+CONTENT_FILE = os.getenv("CONTENT_FILE", "content.json") # .json，或 .yaml/.yml (需要安装 PyYAML)
+CONTENT_WATCH_INTERVAL = _env_float("CONTENT_WATCH_INTERVAL", 5.0) # 检查内容文件是否变化的间隔 (秒)，0 表示不监视
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # 管理接口 (X-Admin-Token 请求头) 的口令，未设置时管理接口关闭
+
+TELEGRAM_HTML_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "a", "code", "pre", "span", "tg-spoiler", "tg-emoji", "blockquote"}
+
+class TelegramHtmlChecker(HTMLParser):
+    """加载时检查指南 HTML：只允许 Telegram 支持的标签，且必须正确闭合 (否则发送时才会 BadRequest)"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in TELEGRAM_HTML_TAGS:
+            raise ValueError(f"不支持的标签 <{tag}>")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            raise ValueError(f"标签 </{tag}> 没有正确闭合")
+
+    @classmethod
+    def check(cls, html: str) -> None:
+        checker = cls()
+        checker.feed(html)
+        checker.close()
+        if checker.stack:
+            raise ValueError(f"标签 <{checker.stack[-1]}> 没有闭合")
+
+@dataclass(frozen=True, slots=True)
+class ContentRegistry:
+    """一次加载的全部内容；热重载时整体替换，处理中的请求不会看到一半新一半旧的内容"""
+    index: Dict[str, KeywordAction]
+    image_map: Dict[str, str]
+    video_map: Dict[str, str]
+    guides: int
+    help_text: str # /start 中的关键字说明 (随内容一起重载)
+    mtime: float | None
+    loaded_at: float
+
+CONTENT: ContentRegistry | None = None
+CONTENT_RELOADS = 0
+CONTENT_RELOAD_ERRORS = 0
+CONTENT_LAST_ERROR: str | None = None
+
+def read_data_file(path: str) -> Any:
+    """读取 JSON 或 YAML 文件 (内容文件、Bot 列表文件共用)"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml # (可选依赖，只有使用 YAML 文件时才需要)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def read_content_file(path: str) -> Dict[str, Any]:
+    data = read_data_file(path) or {}
+    if not isinstance(data, dict):
+        raise ValueError("内容文件的顶层必须是对象")
+    return data
+
+def _keyword_list(value: Any, where: str) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(k, str) for k in value):
+        raise ValueError(f"{where}: keywords 必须是字符串列表")
+    return [k for k in value if k.strip()]
+
+def load_env_media(prefix: str) -> List[Tuple[List[str], str]]:
+    """兼容旧配置 IMAGE_n_KEYS/IMAGE_n_URL (VIDEO 同理)，不再限制数量"""
+    pattern = re.compile(rf"^{prefix}_(\d+)_(KEYS|URL)$")
+    indexes = sorted({int(m.group(1)) for m in map(pattern.match, os.environ) if m})
+    entries = []
+    for i in indexes:
+        keys_str, url_value = os.getenv(f"{prefix}_{i}_KEYS"), os.getenv(f"{prefix}_{i}_URL")
+        if not (keys_str and url_value):
+            logger.warning(f"DIAGNOSTIC: 必须同时提供 {prefix}_{i}_KEYS 和 {prefix}_{i}_URL 才能加载 {prefix} {i}。")
+            continue
+        keys_list = [k.strip() for k in keys_str.split(',') if k.strip()]
+        if keys_list:
+            entries.append((keys_list, url_value))
+        else:
+            logger.warning(f"DIAGNOSTIC: {prefix}_{i}_KEYS 已设置，但关键字列表为空。")
+    return entries
+
+def _help_line(keywords: List[str], what: str) -> str:
+    shown = keywords[:2]
+    quoted = "、".join(f"`{escape_html(k)}`" for k in shown)
+    return f"- 发送 {quoted}{' 等' if len(keywords) > len(shown) else ' '}获取{what}。"
+
+def build_help_text(menu: List[Tuple[List[str], str]], image_map: Dict[str, str], video_map: Dict[str, str]) -> str:
+    """按内容文件中的顺序生成 /start 的关键字说明"""
+    lines = [_help_line(keywords, what) for keywords, what in menu if keywords]
+    for title, media_map, what in (("快捷图片", image_map, "图片"), ("快捷视频", video_map, "视频")):
+        if media_map:
+            lines.append(f"\n<b>--- {title} ---</b>")
+            lines += [f"- 发送 `{escape_html(key)}` 获取{what}" for key in list(media_map)[:3]] # (只显示前 3 个)
+    return "\n".join(lines)
+
+def compile_content(data: Dict[str, Any], mtime: float | None) -> ContentRegistry:
+    """校验内容并预先构建关键字索引、指南回复和图片/视频映射；任何错误都会让整个加载失败"""
+    links = data.get("links") or {}
+    groups: List[Tuple[KeywordAction, List[str]]] = [
+        (KeywordAction("通用链接", get_universal_link), _keyword_list(links.get("universal", []), "links.universal")),
+        (KeywordAction("安卓专用", get_android_specific_link), _keyword_list(links.get("android_apk", []), "links.android_apk")),
+    ]
+    menu: List[Tuple[List[str], str]] = [(groups[0][1], "通用链接"), (groups[1][1], "安卓 APK 链接")]
+
+    guides = data.get("guides") or []
+    for n, guide in enumerate(guides):
+        where = f"guides[{n}]"
+        if not isinstance(guide, dict) or not isinstance(guide.get("name"), str) or not isinstance(guide.get("html"), str):
+            raise ValueError(f"{where}: 需要 name 和 html 字段")
+        try:
+            TelegramHtmlChecker.check(guide["html"])
+        except ValueError as e:
+            raise ValueError(f"{where} ({guide['name']}): {e}")
+        reply = GuideReply(guide["name"], guide["html"])
+        keywords = _keyword_list(guide.get("keywords"), where)
+        groups.append((KeywordAction(reply.name, partial(send_guide, reply)), keywords))
+        menu.append((keywords, f"[{escape_html(reply.name)}]指南"))
+
+    media_maps: Dict[str, Dict[str, str]] = {}
+    for section, prefix in (("images", "IMAGE"), ("videos", "VIDEO")):
+        entries = []
+        for n, entry in enumerate(data.get(section) or []):
+            if not isinstance(entry, dict) or not isinstance(entry.get("url"), str):
+                raise ValueError(f"{section}[{n}]: 需要 url 字段")
+            entries.append((_keyword_list(entry.get("keywords"), f"{section}[{n}]"), entry["url"]))
+        media_map: Dict[str, str] = {}
+        for keys_list, url in entries + load_env_media(prefix):
+            for key in keys_list:
+                media_map[normalize_keyword(key)] = url
+        media_maps[section] = media_map
+    groups.append((KeywordAction("全局图片", send_global_image), list(media_maps["images"])))
+    groups.append((KeywordAction("全局视频", send_global_video), list(media_maps["videos"])))
+
+    return ContentRegistry(
+        index=build_keyword_index(groups),
+        image_map=media_maps["images"],
+        video_map=media_maps["videos"],
+        guides=len(guides),
+        help_text=build_help_text(menu, media_maps["images"], media_maps["videos"]),
+        mtime=mtime,
+        loaded_at=time.time(),
+    )
+
+def reload_content(reason: str) -> Dict[str, Any]:
+    """重新加载内容文件；失败时保留旧内容。替换是同步完成的 (中间没有 await)，所以对事件循环来说是原子的"""
+    global CONTENT, KEYWORD_INDEX, GLOBAL_IMAGE_MAP, GLOBAL_VIDEO_MAP, CONTENT_RELOADS, CONTENT_RELOAD_ERRORS, CONTENT_LAST_ERROR
+    try:
+        if CONTENT is None and not os.path.exists(CONTENT_FILE):
+            logger.warning(f"DIAGNOSTIC: 未找到内容文件 {CONTENT_FILE}，只加载环境变量中的全局图片/视频。")
+            data, mtime = {}, None
+        else:
+            mtime = os.path.getmtime(CONTENT_FILE)
+            data = read_content_file(CONTENT_FILE)
+        registry = compile_content(data, mtime)
+    except Exception as e:
+        CONTENT_RELOAD_ERRORS += 1
+        CONTENT_LAST_ERROR = f"{type(e).__name__}: {e}"
+        logger.error(f"❌ 加载内容文件 {CONTENT_FILE} 失败 ({reason})，继续使用旧内容: {e}")
+        return {"ok": False, "error": CONTENT_LAST_ERROR}
+
+    previous = CONTENT
+    CONTENT, KEYWORD_INDEX = registry, registry.index
+    GLOBAL_IMAGE_MAP, GLOBAL_VIDEO_MAP = registry.image_map, registry.video_map
+    CONTENT_RELOADS += 1
+    CONTENT_LAST_ERROR = None
+    logger.info(f"✅ 内容已加载 ({reason}): {len(registry.index)} 个关键字, {registry.guides} 个指南, {len(registry.image_map)} 个图片关键字, {len(registry.video_map)} 个视频关键字。")
+
+    # 新增的图片/视频在后台预热 file_id
+    if previous is not None and MEDIA_CACHE_CHAT_ID:
+        old_urls = set(previous.image_map.values()) | set(previous.video_map.values())
+        new_urls = set(registry.image_map.values()) | set(registry.video_map.values())
+        if new_urls - old_urls:
+            for application in BOT_APPLICATIONS.values():
+                spawn_background(prewarm_media_cache(application))
+    return {"ok": True, **content_stats()}
+
+async def watch_content_file() -> None:
+    """轮询内容文件的修改时间，变化时自动重载 (每个 worker 各自监视，多 worker 部署也能生效)"""
+    last_mtime = CONTENT.mtime if CONTENT else None
+    while True:
+        await asyncio.sleep(CONTENT_WATCH_INTERVAL)
+        try:
+            mtime = os.path.getmtime(CONTENT_FILE)
+        except OSError:
+            continue # (文件暂时不存在，例如编辑器正在替换它)
+        if mtime != last_mtime:
+            last_mtime = mtime
+            reload_content("文件变化")
+
+def content_stats() -> Dict[str, Any]:
+    return {
+        "file": CONTENT_FILE,
+        "keywords": len(CONTENT.index) if CONTENT else 0,
+        "guides": CONTENT.guides if CONTENT else 0,
+        "images": len(CONTENT.image_map) if CONTENT else 0,
+        "videos": len(CONTENT.video_map) if CONTENT else 0,
+        "loaded_at": datetime.datetime.fromtimestamp(CONTENT.loaded_at, datetime.timezone.utc).isoformat() if CONTENT else None,
+        "reloads": CONTENT_RELOADS,
+        "reload_errors": CONTENT_RELOAD_ERRORS,
+        "last_error": CONTENT_LAST_ERROR,
+    }
+# --- ⬆️ 新增 ⬆️ ---
+
+
 # --- 4. Bot 启动与停止逻辑 ---
 def setup_bot(app_instance: Application, bot_index: int) -> None:
     """配置 Bot 的所有处理器 (Handlers)。"""
     token_end = app_instance.bot.token[-4:]
     logger.info(f"Bot Application 实例 (#{bot_index}, 尾号: {token_end}) 正在配置 Handlers。")
 
-    # (需求 1) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(UNIVERSAL_COMMAND_PATTERN), get_universal_link ))
-    # (需求 2) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(ANDROID_SPECIFIC_COMMAND_PATTERN), get_android_specific_link ))
-    # (需求 3) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(IOS_QUIT_PATTERN), send_ios_quit_guide ))
-    # (需求 4) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(ANDROID_QUIT_PATTERN), send_android_quit_guide ))
-    # (需求 5) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(ANDROID_BROWSER_PATTERN), send_android_browser_guide ))
-    # (需求 6) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(IOS_BROWSER_PATTERN), send_ios_browser_guide ))
-    # (需求 7) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(ANDROID_TAB_LIMIT_PATTERN), send_android_tab_limit_guide ))
-    # (需求 8) 处理器
-    app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(IOS_TAB_LIMIT_PATTERN), send_ios_tab_limit_guide ))
-    
-    # --- ⬇️ 新增：(需求 9) 全局图片处理器 ⬇️ ---
-    if GLOBAL_IMAGE_PATTERN:
-        app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(GLOBAL_IMAGE_PATTERN), send_global_image ))
-    # --- ⬆️ 新增 ⬆️ ---
-
-    # --- ⬇️ 新增：(需求 10) 全局视频处理器 ⬇️ ---
-    if GLOBAL_VIDEO_PATTERN:
-        app_instance.add_handler( MessageHandler( filters.TEXT & filters.Regex(GLOBAL_VIDEO_PATTERN), send_global_video ))
-    # --- ⬆️ 新增 ⬆️ ---
+    # (需求 1 - 10) 所有关键字共用一个分发处理器 (一次字典查找)
+    app_instance.add_handler( MessageHandler( filters.TEXT & ~filters.COMMAND, dispatch_keyword ))
     
     
     async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -488,93 +2409,818 @@ def setup_bot(app_instance: Application, bot_index: int) -> None:
             return # 不在白名单，立即停止
         # --- ⬆️ 智能安全检查 ⬆️ ---
 
-        # (您修改后的 /start 消息)
-        start_message = (f"🤖 Bot #{bot_index} (尾号: {token_end}) 已准备就绪。\n"
-                       f"- 发送 `链接`、`地址` 等获取通用链接。\n"
-                       f"- 发送 `安卓专用` 等获取 APK 链接。\n"
-                       f"- 发送 `苹果大退` 获取 iOS 重启指南。\n"
-                       f"- 发送 `安卓大退` 获取 Android 重启指南。\n"
-                       f"- 发送 `安卓浏览器手机版` 获取安卓浏览器设置指南。\n"
-                       f"- 发送 `苹果浏览器手机版` 获取苹果浏览器设置指南。\n"
-                       f"- 发送 `安卓窗口上限` 获取安卓窗口管理指南。\n"
-                       f"- 发送 `苹果窗口上限` 获取苹果窗口管理指南。")
-        
-        # --- ⬇️ 新增：动态添加图片/视频关键字到 /start ⬇️ ---
-        if GLOBAL_IMAGE_MAP:
-            start_message += "\n\n<b>--- 快捷图片 ---</b>"
-            for key in list(GLOBAL_IMAGE_MAP.keys())[:3]: # (只显示前 3 个)
-                start_message += f"\n- 发送 `{key}` 获取图片"
-        
-        if GLOBAL_VIDEO_MAP:
-            start_message += "\n\n<b>--- 快捷视频 ---</b>"
-            for key in list(GLOBAL_VIDEO_MAP.keys())[:3]: # (只显示前 3 个)
-                start_message += f"\n- 发送 `{key}` 获取视频"
-        # --- ⬆️ 新增 ⬆️ ---
+        # (您修改后的 /start 消息；关键字说明来自当前内容，/admin/reload-content 后立即生效)
+        start_message = f"🤖 Bot #{bot_index} (尾号: {token_end}) 已准备就绪。"
+        if CONTENT is not None and CONTENT.help_text:
+            start_message += "\n" + CONTENT.help_text
 
         await update.message.reply_html(start_message)
     
     app_instance.add_handler(CommandHandler("start", start_command))
+    app_instance.add_error_handler(on_handler_error)
     
 
+# --- ⬇️ 新增：Webhook 快速确认 + 后台更新队列 ⬇️ ---
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1" # 1 = 入队后立即返回 200，由后台 worker 处理
+WEBHOOK_QUEUE_SIZE = _env_int("WEBHOOK_QUEUE_SIZE", 1000) # 每个 Bot 最多积压的更新数
+WEBHOOK_WORKERS = _env_int("WEBHOOK_WORKERS", 8) # 每个 Bot 的并发 worker 数
+WEBHOOK_QUEUE_OVERFLOW = os.getenv("WEBHOOK_QUEUE_OVERFLOW", "reject") # reject = 返回 503 让 Telegram 稍后重投; drop = 返回 200 并丢弃
+
+class UpdateQueue:
+    """
+    单个 Bot 的有界更新队列和 worker 池。
+    同一个 Chat 的更新严格按到达顺序处理，不同 Chat 之间并发处理。
+    """
+
+    def __init__(self, application: Application, webhook_path: str, maxsize: int, workers: int):
+        self.application = application
+        self.webhook_path = webhook_path
+        self.maxsize = max(1, maxsize)
+        self.worker_count = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._active: Dict[Any, deque] = {} # 正在处理的 Chat -> 排在它后面的更新
+        self._workers: List[asyncio.Task] = []
+        self.depth = 0 # 已入队但尚未开始处理的更新数
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def offer(self, update: Update) -> bool:
+        """入队；队列已满时返回 False"""
+        if self.depth >= self.maxsize:
+            self.rejected += 1
+            return False
+        self.depth += 1
+        chat = update.effective_chat
+        key = chat.id if chat else ("update", update.update_id)
+        item = (key, update, asyncio.get_running_loop().time())
+        waiting = self._active.get(key)
+        if waiting is not None:
+            waiting.append(item) # 同一 Chat 正在处理，排在它后面
+        else:
+            self._active[key] = deque()
+            self._queue.put_nowait(item)
+        return True
+
+    @property
+    def idle(self) -> bool:
+        return self.depth == 0 and not self._active
+
+    def start(self) -> None:
+        for _ in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self.depth:
+            logger.warning(f"更新队列 (路径: /{self.webhook_path}) 关闭时仍有 {self.depth} 个更新未处理。")
+
+    async def _process(self, item: tuple) -> None:
+        _, update, enqueued_at = item
+        self.depth -= 1
+        wait = asyncio.get_running_loop().time() - enqueued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        started = time.perf_counter()
+        try:
+            await self.application.process_update(update)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"后台处理更新失败 (路径: /{self.webhook_path})：{e}")
+        UPDATE_SECONDS.observe(time.perf_counter() - started, (self.webhook_path,))
+        self.processed += 1
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            key = item[0]
+            await self._process(item)
+            waiting = self._active[key]
+            while waiting:
+                await self._process(waiting.popleft())
+            del self._active[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "capacity": self.maxsize,
+            "workers": self.worker_count,
+            "processed": self.processed,
+            "rejected_when_full": self.rejected,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait / self.processed * 1000, 1) if self.processed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+UPDATE_QUEUES: Dict[str, UpdateQueue] = {}
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：update_id 去重 (Telegram 重投) ⬇️ ---
+UPDATE_DEDUP_WINDOW = _env_int("UPDATE_DEDUP_WINDOW", 2048) # 每个 Bot 记住最近多少个 update_id
+UPDATE_DEDUP_TTL = _env_float("UPDATE_DEDUP_TTL", 3600.0) # 共享后端中 update_id 记录的保留时长 (秒)
+
+class UpdateDeduplicator:
+    """
+    内存有界的 update_id 去重：环形缓冲 + 集合记住最近 window 个 ID，
+    再加上已淘汰 ID 的最高水位——比它更旧的重投直接视为重复。
+    """
+    __slots__ = ("window", "_ring", "_seen", "evicted_high_water", "high_water", "checked", "duplicates")
+
+    def __init__(self, window: int):
+        self.window = max(1, window)
+        self._ring: deque = deque()
+        self._seen: set = set()
+        self.evicted_high_water = -1
+        self.high_water = -1
+        self.checked = 0
+        self.duplicates = 0
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """检查并记录；重复 (或早已淘汰的旧 ID) 返回 True"""
+        self.checked += 1
+        if update_id in self._seen or update_id <= self.evicted_high_water:
+            self.duplicates += 1
+            return True
+        if len(self._ring) >= self.window:
+            evicted = self._ring.popleft()
+            self._seen.discard(evicted)
+            if evicted > self.evicted_high_water:
+                self.evicted_high_water = evicted
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+        if update_id > self.high_water:
+            self.high_water = update_id
+        return False
+
+    def forget(self, update_id: int) -> None:
+        """处理失败时撤销记录，允许 Telegram 的重投再次被处理"""
+        self._seen.discard(update_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"checked": self.checked, "duplicates_dropped": self.duplicates, "high_water_update_id": self.high_water}
+
+UPDATE_DEDUP: Dict[str, UpdateDeduplicator] = {}
+# --- ⬆️ 新增 ⬆️ ---
+
+
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").rstrip("/") # 默认使用 https://api.telegram.org
+
+# --- ⬇️ 新增：所有 Bot 共用一个 Telegram HTTP 连接池 (可选 HTTP/2) ⬇️ ---
+TELEGRAM_SHARED_TRANSPORT = os.getenv("TELEGRAM_SHARED_TRANSPORT", "1") == "1" # 1 = 所有 Bot Application 共用一个连接池; 0 = 每个 Bot 各自一个
+TELEGRAM_HTTP_VERSION = os.getenv("TELEGRAM_HTTP_VERSION", "1.1") # 1.1 或 2 (HTTP/2 需要 pip install "httpx[http2]")
+TELEGRAM_POOL_SIZE = _env_int("TELEGRAM_POOL_SIZE", 128) # 到 Telegram API 的最大连接数
+TELEGRAM_KEEPALIVE_EXPIRY = _env_float("TELEGRAM_KEEPALIVE_EXPIRY", 60.0) # 空闲连接保留时长 (秒)，定时广播之间也能复用已建立的连接
+TELEGRAM_POOL_TIMEOUT = _env_float("TELEGRAM_POOL_TIMEOUT", 5.0) # 等待空闲连接的超时 (秒)
+
+TELEGRAM_API_SECONDS = register_metric(Histogram("tgbot_telegram_api_seconds", "Telegram Bot API 请求耗时 (按方法)", ("method",)))
+TELEGRAM_CONNECTIONS = register_metric(Counter("tgbot_telegram_connections_total", "新建的 Telegram API 连接 (tcp = 新连接, tls = TLS 握手)", ("kind",)))
+
+class TelegramTransportStats:
+    """Telegram API 请求数与新建连接数 (两者之差即复用已有连接的请求数)"""
+
+    def __init__(self):
+        self.http_version = "1.1"
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.total_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shared": TELEGRAM_SHARED_TRANSPORT,
+            "http_version": self.http_version,
+            "pool_size": TELEGRAM_POOL_SIZE,
+            "keepalive_expiry_seconds": TELEGRAM_KEEPALIVE_EXPIRY,
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "connection_reuse_ratio": round(1 - self.new_connections / self.requests, 3) if self.requests else None,
+            "avg_latency_ms": round(self.total_seconds / self.requests * 1000, 1) if self.requests else None,
+        }
+
+TELEGRAM_TRANSPORT_STATS = TelegramTransportStats()
+
+async def _trace_telegram_connection(event_name: str, info: Dict[str, Any]) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        TELEGRAM_TRANSPORT_STATS.new_connections += 1
+        TELEGRAM_CONNECTIONS.inc(("tcp",))
+    elif event_name == "connection.start_tls.complete":
+        TELEGRAM_TRANSPORT_STATS.tls_handshakes += 1
+        TELEGRAM_CONNECTIONS.inc(("tls",))
+
+class TracingTransport(httpx.AsyncHTTPTransport):
+    """通过 httpcore 的 trace 事件统计新建的连接 / TLS 握手"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions.setdefault("trace", _trace_telegram_connection)
+        return await super().handle_async_request(request)
+
+class TelegramHTTPXRequest(HTTPXRequest):
+    """记录每次 Bot API 调用的耗时 (按方法，不含 Token)"""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> Tuple[int, bytes]:
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            TELEGRAM_TRANSPORT_STATS.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            TELEGRAM_TRANSPORT_STATS.requests += 1
+            TELEGRAM_TRANSPORT_STATS.total_seconds += elapsed
+            TELEGRAM_API_SECONDS.observe(elapsed, (url.rsplit("/", 1)[-1],))
+
+class SharedTelegramRequest(TelegramHTTPXRequest):
+    """
+    所有 Bot 共用的请求对象。
+    Application.shutdown() (例如空闲回收) 不会关闭共享连接池，应用关闭时才调用 close()。
+    """
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        await super().shutdown()
+
+TELEGRAM_REQUEST: SharedTelegramRequest | None = None
+
+def create_telegram_request(request_class=TelegramHTTPXRequest) -> TelegramHTTPXRequest:
+    http_version = TELEGRAM_HTTP_VERSION
+    if http_version in ("2", "2.0"):
+        try:
+            import h2 # noqa: F401 (可选依赖，只有启用 HTTP/2 时才需要)
+        except ImportError:
+            logger.warning('TELEGRAM_HTTP_VERSION=2 但未安装 h2 (pip install "httpx[http2]")，改用 HTTP/1.1。')
+            http_version = "1.1"
+    http2 = http_version != "1.1"
+    limits = httpx.Limits(max_connections=TELEGRAM_POOL_SIZE, max_keepalive_connections=TELEGRAM_POOL_SIZE, keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY)
+    TELEGRAM_TRANSPORT_STATS.http_version = http_version
+    return request_class(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        http_version=http_version,
+        httpx_kwargs={"transport": TracingTransport(http1=not http2, http2=http2, limits=limits)},
+    )
+
+def get_telegram_request() -> TelegramHTTPXRequest:
+    """共享模式下返回唯一的请求对象 (首次调用时创建)，否则为每个 Application 新建一个"""
+    global TELEGRAM_REQUEST
+    if not TELEGRAM_SHARED_TRANSPORT:
+        return create_telegram_request()
+    if TELEGRAM_REQUEST is None:
+        TELEGRAM_REQUEST = create_telegram_request(SharedTelegramRequest)
+        logger.info(f"Telegram 连接池已创建 (所有 Bot 共用, HTTP/{TELEGRAM_TRANSPORT_STATS.http_version}, 最多 {TELEGRAM_POOL_SIZE} 个连接)。")
+    return TELEGRAM_REQUEST
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：Bot 注册表 (数量不限；首次收到 Webhook 时才初始化，空闲后回收) ⬇️ ---
+BOTS_FILE = os.getenv("BOTS_FILE") # 可选：JSON/YAML 格式的 Bot 列表，与 BOT_TOKEN_n 环境变量合并
+BOT_LAZY_INIT = os.getenv("BOT_LAZY_INIT", "0") == "1" # 0 = 启动时并发初始化所有 Bot (首条消息不用等 getMe/预热); 1 = 首次收到该 Bot 的 Webhook (或定时任务) 时才初始化 Application
+BOT_IDLE_TIMEOUT = _env_float("BOT_IDLE_TIMEOUT", 1800.0) # 空闲超过 N 秒的 Application 会被关闭回收，0 表示不回收
+
+BOT_LAST_USED: Dict[str, float] = {} # 路径 -> 最近一次使用 (事件循环时间)
+BOT_IN_FLIGHT: Dict[str, int] = {} # 路径 -> 正在使用该 Bot 的请求/广播数，大于 0 时不会被回收
+BOT_ACTIVATIONS = SingleFlight() # key: webhook 路径 (同一个 Bot 的并发首次请求只初始化一次)
+BOT_ACTIVATION_SECONDS = register_metric(Histogram("tgbot_bot_activation_seconds", "按需初始化 Bot Application 的耗时 (含 getMe)", ("bot",)))
+BOT_EVICTIONS = register_metric(Counter("tgbot_bot_evictions_total", "因空闲被回收的 Bot Application 数", ("bot",)))
+
+def _split_list(value: Any) -> List[str]:
+    """同时接受 "a,b" 字符串 (环境变量) 和列表 (文件)"""
+    if value is None:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    return [str(item).strip() for item in items if str(item).strip()]
+
+def env_bot_specs() -> List[Dict[str, Any]]:
+    """BOT_TOKEN_n 及对应的 BOT_n_* 环境变量 (n 不再限制为 1-9)"""
+    pattern = re.compile(r"^BOT_TOKEN_(\d+)$")
+    specs = []
+    for i in sorted(int(m.group(1)) for m in map(pattern.match, os.environ) if m):
+        token_value = os.getenv(f"BOT_TOKEN_{i}")
+        if not token_value:
+            continue
+        specs.append({
+            "index": i,
+            "token": token_value,
+            "api_url": os.getenv(f"BOT_{i}_API_URL"),
+            "apk_url": os.getenv(f"BOT_{i}_APK_URL"),
+            "allowed_chat_ids": os.getenv(f"BOT_{i}_ALLOWED_CHAT_IDS"),
+            "chat_rate": os.getenv(f"BOT_{i}_CHAT_RATE"),
+            "chat_burst": os.getenv(f"BOT_{i}_CHAT_BURST"),
+            "bot_rate": os.getenv(f"BOT_{i}_RATE"),
+            "bot_burst": os.getenv(f"BOT_{i}_BURST"),
+            "schedule": {
+                "chat_ids": os.getenv(f"BOT_{i}_SCHEDULE_CHAT_ID"),
+                "times_utc": os.getenv(f"BOT_{i}_SCHEDULE_TIMES_UTC"),
+                "message": os.getenv(f"BOT_{i}_SCHEDULE_MESSAGE"),
+            },
+        })
+    return specs
+
+def file_bot_specs(path: str, next_index: int) -> List[Dict[str, Any]]:
+    """
+    BOTS_FILE 中的 Bot 列表: {"bots": [{"token": ..., "api_url": ..., "apk_url": ...,
+    "allowed_chat_ids": [...], "schedule": {"chat_ids": [...], "times_utc": [...], "message": ...},
+    "chat_rate": ..., "chat_burst": ..., "bot_rate": ..., "bot_burst": ...}]}
+    可选 "index" / "webhook_path"；未指定 index 时接在环境变量中的 Bot 之后编号。
+    """
+    data = read_data_file(path) or {}
+    entries = data.get("bots", []) if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("Bot 列表文件必须是列表，或包含 bots 列表的对象")
+    specs = []
+    for n, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("token"):
+            logger.error(f"DIAGNOSTIC: {path} 第 {n + 1} 个 Bot 缺少 token，已忽略。")
+            continue
+        spec = dict(entry)
+        if "index" not in spec:
+            spec["index"] = next_index
+            next_index += 1
+        specs.append(spec)
+    return specs
+
+def register_bot(spec: Dict[str, Any]) -> BotConfig | None:
+    """解析一个 Bot 的配置 (链接 API、APK 模板、定时任务、白名单)；此时还不会创建 Application"""
+    i = int(spec["index"])
+    token_value = str(spec["token"])
+    webhook_path = spec.get("webhook_path") or f"bot{i}_webhook"
+    if webhook_path in BOT_CONFIGS:
+        logger.error(f"DIAGNOSTIC: Bot #{i} 的监听路径 /{webhook_path} 与已有 Bot 重复，已忽略。")
+        return None
+    logger.info(f"DIAGNOSTIC: D 发现 Bot #{i}: Token (尾号: {token_value[-4:]})")
+
+    # 1. API URL (用于通用链接)
+    api_url_value = spec.get("api_url")
+    if api_url_value:
+        logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [通用链接 API]: {api_url_value}")
+    else:
+        logger.warning(f"DIAGNOSTIC: Bot #{i} 未配置 api_url (BOT_{i}_API_URL)。[通用链接] 功能将无法工作。")
+
+    # 2. APK URL (用于安卓专用链接)
+    apk_url_value = spec.get("apk_url")
+    if apk_url_value:
+        logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [安卓专用模板]: {apk_url_value}")
+    else:
+        logger.warning(f"DIAGNOSTIC: Bot #{i} 未配置 apk_url (BOT_{i}_APK_URL)。[安卓专用链接] 功能将无法工作。")
+
+    # 3. 固定时间点配置
+    schedule_spec = spec.get("schedule") or {}
+    schedule_chat_ids = _split_list(schedule_spec.get("chat_ids"))
+    schedule_times = _split_list(schedule_spec.get("times_utc"))
+    schedule_message = schedule_spec.get("message")
+    if schedule_chat_ids or schedule_times or schedule_message:
+        try:
+            times_list = [parse_hhmm(t) for t in schedule_times]
+            if not times_list: raise ValueError("时间列表为空")
+            if not schedule_chat_ids: raise ValueError("Chat ID 列表为空")
+            if not schedule_message: raise ValueError("消息为空")
+            BOT_SCHEDULES[webhook_path] = {
+                "chat_ids": schedule_chat_ids,
+                "times": times_list,
+                "message": schedule_message,
+            }
+            logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [定时任务]: 在 UTC {times_list} 发送到 {len(schedule_chat_ids)} 个 Chat(s)")
+        except Exception as e:
+            logger.error(f"Bot #{i} 的定时任务配置错误: {e}")
+    else:
+        logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 未配置定时任务。")
+
+    # 4. 安全白名单
+    allowed_list = _split_list(spec.get("allowed_chat_ids"))
+    if allowed_list:
+        logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [安全白名单]: 允许 {len(allowed_list)} 个 Chat(s)")
+    else:
+        logger.warning(f"DIAGNOSTIC: Bot #{i} 未配置白名单 (BOT_{i}_ALLOWED_CHAT_IDS)。此 Bot 将 [不会] 响应任何群组或私聊的指令。")
+
+    # 5. [通用链接] 限流 (未配置时使用 LINK_CHAT_RATE / LINK_BOT_RATE 等全局默认值)
+    def _number(key: str, default: float, cast) -> Any:
+        value = spec.get(key)
+        return default if value is None or value == "" else cast(value) # (显式的 0 表示不限制)
+    try:
+        chat_limit = RateLimit(_number("chat_rate", LINK_CHAT_RATE, float), _number("chat_burst", LINK_CHAT_BURST, int))
+        bot_limit = RateLimit(_number("bot_rate", LINK_BOT_RATE, float), _number("bot_burst", LINK_BOT_BURST, int))
+    except (TypeError, ValueError) as e:
+        logger.error(f"Bot #{i} 的限流配置错误 ({e})，改用默认值。")
+        chat_limit = RateLimit(LINK_CHAT_RATE, LINK_CHAT_BURST)
+        bot_limit = RateLimit(LINK_BOT_RATE, LINK_BOT_BURST)
+    logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) [通用链接] 限流: 每个 Chat {chat_limit}，整个 Bot {bot_limit}")
+
+    # 6. 只读配置记录 (Application 创建时挂到 bot_data 上)
+    config = BotConfig(
+        index=i,
+        webhook_path=webhook_path,
+        token_end=token_value[-4:],
+        token=token_value,
+        api_url=api_url_value or None,
+        apk_template=apk_url_value or None,
+        schedule=BOT_SCHEDULES.get(webhook_path),
+        allowed_chat_ids=normalize_allowlist(allowed_list),
+        allowed_chats_configured=len(allowed_list),
+        chat_limit=chat_limit,
+        bot_limit=bot_limit,
+    )
+    BOT_CONFIGS[webhook_path] = config
+    return config
+
+async def _activate_bot(config: BotConfig) -> Application:
+    started = time.perf_counter()
+    builder = Application.builder().token(config.token).request(get_telegram_request())
+    if TELEGRAM_API_BASE_URL: # (例如本地压测时的假 Bot API 服务)
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot").base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    application = builder.build()
+    application.bot_data["fastapi_app"] = app
+    application.bot_data[BOT_CONFIG_KEY] = config
+    # (setup_bot 只注册一个关键字分发处理器，全局图片/视频也在索引中)
+    setup_bot(application, config.index)
+    try:
+        await application.initialize() # (getMe)
+    except Exception as e:
+        BOT_INIT_FAILURES[config.webhook_path] = str(e)
+        logger.error(f"❌ Bot #{config.index} (路径: {config.webhook_path}) 初始化失败: {e}")
+        raise
+    BOT_INIT_FAILURES.pop(config.webhook_path, None)
+
+    webhook_path = config.webhook_path
+    BOT_APPLICATIONS[webhook_path] = application
+    BOT_LAST_USED[webhook_path] = asyncio.get_running_loop().time()
+    if WEBHOOK_ASYNC:
+        UPDATE_QUEUES[webhook_path] = UpdateQueue(application, webhook_path, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS)
+        UPDATE_QUEUES[webhook_path].start()
+    if MEDIA_CACHE_CHAT_ID and (GLOBAL_IMAGE_MAP or GLOBAL_VIDEO_MAP):
+        spawn_background(prewarm_media_cache(application))
+    if LINK_INVENTORY.enabled and config.api_url: # (Bot 一被使用就开始补货，第一次 "链接" 请求即可命中)
+        LINK_INVENTORY.ensure_producer(webhook_path)
+    elapsed = time.perf_counter() - started
+    BOT_ACTIVATION_SECONDS.observe(elapsed, (webhook_path,))
+    logger.info(f"Bot #{config.index} (尾号: {config.token_end}) 已初始化 (耗时 {elapsed:.2f}s)。监听路径: /{webhook_path}")
+    return application
+
+async def activate_bot(webhook_path: str) -> Application:
+    """返回该 Bot 的 Application，尚未初始化时先初始化 (并发调用共用同一次初始化)"""
+    application = BOT_APPLICATIONS.get(webhook_path)
+    if application is not None:
+        return application
+    config = BOT_CONFIGS[webhook_path]
+    return await BOT_ACTIVATIONS.do(webhook_path, lambda: _activate_bot(config))
+
+def hold_bot(webhook_path: str) -> None:
+    BOT_IN_FLIGHT[webhook_path] = BOT_IN_FLIGHT.get(webhook_path, 0) + 1
+
+def release_bot(webhook_path: str) -> None:
+    BOT_IN_FLIGHT[webhook_path] -= 1
+    BOT_LAST_USED[webhook_path] = asyncio.get_running_loop().time()
+
+async def deactivate_bot(webhook_path: str) -> None:
+    """关闭并移除 Application (配置保留，下次收到 Webhook 时重新初始化)"""
+    application = BOT_APPLICATIONS.pop(webhook_path, None)
+    if application is None:
+        return
+    update_queue = UPDATE_QUEUES.pop(webhook_path, None)
+    if update_queue is not None:
+        await update_queue.stop()
+    try:
+        await application.shutdown()
+    except Exception as e:
+        logger.warning(f"关闭 Bot Application (路径: /{webhook_path}) 时出错: {e}")
+
+async def evict_idle_bots() -> None:
+    """定期回收空闲超过 BOT_IDLE_TIMEOUT 的 Application (正在处理请求、队列未清空的 Bot 不会被回收)"""
+    while True:
+        await asyncio.sleep(max(5.0, min(BOT_IDLE_TIMEOUT / 4, 60.0)))
+        now = asyncio.get_running_loop().time()
+        for webhook_path in list(BOT_APPLICATIONS):
+            if now - BOT_LAST_USED.get(webhook_path, now) < BOT_IDLE_TIMEOUT or BOT_IN_FLIGHT.get(webhook_path):
+                continue
+            update_queue = UPDATE_QUEUES.get(webhook_path)
+            if update_queue is not None and not update_queue.idle:
+                continue
+            await deactivate_bot(webhook_path)
+            BOT_EVICTIONS.inc((webhook_path,))
+            logger.info(f"Bot (路径: /{webhook_path}) 已空闲 {BOT_IDLE_TIMEOUT:.0f}s，Application 已回收。")
+# --- ⬆️ 新增 ⬆️ ---
+
 # --- 5. FastAPI 应用实例 ---
 app = FastAPI(title="Multi-Bot Playwright Service")
 
 # --- 6. 应用启动/关闭事件 ---
 
-# --- ⬇️ 后台调度器 (已修复 <br> Bug) ⬇️ ---
-async def background_scheduler():
-    """每60秒检查一次是否有到期的定时任务"""
-    logger.info("后台调度器已启动... (每 60 秒检查一次)")
-    await asyncio.sleep(10) 
+# --- ⬇️ 后台调度器 (最小堆精确定时，已修复 <br> Bug) ⬇️ ---
+SCHEDULE_STATE_FILE = os.getenv("SCHEDULE_STATE_FILE", "schedule_state.json") # 已触发时间点的持久化文件
+SCHEDULE_CATCHUP = os.getenv("SCHEDULE_CATCHUP", "skip") # skip = 不补发错过的时间点; once = 启动时补发最近一次错过的时间点
+SCHEDULE_CATCHUP_WINDOW = _env_float("SCHEDULE_CATCHUP_WINDOW", 3600.0) # once 模式下，只补发错过不超过 N 秒的时间点
+SCHEDULE_GRACE_SECONDS = 60.0 # 任何模式下，错过不超过 60 秒 (例如重启时恰好跨过) 的时间点都会照常发送
+SCHEDULE_MAX_SLEEP = 300.0 # 最长睡眠时间，防止系统时钟跳变导致长时间不唤醒
+
+def parse_hhmm(value: str) -> str:
+    """校验并规范化 "H:MM" / "HH:MM" 为 "HH:MM" (UTC)"""
+    hour_str, minute_str = value.strip().split(":")
+    hour, minute = int(hour_str), int(minute_str)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"无效的时间点: {value}")
+    return f"{hour:02d}:{minute:02d}"
+
+def latest_slot(hhmm: str, now: datetime.datetime) -> datetime.datetime:
+    """不晚于 now 的最近一次该时间点"""
+    hour, minute = map(int, hhmm.split(":"))
+    slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if slot > now:
+        slot -= datetime.timedelta(days=1)
+    return slot
+
+class ScheduleTimer:
+    """
+    所有 Bot 的定时任务放在一个最小堆里 (按下一次触发时刻排序)，
+    循环只睡到最近一个到期的时间点。已触发的时间点持久化到本地文件，
+    重启后既不会重复发送，也会按 SCHEDULE_CATCHUP 策略处理错过的时间点。
+    """
+
+    def __init__(self, state_file: str):
+        self.state_file = state_file
+        self._heap: List[tuple] = [] # (触发时间戳, webhook_path, "HH:MM")
+        self._fired: Dict[str, Dict[str, str]] = {} # webhook_path -> {"HH:MM": 最近已触发时间点 (ISO)}
+        self.fired_count = 0
+        self.caught_up = 0
 
-    while True:
+    async def load_state(self) -> None:
+        if STATE.shared:
+            self._fired = await STATE.get("schedule:fired") or {}
+            return
         try:
-            now_utc = datetime.datetime.now(datetime.timezone.utc)
-            current_utc_hm = now_utc.strftime("%H:%M") 
-            
-            for webhook_path, schedule in BOT_SCHEDULES.items():
-                
-                if current_utc_hm in schedule["times"]:
-                    
-                    last_sent_time = schedule.get("last_sent")
-                    should_send = False
-                    
-                    if last_sent_time is None: 
-                        should_send = True
-                    else:
-                        delta = now_utc - last_sent_time
-                        if delta.total_seconds() > 3540: 
-                            should_send = True
-                            
-                    if should_send:
-                        application = BOT_APPLICATIONS.get(webhook_path)
-                        if application:
-                            chat_ids_list = schedule["chat_ids"] 
-                            message_raw = schedule["message"] # <-- (来自 Env Var, 可能包含 <br>)
-                            
-                            # --- ⬇️ 关键修复：替换 <br> 标签 ⬇️ ---
-                            message_formatted = message_raw.replace("<br>", "\n").replace("<br/>", "\n").replace("<br />", "\n")
-                            # --- ⬆️ 关键修复 ⬆️ ---
-                            
-                            logger.info(f"Bot (路径: {webhook_path}) 正在发送定时消息到 {len(chat_ids_list)} 个 Chats...")
-                            
-                            for chat_id in chat_ids_list: 
-                                try:
-                                    # --- ⬇️ 关键修复：发送格式化后的消息 ⬇️ ---
-                                    await application.bot.send_message(chat_id=chat_id, text=message_formatted, parse_mode='HTML') 
-                                    # --- ⬆️ 关键修复 ⬆️ ---
-                                    logger.info(f"Bot (路径: {webhook_path}) 定时消息 -> {chat_id} 发送成功。")
-                                except Exception as e:
-                                    logger.error(f"Bot (路径: {webhook_path}) 发送定时消息 -> {chat_id} 失败: {e}")
-                            
-                            schedule["last_sent"] = now_utc 
-                        else:
-                            logger.warning(f"调度器：找不到 Bot Application 实例 (路径: {webhook_path})")
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                self._fired = json.load(f)
+        except FileNotFoundError:
+            self._fired = {}
+        except Exception as e:
+            logger.warning(f"调度器：读取 {self.state_file} 失败，将从空状态开始: {e}")
+            self._fired = {}
 
+    async def save_state(self) -> None:
+        if STATE.shared:
+            await STATE.set("schedule:fired", self._fired)
+            return
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._fired, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            logger.warning(f"调度器：写入 {self.state_file} 失败: {e}")
+
+    def build(self, now: datetime.datetime) -> None:
+        """根据 BOT_SCHEDULES 建堆，并按补发策略安排错过的时间点"""
+        self._heap = []
+        for webhook_path, schedule in BOT_SCHEDULES.items():
+            fired = self._fired.get(webhook_path, {})
+            for hhmm in schedule["times"]:
+                slot = latest_slot(hhmm, now)
+                missed_by = (now - slot).total_seconds()
+                if fired.get(hhmm) != slot.isoformat() and (
+                    missed_by <= SCHEDULE_GRACE_SECONDS
+                    or (SCHEDULE_CATCHUP == "once" and missed_by <= SCHEDULE_CATCHUP_WINDOW)
+                ):
+                    if missed_by > SCHEDULE_GRACE_SECONDS:
+                        self.caught_up += 1
+                        logger.info(f"调度器：补发错过的时间点 {slot.isoformat()} (路径: {webhook_path})")
+                    heapq.heappush(self._heap, (slot.timestamp(), webhook_path, hhmm))
+                else:
+                    next_slot = slot + datetime.timedelta(days=1)
+                    heapq.heappush(self._heap, (next_slot.timestamp(), webhook_path, hhmm))
+
+    def next_fire_times(self) -> Dict[str, List[str]]:
+        result: Dict[str, List[str]] = {}
+        for fire_ts, webhook_path, _ in sorted(self._heap):
+            result.setdefault(webhook_path, []).append(
+                datetime.datetime.fromtimestamp(fire_ts, datetime.timezone.utc).isoformat()
+            )
+        return result
+
+    async def run(self) -> None:
+        logger.info(f"后台调度器已启动... (最小堆精确定时，{len(self._heap)} 个时间点)")
+        while self._heap:
+            fire_ts, webhook_path, hhmm = self._heap[0]
+            delay = fire_ts - time.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, SCHEDULE_MAX_SLEEP))
+                continue
+            heapq.heappop(self._heap)
+            slot = datetime.datetime.fromtimestamp(fire_ts, datetime.timezone.utc)
+            heapq.heappush(self._heap, ((slot + datetime.timedelta(days=1)).timestamp(), webhook_path, hhmm))
+            spawn_background(self._fire(webhook_path, hhmm, slot))
+        logger.info("后台调度器：没有配置任何定时任务，调度器退出。")
+
+    async def _fire(self, webhook_path: str, hhmm: str, slot: datetime.datetime) -> None:
+        if self._fired.get(webhook_path, {}).get(hhmm) == slot.isoformat():
+            return # 已发送过 (例如补发与正常触发重叠)
+        self._fired.setdefault(webhook_path, {})[hhmm] = slot.isoformat()
+        self.fired_count += 1
+        # 先持久化再发送：即使发送途中崩溃或发生 leader 切换，也不会重复广播
+        await self.save_state()
+        try:
+            await send_scheduled_message(webhook_path, BOT_SCHEDULES[webhook_path])
         except Exception as e:
             logger.error(f"后台调度器发生严重错误: {e}")
-            
-        await asyncio.sleep(60) # 休息 60 秒
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fired": self.fired_count,
+            "caught_up": self.caught_up,
+            "catchup_policy": SCHEDULE_CATCHUP,
+            "next_fire_utc": self.next_fire_times(),
+        }
+
+SCHEDULE_TIMER = ScheduleTimer(SCHEDULE_STATE_FILE)
+SCHEDULER_IS_LEADER = False
+
+async def run_scheduler_with_lease() -> None:
+    """
+    多 worker 部署时，只有持有 "scheduler" 租约的 worker 运行调度器；
+    租约丢失 (例如续约超时) 时立即停止，由其他 worker 接管。
+    """
+    global SCHEDULER_IS_LEADER
+    timer_task: asyncio.Task | None = None
+    while True:
+        try:
+            is_leader = await STATE.acquire_lease("scheduler", WORKER_ID, SCHEDULER_LEASE_TTL)
+        except Exception as e:
+            logger.error(f"调度器：续约失败: {e}")
+            is_leader = False
+        if is_leader and timer_task is None:
+            logger.info(f"调度器：worker {WORKER_ID} 成为 leader，开始调度。")
+            await SCHEDULE_TIMER.load_state()
+            SCHEDULE_TIMER.build(datetime.datetime.now(datetime.timezone.utc))
+            timer_task = spawn_background(SCHEDULE_TIMER.run())
+        elif not is_leader and timer_task is not None:
+            logger.warning(f"调度器：worker {WORKER_ID} 失去租约，停止调度。")
+            timer_task.cancel()
+            timer_task = None
+        SCHEDULER_IS_LEADER = is_leader
+        await asyncio.sleep(SCHEDULER_LEASE_TTL / 3)
+
+# --- ⬇️ 新增：限速感知的广播引擎 ⬇️ ---
+BROADCAST_GLOBAL_RATE = _env_float("BROADCAST_GLOBAL_RATE", 25.0) # 每个 Bot 每秒最多发送条数 (Telegram 上限约 30/s)，0 表示不限制
+BROADCAST_CHAT_RATE = _env_float("BROADCAST_CHAT_RATE", 1.0) # 私聊：每个 Chat 每秒最多 1 条，0 表示不限制
+BROADCAST_GROUP_RATE_PER_MIN = _env_float("BROADCAST_GROUP_RATE_PER_MIN", 20.0) # 群组：每分钟最多 20 条，0 表示不限制
+BROADCAST_CONCURRENCY = _env_int("BROADCAST_CONCURRENCY", 10) # 同时进行中的发送请求数
+BROADCAST_MAX_RETRIES = _env_int("BROADCAST_MAX_RETRIES", 3)
+
+class TokenBucket:
+    """令牌桶：rate 个/秒，最多积累 capacity 个；rate <= 0 表示不限制"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1, capacity) # (capacity < 1 时永远攒不满一个令牌)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def is_full(self) -> bool:
+        if self.unlimited:
+            return True
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self) -> bool:
+        if self.unlimited:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class BroadcastEngine:
+    """
+    单个 Bot 的广播引擎：全局 + 每个 Chat 的令牌桶，
+    在限速范围内并发发送，429 时按 retry_after 暂停整个 Bot 后重试。
+    """
+
+    def __init__(self, webhook_path: str):
+        self.webhook_path = webhook_path
+        self.global_bucket = TokenBucket(BROADCAST_GLOBAL_RATE, BROADCAST_GLOBAL_RATE)
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        self.paused_until = 0.0 # 收到 429 后，整个 Bot 暂停到这个时刻 (monotonic)
+        self.last_result: Dict[str, Any] | None = None
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id.startswith("-"):
+                bucket = TokenBucket(BROADCAST_GROUP_RATE_PER_MIN / 60.0, 1)
+            else:
+                bucket = TokenBucket(BROADCAST_CHAT_RATE, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _send_one(self, application: Application, chat_id: str, text: str, result: Dict[str, Any]) -> None:
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            await self._chat_bucket(chat_id).acquire()
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.global_bucket.acquire()
+            try:
+                await application.bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
+                result["sent"] += 1
+                logger.info(f"Bot (路径: {self.webhook_path}) 定时消息 -> {chat_id} 发送成功。")
+                return
+            except RetryAfter as e:
+                record_telegram_error(self.webhook_path, e)
+                delay = retry_after_seconds(e)
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                result["retries"] += 1
+                logger.warning(f"Bot (路径: {self.webhook_path}) 被限速 (429)，{delay:.0f} 秒后重试 -> {chat_id}")
+                last_error: Exception = e
+            except (TimedOut, NetworkError) as e:
+                record_telegram_error(self.webhook_path, e)
+                result["retries"] += 1
+                await asyncio.sleep(2 ** attempt)
+                last_error = e
+            except Exception as e:
+                record_telegram_error(self.webhook_path, e)
+                last_error = e
+                break
+        result["failed"] += 1
+        error_name = type(last_error).__name__
+        result["errors"][error_name] = result["errors"].get(error_name, 0) + 1
+        logger.error(f"Bot (路径: {self.webhook_path}) 发送定时消息 -> {chat_id} 失败: {last_error}")
+
+    async def broadcast(self, application: Application, chat_ids: List[str], text: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"chats": len(chat_ids), "sent": 0, "failed": 0, "retries": 0, "errors": {}}
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        async def send(chat_id: str) -> None:
+            async with semaphore:
+                await self._send_one(application, chat_id, text, result)
+
+        await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+        elapsed = time.perf_counter() - started
+        BROADCAST_SECONDS.observe(elapsed, (self.webhook_path,))
+        BROADCAST_MESSAGES.inc((self.webhook_path, "sent"), result["sent"])
+        BROADCAST_MESSAGES.inc((self.webhook_path, "failed"), result["failed"])
+        result["duration_seconds"] = round(elapsed, 2)
+        result["finished_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.last_result = result
+        return result
+
+BROADCAST_ENGINES: Dict[str, BroadcastEngine] = {}
+
+def render_schedule_message(message_raw: str) -> str:
+    """(来自 Env Var, 可能包含 <br>) -> Telegram HTML 可用的文本"""
+    # --- ⬇️ 关键修复：替换 <br> 标签 ⬇️ ---
+    return message_raw.replace("<br>", "\n").replace("<br/>", "\n").replace("<br />", "\n")
+    # --- ⬆️ 关键修复 ⬆️ ---
+# --- ⬆️ 新增 ⬆️ ---
+
+async def send_scheduled_message(webhook_path: str, schedule: Dict[str, Any]) -> None:
+    """把定时消息广播到该 Bot 配置的所有 Chat"""
+    if webhook_path not in BOT_CONFIGS:
+        logger.warning(f"调度器：找不到 Bot 配置 (路径: {webhook_path})")
+        return
+
+    chat_ids_list = schedule["chat_ids"] 
+    message_formatted = render_schedule_message(schedule["message"]) # 每次广播只渲染一次
+    
+    logger.info(f"Bot (路径: {webhook_path}) 正在发送定时消息到 {len(chat_ids_list)} 个 Chats...")
+
+    engine = BROADCAST_ENGINES.get(webhook_path)
+    if engine is None:
+        engine = BROADCAST_ENGINES[webhook_path] = BroadcastEngine(webhook_path)
+    hold_bot(webhook_path) # (广播期间不会被空闲回收)
+    try:
+        application = await activate_bot(webhook_path)
+        result = await engine.broadcast(application, chat_ids_list, message_formatted)
+    finally:
+        release_bot(webhook_path)
+    logger.info(f"Bot (路径: {webhook_path}) 定时广播完成: 成功 {result['sent']}，失败 {result['failed']}，重试 {result['retries']}，耗时 {result['duration_seconds']} 秒。")
 # --- ⬆️ 后台调度器 ⬆️ ---
 
 
@@ -582,214 +3228,328 @@ async def background_scheduler():
 async def startup_event():
     """在 FastAPI 启动时：1. 初始化 Bot 2. 启动 Playwright 3. 启动调度器"""
     
-    global BOT_APPLICATIONS, BOT_API_URLS, BOT_APK_URLS, BOT_SCHEDULES, BOT_ALLOWED_CHATS, PLAYWRIGHT_INSTANCE, BROWSER_INSTANCE
+    global BOT_APPLICATIONS, BOT_CONFIGS, BOT_SCHEDULES, HTTP_CLIENT, STARTUP_COMPLETE
+    startup_started = time.perf_counter()
     # --- ⬇️ 新增：初始化全局字典 ⬇️ ---
-    global GLOBAL_IMAGE_MAP, GLOBAL_IMAGE_PATTERN, GLOBAL_VIDEO_MAP, GLOBAL_VIDEO_PATTERN
+    global GLOBAL_IMAGE_MAP, GLOBAL_VIDEO_MAP, KEYWORD_INDEX
     # --- ⬆️ 新增 ⬆️ ---
 
     BOT_APPLICATIONS = {}
-    BOT_API_URLS = {}
-    BOT_APK_URLS = {}
+    BOT_CONFIGS = {} # <-- 包含 API/APK/定时任务/智能安全白名单
     BOT_SCHEDULES = {} 
-    BOT_ALLOWED_CHATS = {} # <-- 智能安全白名单
     # --- ⬇️ 新增：初始化全局字典 ⬇️ ---
     GLOBAL_IMAGE_MAP = {}
-    GLOBAL_IMAGE_PATTERN = ""
     GLOBAL_VIDEO_MAP = {}
-    GLOBAL_VIDEO_PATTERN = ""
     # --- ⬆️ 新增 ⬆️ ---
 
     logger.info("应用启动中... 正在查找所有 Bot 和全局配置。")
 
-    # --- ⬇️ 新增：首先加载全局图片配置 ⬇️ ---
-    all_global_image_keys = []
-    for i in range(1, 11): # 最多支持 10 个全局图片 (IMAGE_1 ... IMAGE_10)
-        keys_name = f"IMAGE_{i}_KEYS"
-        url_name = f"IMAGE_{i}_URL"
-        
-        keys_str = os.getenv(keys_name)
-        url_value = os.getenv(url_name)
-        
-        if keys_str and url_value:
-            keys_list = [k.strip() for k in keys_str.split(',') if k.strip()]
-            if keys_list:
-                logger.info(f"DIAGNOSTIC: 已加载 [全局图片 {i}]: 关键字 {keys_list} -> {url_value}")
-                for key in keys_list:
-                    GLOBAL_IMAGE_MAP[key] = url_value
-                all_global_image_keys.extend(keys_list)
-            else:
-                logger.warning(f"DIAGNOSTIC: {keys_name} 已设置，但关键字列表为空。")
-        elif (keys_str or url_value) and not (keys_str and url_value): # (只设置了其中一个)
-             logger.warning(f"DIAGNOSTIC: 必须同时提供 {keys_name} 和 {url_name} 才能加载图片 {i}。")
-
-    if all_global_image_keys:
-        escaped_keys = [re.escape(k) for k in all_global_image_keys]
-        GLOBAL_IMAGE_PATTERN = r"^(" + "|".join(escaped_keys) + r")$"
-        logger.info(f"✅ 成功构建 [全局图片 Regex 模式]: {GLOBAL_IMAGE_PATTERN}")
+    # --- ⬇️ 新增：启动共享 HTTP 客户端 ⬇️ ---
+    HTTP_CLIENT = create_http_client()
+    logger.info(f"共享 HTTP 客户端已启动 (连接超时 {HTTP_CONNECT_TIMEOUT}s, 读取超时 {HTTP_READ_TIMEOUT}s, 每主机并发 {HTTP_PER_HOST_LIMIT})。")
+    # --- ⬆️ 新增 ⬆️ ---
+
+    # --- ⬇️ 新增：加载 file_id 缓存 ⬇️ ---
+    MEDIA_CACHE.load()
+    # --- ⬆️ 新增 ⬆️ ---
+
+    # --- ⬇️ 新增：加载内容文件 (关键字索引、指南、全局图片/视频，并报告冲突) ⬇️ ---
+    reload_content("启动")
+    # --- ⬆️ 新增 ⬆️ ---
+
+
+    # --- ⬇️ 接下来，登记所有 Bot (BOT_TOKEN_n 环境变量 + 可选的 BOTS_FILE，数量不限) ⬇️ ---
+    specs = env_bot_specs()
+    if BOTS_FILE:
+        try:
+            specs += file_bot_specs(BOTS_FILE, max((spec["index"] for spec in specs), default=0) + 1)
+        except Exception as e:
+            logger.error(f"❌ 读取 Bot 列表文件 {BOTS_FILE} 失败: {e}")
+    for spec in specs:
+        try:
+            register_bot(spec)
+        except Exception as e: # (一个 Bot 的配置错误不影响其他 Bot 启动)
+            logger.error(f"❌ Bot #{spec.get('index')} 配置错误，已忽略: {e}")
+    STARTUP_TIMINGS["config_seconds"] = round(time.perf_counter() - startup_started, 3)
+
+    if not BOT_CONFIGS:
+        logger.error("❌ 未找到任何有效的 Bot Token。")
+    elif BOT_LAZY_INIT:
+        logger.info(f"✅ 已登记 {len(BOT_CONFIGS)} 个 Bot，Application 将在首次收到 Webhook 时初始化 (BOT_LAZY_INIT=1)。")
     else:
-        logger.info("DIAGNOSTIC: 未配置任何全局图片。")
+        # 并发初始化所有 Bot (每个 initialize() 都要请求一次 getMe)；失败的 Bot 会在下次收到 Webhook 时重试
+        bots_started = time.perf_counter()
+        await asyncio.gather(*(activate_bot(path) for path in BOT_CONFIGS), return_exceptions=True)
+        STARTUP_TIMINGS["bots_seconds"] = round(time.perf_counter() - bots_started, 3)
+        logger.info(f"✅ 成功初始化 {len(BOT_APPLICATIONS)}/{len(BOT_CONFIGS)} 个 Bot 实例 (并发，耗时 {STARTUP_TIMINGS['bots_seconds']}s)。")
     # --- ⬆️ 新增 ⬆️ ---
 
-    # --- ⬇️ 新增：加载全局视频配置 ⬇️ ---
-    all_global_video_keys = []
-    for i in range(1, 11): # 最多支持 10 个全局视频 (VIDEO_1 ... VIDEO_10)
-        keys_name = f"VIDEO_{i}_KEYS"
-        url_name = f"VIDEO_{i}_URL"
-        
-        keys_str = os.getenv(keys_name)
-        url_value = os.getenv(url_name)
-        
-        if keys_str and url_value:
-            keys_list = [k.strip() for k in keys_str.split(',') if k.strip()]
-            if keys_list:
-                logger.info(f"DIAGNOSTIC: 已加载 [全局视频 {i}]: 关键字 {keys_list} -> {url_value}")
-                for key in keys_list:
-                    GLOBAL_VIDEO_MAP[key] = url_value
-                all_global_video_keys.extend(keys_list)
-            else:
-                logger.warning(f"DIAGNOSTIC: {keys_name} 已设置，但关键字列表为空。")
-        elif (keys_str or url_value) and not (keys_str and url_value): # (只设置了其中一个)
-             logger.warning(f"DIAGNOSTIC: 必须同时提供 {keys_name} 和 {url_name} 才能加载视频 {i}。")
-
-    if all_global_video_keys:
-        escaped_keys = [re.escape(k) for k in all_global_video_keys]
-        GLOBAL_VIDEO_PATTERN = r"^(" + "|".join(escaped_keys) + r")$"
-        logger.info(f"✅ 成功构建 [全局视频 Regex 模式]: {GLOBAL_VIDEO_PATTERN}")
+    # 6.2 启动 Playwright (大部分指令是静态指南，不需要浏览器，默认不阻塞启动)
+    if BROWSER_STARTUP == "eager":
+        await start_browser()
+    elif BROWSER_STARTUP == "lazy":
+        logger.info("浏览器将在首次需要时启动 (BROWSER_STARTUP=lazy)。")
     else:
-        logger.info("DIAGNOSTIC: 未配置任何全局视频。")
+        spawn_background(start_browser())
+        logger.info("浏览器正在后台预热 (BROWSER_STARTUP=background)。")
+
+    # --- ⬇️ 新增：后台更新队列 (每个 Bot 初始化时创建) ⬇️ ---
+    if WEBHOOK_ASYNC:
+        logger.info(f"Webhook 快速确认模式已启用: 每个 Bot 队列 {WEBHOOK_QUEUE_SIZE}, worker {WEBHOOK_WORKERS}, 满载策略 {WEBHOOK_QUEUE_OVERFLOW}。")
     # --- ⬆️ 新增 ⬆️ ---
 
+    # --- ⬇️ 新增：后台预热媒体 file_id ⬇️ ---
+    if MEDIA_CACHE_CHAT_ID and (GLOBAL_IMAGE_MAP or GLOBAL_VIDEO_MAP):
+        logger.info(f"媒体缓存：每个 Bot 初始化后在后台预热 (目标 Chat: {MEDIA_CACHE_CHAT_ID})。")
+    # --- ⬆️ 新增 ⬆️ ---
 
-    # --- ⬇️ 接下来，加载所有 Bot (和之前一样) ⬇️ ---
-    for i in range(1, 10): 
-        token_name = f"BOT_TOKEN_{i}"
-        token_value = os.getenv(token_name)
-        
-        # 只要有 Token，就加载 Bot
-        if token_value:
-            logger.info(f"DIAGNOSTIC: D 发现 Bot #{i}: Token (尾号: {token_value[-4:]})")
-            
-            application = Application.builder().token(token_value).build()
-            application.bot_data["fastapi_app"] = app
-            
-            await application.initialize()
-            
-            # (setup_bot 现在会*自动*添加全局图片/视频处理器)
-            setup_bot(application, i)
-            
-            webhook_path = f"bot{i}_webhook"
-            BOT_APPLICATIONS[webhook_path] = application
-            
-            # 1. 加载 API URL (用于通用链接)
-            api_url_name = f"BOT_{i}_API_URL"
-            api_url_value = os.getenv(api_url_name)
-            if api_url_value:
-                BOT_API_URLS[webhook_path] = api_url_value 
-                logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [通用链接 API]: {api_url_value}")
-            else:
-                 logger.warning(f"DIAGNOSTIC: Bot #{i} 未找到 {api_url_name}。[通用链接] 功能将无法工作。")
-
-            # 2. 加载 APK URL (用于安卓专用链接)
-            apk_url_name = f"BOT_{i}_APK_URL"
-            apk_url_value = os.getenv(apk_url_name)
-            if apk_url_value:
-                BOT_APK_URLS[webhook_path] = apk_url_value
-                logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [安卓专用模板]: {apk_url_value}")
-            else:
-                logger.warning(f"DIAGNOSTIC: Bot #{i} 未找到 {apk_url_name}。[安卓专用链接] 功能将无法工作。")
+    # --- ⬇️ 新增：监视内容文件，修改后自动热重载 (无需重启 Bot 或浏览器) ⬇️ ---
+    if CONTENT_WATCH_INTERVAL > 0:
+        spawn_background(watch_content_file())
+        logger.info(f"内容文件热重载已启用: 每 {CONTENT_WATCH_INTERVAL:.0f}s 检查 {CONTENT_FILE}。")
+    # --- ⬆️ 新增 ⬆️ ---
 
-            # 3. 加载固定时间点配置
-            schedule_chat_ids_str = os.getenv(f"BOT_{i}_SCHEDULE_CHAT_ID") 
-            schedule_times_str = os.getenv(f"BOT_{i}_SCHEDULE_TIMES_UTC")
-            schedule_message = os.getenv(f"BOT_{i}_SCHEDULE_MESSAGE")
+    # --- ⬇️ 新增：浏览器守护 ⬇️ ---
+    if BROWSER_WATCHDOG_INTERVAL > 0:
+        spawn_background(supervise_browser())
+    # --- ⬆️ 新增 ⬆️ ---
 
-            if schedule_chat_ids_str and schedule_times_str and schedule_message:
-                try:
-                    times_list = [t.strip() for t in schedule_times_str.split(',') if t.strip()]
-                    if not times_list: raise ValueError("时间列表为空")
-                    chat_ids_list = [cid.strip() for cid in schedule_chat_ids_str.split(',') if cid.strip()]
-                    if not chat_ids_list: raise ValueError("Chat ID 列表为空")
-
-                    BOT_SCHEDULES[webhook_path] = {
-                        "chat_ids": chat_ids_list, 
-                        "times": times_list, 
-                        "message": schedule_message,
-                        "last_sent": None 
-                    }
-                    logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [定时任务]: 在 UTC {times_list} 发送到 {len(chat_ids_list)} 个 Chat(s)")
-                except Exception as e:
-                    logger.error(f"Bot #{i} 的定时任务配置错误: {e}")
-            else:
-                logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 未配置定时任务。")
-
-            # 4. 加载安全白名单
-            allowed_chats_name = f"BOT_{i}_ALLOWED_CHAT_IDS"
-            allowed_chats_str = os.getenv(allowed_chats_name)
-            if allowed_chats_str:
-                chat_ids_list = [cid.strip() for cid in allowed_chats_str.split(',') if cid.strip()]
-                BOT_ALLOWED_CHATS[webhook_path] = chat_ids_list
-                logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已加载 [安全白名单]: 允许 {len(chat_ids_list)} 个 Chat(s)")
-            else:
-                logger.warning(f"DIAGNOSTIC: Bot #{i} 未找到 {allowed_chats_name}。此 Bot 将 [不会] 响应任何群组或私聊的指令。")
-                
-            # (删除了每-Bot-图片加载)
-                
-            logger.info(f"Bot #{i} (尾号: {token_value[-4:]}) 已创建并初始化。监听路径: /{webhook_path}")
+    # --- ⬇️ 新增：回收空闲的 Bot Application ⬇️ ---
+    if BOT_IDLE_TIMEOUT > 0 and BOT_CONFIGS:
+        spawn_background(evict_idle_bots())
+        logger.info(f"空闲 Bot 回收已启用: 空闲超过 {BOT_IDLE_TIMEOUT:.0f}s 的 Application 会被关闭。")
+    # --- ⬆️ 新增 ⬆️ ---
 
-    if not BOT_APPLICATIONS:
-        logger.error("❌ 未找到任何有效的 Bot Token。")
-    else:
-        logger.info(f"✅ 成功初始化 {len(BOT_APPLICATIONS)} 个 Bot 实例。")
+    # --- ⬇️ 新增：事件循环延迟监控 (用于 /metrics) ⬇️ ---
+    spawn_background(monitor_event_loop_lag())
+    # --- ⬆️ 新增 ⬆️ ---
 
-    # 6.2 启动 Playwright
-    logger.info("正在启动全局 Playwright 实例...")
-    try:
-        PLAYWRIGHT_INSTANCE = await async_playwright().start()
-        BROWSER_INSTANCE = await PLAYWRIGHT_INSTANCE.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-setuid-sandbox"]
-        )
-        app.state.browser = BROWSER_INSTANCE 
-        logger.info("🎉 全局 Playwright Chromium 浏览器启动成功！")
-    except Exception as e:
-        logger.error(f"❌ 启动 Playwright 失败: {e}")
-        logger.error("服务将启动，但 Playwright 功能将无法工作！")
+    # --- ⬇️ 新增：启动解析缓存的后台刷新任务 ⬇️ ---
+    if LINK_CACHE.enabled:
+        spawn_background(LINK_CACHE.run_refresher())
+        logger.info(f"解析缓存已启用 (TTL {LINK_CACHE_TTL}s, stale {LINK_CACHE_STALE_TTL}s, 提前刷新 {LINK_CACHE_REFRESH_AHEAD}s)。")
+    if LINK_INVENTORY.enabled:
+        logger.info(f"链接库存已启用 (每个 Bot {LINK_INVENTORY.capacity} 个, 低水位 {LINK_INVENTORY.low_water}, TTL {LINK_INVENTORY_TTL}s)。")
+    # --- ⬆️ 新增 ⬆️ ---
 
     # 启动后台调度器
-    logger.info("正在启动后台定时任务调度器...")
-    asyncio.create_task(background_scheduler())
+    logger.info(f"正在启动后台定时任务调度器... (状态后端: {STATE_BACKEND}, worker: {WORKER_ID})")
+    if BOT_SCHEDULES:
+        spawn_background(run_scheduler_with_lease())
 
-    logger.info("🎉 核心服务启动完成。等待 Telegram 的 Webhook 消息...")
+    STARTUP_TIMINGS["total_seconds"] = round(time.perf_counter() - startup_started, 3)
+    STARTUP_COMPLETE = True
+    logger.info(f"🎉 核心服务启动完成 (耗时 {STARTUP_TIMINGS['total_seconds']}s: {STARTUP_TIMINGS})。等待 Telegram 的 Webhook 消息...")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """在 FastAPI 关闭时，优雅地关闭浏览器和 Playwright"""
+    global SHUTTING_DOWN
     logger.info("应用关闭中...")
+    SHUTTING_DOWN = True
+    if SCHEDULER_IS_LEADER:
+        await STATE.release_lease("scheduler", WORKER_ID)
+    for webhook_path in list(BOT_APPLICATIONS):
+        await deactivate_bot(webhook_path) # (先停止更新队列，再关闭 Application)
+    if TELEGRAM_REQUEST is not None:
+        await TELEGRAM_REQUEST.close()
+        logger.info("共享 Telegram 连接池已关闭。")
+    if PAGE_POOL:
+        await PAGE_POOL.close()
+        logger.info("页面池已关闭。")
     if BROWSER_INSTANCE:
-        await BROWSER_INSTANCE.close()
+        await BROWSER_INSTANCE.close() # (CDP 模式下只断开连接，共享浏览器继续运行)
         logger.info("全局浏览器已关闭。")
     if PLAYWRIGHT_INSTANCE:
         await PLAYWRIGHT_INSTANCE.stop()
         logger.info("Playwright 实例已停止。")
+    if HTTP_CLIENT:
+        await HTTP_CLIENT.aclose()
+        logger.info("共享 HTTP 客户端已关闭。")
+    await MEDIA_CACHE.flush()
+    await STATE.close()
     logger.info("应用关闭完成。")
 
+# --- ⬇️ 新增：Webhook 原始请求体预过滤 (不相关的更新在完整反序列化之前直接返回 200) ⬇️ ---
+WEBHOOK_PREFILTER = os.getenv("WEBHOOK_PREFILTER", "1") == "1" # 1 = 只有命中关键字 (或 /start) 且在白名单内的消息才会反序列化和分发
+
+try:
+    import orjson # (可选依赖，安装后解析更快)
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+START_COMMAND_RE = re.compile(r"/start(?:@\w+)?(?:\s|$)", re.IGNORECASE)
+
+PREFILTER_RESULTS = register_metric(Counter("tgbot_webhook_prefilter_total", "Webhook 预过滤结果 (passed / no_message / no_text / not_keyword / unauthorized)", ("bot", "result")))
+
+class PrefilterStats:
+    """预过滤的跳过比例和节省的时间 (按通过的更新 de_json 的平均耗时估算，是下限：还省掉了 Bot 初始化和处理器遍历)"""
+
+    def __init__(self):
+        self.passed = 0
+        self.skipped = 0
+        self.prefilter_seconds = 0.0
+        self.de_json_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.passed + self.skipped
+        avg_de_json = self.de_json_seconds / self.passed if self.passed else 0.0
+        return {
+            "enabled": WEBHOOK_PREFILTER,
+            "json": json_loads.__module__,
+            "passed": self.passed,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / total, 3) if total else None,
+            "avg_prefilter_us": round(self.prefilter_seconds / total * 1e6, 1) if total else None,
+            "avg_de_json_us": round(avg_de_json * 1e6, 1) if self.passed else None,
+            "estimated_saved_seconds": round(self.skipped * avg_de_json, 3),
+        }
+
+PREFILTER_STATS = PrefilterStats()
+
+def prefilter_update(config: BotConfig, update_data: Any) -> str | None:
+    """
+    只看 message.text 和 chat.id，判断这条更新是否需要处理。
+    返回跳过的原因；返回 None 表示需要完整处理 (与 dispatch_keyword / start_command 的判断一致)。
+    """
+    if not isinstance(update_data, dict):
+        return None # (交给原来的流程报错)
+    message = update_data.get("message")
+    if not isinstance(message, dict):
+        return "no_message" # (编辑的消息、频道消息、成员变动等：没有处理器)
+    text = message.get("text")
+    if not isinstance(text, str):
+        return "no_text"
+    if KEYWORD_INDEX.get(normalize_keyword(text)) is None and not START_COMMAND_RE.match(text):
+        return "not_keyword"
+    chat_id = (message.get("chat") or {}).get("id")
+    if chat_id not in config.allowed_chat_ids:
+        logger.warning(f"Bot (尾号: {config.token_end}) 收到来自 [未授权] Chat ID: {chat_id} 的请求。已忽略。")
+        return "unauthorized"
+    return None
+# --- ⬆️ 新增 ⬆️ ---
+
 # --- 7. 动态 Webhook 路由 (与之前相同, 100% 正确) ---
 @app.post("/{webhook_path}")
 async def handle_webhook(webhook_path: str, request: Request):
-    if webhook_path not in BOT_APPLICATIONS:
+    config = BOT_CONFIGS.get(webhook_path)
+    if config is None:
         logger.warning(f"收到未知路径的请求: /{webhook_path}")
         return Response(status_code=404) 
-    application = BOT_APPLICATIONS[webhook_path]
+    update_id = None
+    started = time.perf_counter()
+    hold_bot(webhook_path) # (处理期间不会被空闲回收)
     try:
-        update_data = await request.json()
+        update_data = json_loads(await request.body())
+        # --- ⬇️ 新增：预过滤，不相关/未授权的更新不初始化 Bot、不反序列化 ⬇️ ---
+        if WEBHOOK_PREFILTER:
+            skip_reason = prefilter_update(config, update_data)
+            PREFILTER_STATS.prefilter_seconds += time.perf_counter() - started
+            PREFILTER_RESULTS.inc((webhook_path, skip_reason or "passed"))
+            if skip_reason is not None:
+                PREFILTER_STATS.skipped += 1
+                return Response(status_code=200)
+            PREFILTER_STATS.passed += 1
+        # --- ⬆️ 新增 ⬆️ ---
+        # --- ⬇️ 新增：在反序列化之前丢弃重投的 update_id ⬇️ ---
+        update_id = update_data.get("update_id")
+        if isinstance(update_id, int):
+            deduplicator = UPDATE_DEDUP.get(webhook_path)
+            if deduplicator is None:
+                deduplicator = UPDATE_DEDUP[webhook_path] = UpdateDeduplicator(UPDATE_DEDUP_WINDOW)
+            duplicate = deduplicator.is_duplicate(update_id)
+            if not duplicate and STATE.shared:
+                # 多 worker：重投可能落到另一个 worker 上
+                duplicate = not await STATE.add(f"update:{webhook_path}:{update_id}", WORKER_ID, ttl=UPDATE_DEDUP_TTL)
+                if duplicate:
+                    deduplicator.duplicates += 1
+            if duplicate:
+                logger.info(f"丢弃重复的更新 update_id={update_id} (路径: /{webhook_path})")
+                return Response(status_code=200)
+        # --- ⬆️ 新增 ⬆️ ---
+        application = await activate_bot(webhook_path) # (首次收到该 Bot 的 Webhook 时初始化)
+        de_json_started = time.perf_counter()
         update = Update.de_json(update_data, application.bot)
+        PREFILTER_STATS.de_json_seconds += time.perf_counter() - de_json_started
+        # --- ⬇️ 新增：快速确认模式，入队后立即返回 ⬇️ ---
+        update_queue = UPDATE_QUEUES.get(webhook_path)
+        if update_queue is not None:
+            if update_queue.offer(update):
+                return Response(status_code=200)
+            logger.warning(f"更新队列已满 (路径: /{webhook_path})，策略: {WEBHOOK_QUEUE_OVERFLOW}")
+            if WEBHOOK_QUEUE_OVERFLOW == "drop":
+                return Response(status_code=200) # 丢弃，避免 Telegram 重投加重负载
+            return Response(status_code=503) # 背压：让 Telegram 稍后重投
+        # --- ⬆️ 新增 ⬆️ ---
         await application.process_update(update)
+        UPDATE_SECONDS.observe(time.perf_counter() - started, (webhook_path,))
         return Response(status_code=200) # OK
     except Exception as e:
         logger.error(f"处理 Webhook 请求失败 (路径: /{webhook_path})：{e}")
+        if isinstance(update_id, int) and webhook_path in UPDATE_DEDUP:
+            UPDATE_DEDUP[webhook_path].forget(update_id)
+            if STATE.shared:
+                await STATE.delete(f"update:{webhook_path}:{update_id}")
+        record_telegram_error(webhook_path, e)
         return Response(status_code=500) 
+    finally:
+        release_bot(webhook_path)
+        WEBHOOK_SECONDS.observe(time.perf_counter() - started, (webhook_path,))
+
+# --- ⬇️ 新增：Prometheus 指标路由 ⬇️ ---
+register_metric(Gauge("tgbot_browser_pages_open", "当前已租出的 Playwright 页面数", (), lambda: [((), PAGE_POOL.leased if PAGE_POOL else 0)]))
+register_metric(Gauge("tgbot_browser_memory_bytes", "本地 Chromium 进程内存 (PSS) 总和", (), lambda: [((), BROWSER_MEMORY["bytes"])] if BROWSER_MEMORY["bytes"] is not None else []))
+register_metric(Gauge("tgbot_browser_pages_waiting", "正在等待空闲页面的请求数", (), lambda: [((), PAGE_POOL.waiting if PAGE_POOL else 0)]))
+register_metric(Gauge("tgbot_bots_configured", "已登记的 Bot 数", (), lambda: [((), len(BOT_CONFIGS))]))
+register_metric(Gauge("tgbot_bots_active", "已初始化 (未被回收) 的 Bot Application 数", (), lambda: [((), len(BOT_APPLICATIONS))]))
+register_metric(Gauge("tgbot_link_resolutions_in_flight", "正在进行的 [通用链接] 实时解析数 (所有 Bot)", (), lambda: [((), len(RESOLVE_FLIGHTS))]))
+register_metric(Gauge("tgbot_link_inventory_depth", "预先解析好的 域名 B 库存数", ("bot",), LINK_INVENTORY.depths))
+register_metric(Gauge("tgbot_update_queue_depth", "后台更新队列积压数", ("bot",), lambda: [((path,), q.depth) for path, q in UPDATE_QUEUES.items()]))
+register_metric(Gauge("tgbot_duplicate_updates_dropped", "被丢弃的重复更新数", ("bot",), lambda: [((path,), d.duplicates) for path, d in UPDATE_DEDUP.items()]))
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+# --- ⬆️ 新增 ⬆️ ---
+
+# --- ⬇️ 新增：管理接口 ⬇️ ---
+def is_admin_request(request: Request) -> bool:
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+@app.post("/admin/reload-content")
+async def admin_reload_content(request: Request):
+    """立即重新加载内容文件 (只作用于收到请求的 worker；其他 worker 由文件监视自动重载)"""
+    if not is_admin_request(request):
+        return Response(status_code=403)
+    result = reload_content("管理接口")
+    return JSONResponse(result, status_code=200 if result["ok"] else 400)
+# --- ⬆️ 新增 ⬆️ ---
 
 # --- 8. 健康检查路由 (与之前相同, 100% 正确) ---
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：分别报告各子系统；浏览器只有在 BROWSER_STARTUP=eager 时才影响就绪状态"""
+    browser = browser_startup_status()
+    subsystems = {
+        "bots": {
+            "ready": bool(BOT_CONFIGS) and (BOT_LAZY_INIT or bool(BOT_APPLICATIONS)),
+            "configured": len(BOT_CONFIGS),
+            "active": len(BOT_APPLICATIONS),
+            "lazy_init": BOT_LAZY_INIT,
+            "failed": BOT_INIT_FAILURES,
+        },
+        "http_client": {"ready": HTTP_CLIENT is not None},
+        "update_queues": {"ready": not WEBHOOK_ASYNC or set(UPDATE_QUEUES) == set(BOT_APPLICATIONS), "enabled": WEBHOOK_ASYNC},
+        "browser": {**browser, "ready": browser["state"] == "ready", "required": BROWSER_STARTUP == "eager"},
+        "scheduler": {"ready": True, "configured": len(BOT_SCHEDULES), "leader": SCHEDULER_IS_LEADER},
+    }
+    ready = STARTUP_COMPLETE and all(s["ready"] for s in subsystems.values() if s.get("required", True))
+    return JSONResponse(
+        {"ready": ready, "startup_complete": STARTUP_COMPLETE, "startup_timings": STARTUP_TIMINGS, "subsystems": subsystems},
+        status_code=200 if ready else 503,
+    )
+
 @app.get("/")
 async def root():
     browser_status = "未运行"
@@ -797,29 +3557,53 @@ async def root():
         browser_status = f"运行中 (Version: {BROWSER_INSTANCE.version})"
 
     active_bots_info = {}
-    for path, app in BOT_APPLICATIONS.items():
+    for path, config in BOT_CONFIGS.items():
         schedule_info = "未配置"
-        if BOT_SCHEDULES.get(path):
-            schedule_info = f"配置于 UTC {BOT_SCHEDULES[path]['times']} -> {len(BOT_SCHEDULES[path]['chat_ids'])} 个 Chat(s)" 
+        if config.schedule:
+            schedule_info = f"配置于 UTC {config.schedule['times']} -> {len(config.schedule['chat_ids'])} 个 Chat(s)" 
         
         allowed_info = "未配置 (不响应任何指令)"
-        if BOT_ALLOWED_CHATS.get(path):
-            allowed_info = f"已配置 (允许 {len(BOT_ALLOWED_CHATS[path])} 个 Chat(s))"
+        if config.allowed_chats_configured:
+            allowed_info = f"已配置 (允许 {config.allowed_chats_configured} 个 Chat(s))"
         
         active_bots_info[path] = {
-            "token_end": app.bot.token[-4:],
-            "api_url_universal": BOT_API_URLS.get(path, "未设置!"),
-            "api_url_android_apk": BOT_APK_URLS.get(path, "未设置!"),
+            "token_end": config.token_end,
+            "active": path in BOT_APPLICATIONS,
+            "api_url_universal": config.api_url or "未设置!",
+            "api_url_android_apk": config.apk_template or "未设置!",
             "schedule_info": schedule_info,
             "security_allowlist": allowed_info,
+            "link_rate_limit": {"per_chat": str(config.chat_limit), "per_bot": str(config.bot_limit)},
         }
     status = {
         "status": "OK",
         "message": "Telegram Multi-Bot (Playwright JS + Scheduler + Security) service is running.",
         "browser_status": browser_status,
+        "browser_startup": browser_startup_status(),
+        "startup_timings": STARTUP_TIMINGS,
+        "browser_mode": f"共享浏览器服务 (CDP: {BROWSER_CDP_URL})" if BROWSER_CDP_URL else "本地 Chromium",
+        "browser_reconnects": BROWSER_RECONNECTS,
+        "browser_supervisor": browser_supervisor_stats(),
+        "page_pool": PAGE_POOL.stats() if PAGE_POOL else "未启动",
+        "link_cache": LINK_CACHE.stats(),
+        "link_inventory": LINK_INVENTORY.stats(),
+        "link_admission": LINK_ADMISSION.stats(),
+        "resolver_hosts": {host: st.to_dict() for host, st in RESOLVER_HOST_STATS.items()},
+        "resolve_coalescing": {"by_bot": RESOLVE_FLIGHTS.stats(), "by_domain_a": NAVIGATION_FLIGHTS.stats()},
+        "configured_bots_count": len(BOT_CONFIGS),
         "active_bots_count": len(BOT_APPLICATIONS),
+        "bot_activation": {"lazy": BOT_LAZY_INIT, "idle_timeout_seconds": BOT_IDLE_TIMEOUT, **BOT_ACTIVATIONS.stats()},
         "global_images_loaded": len(GLOBAL_IMAGE_MAP), # <-- 新增
         "global_videos_loaded": len(GLOBAL_VIDEO_MAP), # <-- 新增
+        "content": content_stats(),
+        "media_file_id_cache": MEDIA_CACHE.stats(),
+        "worker": {"id": WORKER_ID, "state_backend": STATE_BACKEND, "scheduler_leader": SCHEDULER_IS_LEADER},
+        "scheduler": SCHEDULE_TIMER.stats(),
+        "last_broadcasts": {path: e.last_result for path, e in BROADCAST_ENGINES.items()},
+        "webhook_prefilter": PREFILTER_STATS.stats(),
+        "telegram_transport": TELEGRAM_TRANSPORT_STATS.stats(),
+        "update_dedup": {path: d.stats() for path, d in UPDATE_DEDUP.items()},
+        "update_queues": {path: q.stats() for path, q in UPDATE_QUEUES.items()} if WEBHOOK_ASYNC else "未启用",
         "active_bots_info": active_bots_info
     }
     return status
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import main
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = [] # (chat_id, 发送时刻)
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.sent.append((chat_id, time.monotonic()))
+
+
+def broadcast(monkeypatch, chat_ids, **rates):
+    for name, value in rates.items():
+        monkeypatch.setattr(main, name, value)
+    bot = FakeBot()
+    engine = main.BroadcastEngine("/webhook/bot1")
+    started = time.monotonic()
+    result = asyncio.run(engine.broadcast(SimpleNamespace(bot=bot), chat_ids, "hi"))
+    return result, [at - started for _, at in bot.sent]
+
+
+def test_global_rate_paces_after_burst(monkeypatch):
+    chat_ids = [str(1000 + i) for i in range(15)]
+    result, offsets = broadcast(monkeypatch, chat_ids, BROADCAST_GLOBAL_RATE=20.0, BROADCAST_CHAT_RATE=1.0, BROADCAST_CONCURRENCY=15)
+    assert result["sent"] == 15 and result["failed"] == 0
+    offsets.sort()
+    assert offsets[9] < 0.1 # (前 capacity=20 个令牌立即可用)
+    assert offsets[-1] < 0.5
+
+
+def test_group_chat_rate_spaces_messages(monkeypatch):
+    result, offsets = broadcast(monkeypatch, ["-1001", "-1001", "-1001"], BROADCAST_GLOBAL_RATE=100.0, BROADCAST_GROUP_RATE_PER_MIN=600.0)
+    assert result["sent"] == 3
+    offsets.sort()
+    assert offsets[1] - offsets[0] >= 0.08 # (10 条/秒 => 约 0.1 秒一条)
+    assert offsets[2] - offsets[1] >= 0.08
+
+
+def test_zero_rates_mean_unlimited(monkeypatch):
+    chat_ids = ["-1001", "-1001", "42", "42"]
+    result, offsets = broadcast(monkeypatch, chat_ids, BROADCAST_GLOBAL_RATE=0.0, BROADCAST_GROUP_RATE_PER_MIN=0.0, BROADCAST_CHAT_RATE=0.0)
+    assert result["sent"] == 4 and result["failed"] == 0
+    assert max(offsets) < 0.1
+
+
+def test_fractional_rate_bucket_still_refills():
+    bucket = main.TokenBucket(0.5, 0.5)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
@@ -0,0 +1,38 @@
+import json
+
+import main
+
+
+def write_content(path, guide_name, keywords):
+    path.write_text(json.dumps({
+        "links": {"universal": ["链接", "地址", "最新链接"], "android_apk": ["安卓专用"]},
+        "guides": [{"name": guide_name, "keywords": keywords, "html": "<b>步骤</b>"}],
+    }, ensure_ascii=False), encoding="utf-8")
+
+
+def test_help_text_follows_reloaded_content(tmp_path, monkeypatch):
+    content_file = tmp_path / "content.json"
+    for name in ("CONTENT", "KEYWORD_INDEX", "GLOBAL_IMAGE_MAP", "GLOBAL_VIDEO_MAP", "CONTENT_RELOADS"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "CONTENT_FILE", str(content_file))
+    monkeypatch.setenv("IMAGE_1_KEYS", "教程图")
+    monkeypatch.setenv("IMAGE_1_URL", "https://example.com/a.png")
+
+    write_content(content_file, "苹果大退", ["苹果大退"])
+    assert main.reload_content("test")["ok"]
+    assert main.CONTENT.help_text.splitlines()[:3] == [
+        "- 发送 `链接`、`地址` 等获取通用链接。",
+        "- 发送 `安卓专用` 获取安卓 APK 链接。",
+        "- 发送 `苹果大退` 获取[苹果大退]指南。",
+    ]
+    assert "- 发送 `教程图` 获取图片" in main.CONTENT.help_text
+
+    write_content(content_file, "清理缓存", ["清理缓存", "清缓存"])
+    assert main.reload_content("test")["ok"]
+    assert "苹果大退" not in main.CONTENT.help_text
+    assert "- 发送 `清理缓存`、`清缓存` 获取[清理缓存]指南。" in main.CONTENT.help_text
+
+
+def test_help_text_escapes_keywords():
+    registry = main.compile_content({"links": {"universal": ["<链接>"]}}, None)
+    assert "`&lt;链接&gt;`" in registry.help_text
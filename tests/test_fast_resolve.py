@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+BASE = "http://a.example/start"
+
+
+def test_single_meta_refresh_target():
+    html = '<html><head><meta http-equiv="refresh" content="0; url=https://b.example/landing"></head></html>'
+    assert main.find_html_redirect(html, BASE) == "https://b.example/landing"
+
+
+def test_single_js_target_repeated_is_one_target():
+    html = '<script>location.href = "https://b.example/x"; if (!ok) { window.location.replace("https://b.example/x"); }</script>'
+    assert main.find_html_redirect(html, BASE) == "https://b.example/x"
+
+
+def test_user_agent_dependent_targets_are_undecided():
+    html = (
+        "<script>if (/android/i.test(navigator.userAgent)) { location.href = 'https://a.example/android'; }"
+        " else { location.href = 'https://a.example/ios'; }</script>"
+    )
+    assert main.find_html_redirect(html, BASE) is None
+
+
+def test_meta_and_js_disagree_is_undecided():
+    html = '<meta http-equiv="refresh" content="5;url=/slow"><script>location.replace("https://b.example/fast")</script>'
+    assert main.find_html_redirect(html, BASE) is None
+
+
+def test_relative_target_is_resolved_against_page_url():
+    html = '<meta http-equiv="refresh" content="0;URL=\'../next/page\'">'
+    assert main.find_html_redirect(html, "http://a.example/dir/start") == "http://a.example/next/page"
+
+
+def test_no_redirect():
+    assert main.find_html_redirect("<html><body>hello</body></html>", BASE) is None
+
+
+def test_location_without_static_target():
+    html = "<script>var t = ['https:', '', 'b.example'].join('/'); window.location = t;</script>"
+    assert main.find_html_redirect(html, BASE) is None
+
+
+def run_fast_resolve(monkeypatch, pages, **kwargs):
+    """pages: url -> httpx.Response 参数；记录请求头"""
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(**pages[str(request.url)])
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(main, "HTTP_CLIENT", client)
+        monkeypatch.setattr(main, "HTTP_HOST_SEMAPHORES", {})
+        try:
+            return await main.fast_resolve_redirect(BASE)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), seen
+
+
+def html_page(body):
+    return {"status_code": 200, "headers": {"content-type": "text/html"}, "text": body}
+
+
+def test_fast_resolve_follows_multiple_hops(monkeypatch):
+    pages = {
+        BASE: html_page('<meta http-equiv="refresh" content="0; url=/hop">'),
+        "http://a.example/hop": html_page('<script>location.replace("https://b.example/final")</script>'),
+        "https://b.example/final": html_page("<html>landing</html>"),
+    }
+    result, seen = run_fast_resolve(monkeypatch, pages)
+    assert result == "https://b.example/final"
+    assert {r.headers["user-agent"] for r in seen} == {main.BROWSER_USER_AGENT}
+
+
+def test_fast_resolve_escalates_on_ambiguous_page(monkeypatch):
+    pages = {BASE: html_page("<script>location.href = ua ? 'https://b.example/1' : 'https://b.example/2';</script>")}
+    assert run_fast_resolve(monkeypatch, pages)[0] is None
+
+
+def test_fast_resolve_escalates_when_still_on_domain_a(monkeypatch):
+    pages = {BASE: html_page("<html><body>loading...</body></html>")}
+    assert run_fast_resolve(monkeypatch, pages)[0] is None
+
+
+def test_fast_resolve_escalates_on_dynamic_location(monkeypatch):
+    pages = {
+        BASE: {"status_code": 302, "headers": {"location": "https://b.example/js"}},
+        "https://b.example/js": html_page("<script>window.location = pick();</script>"),
+    }
+    assert run_fast_resolve(monkeypatch, pages)[0] is None
+
+
+def test_host_stats_pin_and_reprobe(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(main, "FAST_RESOLVE_SKIP_AFTER", 2)
+    monkeypatch.setattr(main, "FAST_RESOLVE_REPROBE_AFTER", 60.0)
+    stats = main.HostResolveStats()
+
+    stats.record_escalation(5.0)
+    assert stats.try_http()
+    stats.record_escalation(5.0)
+    assert stats.strategy == "browser"
+    assert not stats.try_http()
+
+    clock[0] += 61
+    assert stats.try_http() # (到期后放行一次探测)
+    assert not stats.try_http() # (同一时间只放行一次)
+    stats.record_http(3.0)
+    assert stats.strategy == "http"
+    assert stats.to_dict()["http_reprobes"] == 1
+
+
+def test_fast_resolve_budget_counts_as_escalation(monkeypatch):
+    async def slow(domain_a):
+        await asyncio.sleep(10)
+
+    async def no_browser():
+        return False
+
+    monkeypatch.setattr(main, "fast_resolve_redirect", slow)
+    monkeypatch.setattr(main, "FAST_RESOLVE_BUDGET", 0.05)
+    monkeypatch.setattr(main, "browser_ready", lambda: False)
+    monkeypatch.setattr(main, "start_browser", no_browser)
+    monkeypatch.setattr(main, "RESOLVER_HOST_STATS", {})
+
+    with pytest.raises(main.LinkResolveError):
+        asyncio.run(main.resolve_domain_a_target("http://slow.example/"))
+    assert main.RESOLVER_HOST_STATS["slow.example"].escalations == 1
@@ -0,0 +1,107 @@
+import asyncio
+
+import main
+
+
+def make_config(chat_limit, bot_limit=main.RateLimit(0, 0)):
+    return main.BotConfig(
+        1, "/webhook/bot1", "abcd", "token", None, None, None,
+        frozenset(), 0, chat_limit, bot_limit,
+    )
+
+
+def test_admit_survives_periodic_prune():
+    async def run():
+        admission = main.LinkAdmission(max_in_flight=0, notice_interval=0.0)
+        config = make_config(main.RateLimit(60, 1))
+        results = []
+        for i in range(admission.PRUNE_EVERY * 2 + 1):
+            chat_id = -1000 - i % 8
+            reason = admission.admit(config, chat_id, user_id=i) or admission.admit_resolution(config, chat_id)
+            results.append(reason)
+            admission.finish(config, chat_id, i)
+            if reason is not None:
+                admission.should_notify(config.webhook_path, chat_id)
+        return admission, results
+
+    admission, results = asyncio.run(run())
+    assert results[:8] == [None] * 8
+    assert set(results[8:]) == {"chat_rate"}
+    assert admission.admitted == admission.PRUNE_EVERY * 2 + 1
+    assert admission.resolutions_admitted == 8
+    assert len(admission._last_notice) <= 2 # (notice_interval=0：只剩最后一次 prune 之后写入的提示)
+
+
+def test_prune_drops_refilled_buckets_only():
+    async def run():
+        admission = main.LinkAdmission(max_in_flight=0, notice_interval=60.0)
+        config = make_config(main.RateLimit(60, 1))
+        assert admission.admit(config, chat_id=-1, user_id=1) is None
+        assert admission.admit_resolution(config, -1) is None
+        admission.finish(config, -1, 1)
+        assert admission.should_notify(config.webhook_path, -1)
+        admission._prune()
+        return admission
+
+    admission = asyncio.run(run())
+    assert ("/webhook/bot1", -1) in admission._chat_buckets
+    assert ("/webhook/bot1", -1) in admission._last_notice
+
+
+def test_inventory_resolutions_count_against_global_cap():
+    admission = main.LinkAdmission(max_in_flight=4, notice_interval=0.0)
+    assert admission.background_allowed()
+    admission.background_in_flight = 2
+    assert not admission.background_allowed() # (补货最多占一半)
+    config = make_config(main.RateLimit(0, 0))
+    admission.background_in_flight = 4
+    assert admission.admit_resolution(config, -1) == "global_in_flight"
+    admission.background_in_flight = 3
+    assert admission.admit_resolution(config, -1) is None
+
+
+def test_cache_hits_do_not_spend_tokens():
+    admission = main.LinkAdmission(max_in_flight=0, notice_interval=0.0)
+    config = make_config(main.RateLimit(60, 1), bot_limit=main.RateLimit(60, 1))
+    for user_id in range(50): # (库存/缓存命中：只经过 admit)
+        assert admission.admit(config, -1, user_id) is None
+        admission.finish(config, -1, user_id)
+    assert admission.admit(config, -1, 1) is None
+    assert admission.admit(config, -1, 1) == "user_in_flight"
+    assert admission.admit_resolution(config, -1) is None
+    assert admission.admit_resolution(config, -2) == "bot_rate"
+    assert admission._chat_buckets[("/webhook/bot1", -2)].tokens >= 1 # (Bot 级拒绝退还 Chat 令牌)
+
+
+def test_inventory_refill_does_not_join_user_navigation(monkeypatch):
+    calls = []
+
+    async def fake_target(domain_a, bot=""):
+        calls.append(domain_a)
+        n = len(calls)
+        await asyncio.sleep(0.01)
+        return f"https://b{n}.example/"
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"code": 0, "data": "http://a.example/"}
+
+    async def fake_get(url, **kwargs):
+        return FakeResponse()
+
+    monkeypatch.setattr(main, "resolve_domain_a_target", fake_target)
+    monkeypatch.setattr(main, "http_get", fake_get)
+    monkeypatch.setattr(main, "LINK_ADMISSION", main.LinkAdmission(max_in_flight=4, notice_interval=0.0))
+
+    async def run():
+        user = main.resolve_domain_b("http://api.example/", "/webhook/bot1")
+        refill = main.LinkInventory._resolve_one("http://api.example/", "/webhook/bot1")
+        return await asyncio.gather(user, refill)
+
+    user_b, refill_b = asyncio.run(run())
+    assert len(calls) == 2
+    assert user_b != refill_b
+    assert main.LINK_ADMISSION.background_in_flight == 0
@@ -0,0 +1,86 @@
+import asyncio
+
+import main
+
+
+def test_fresh_stale_and_expired_windows():
+    cache = main.LinkResolutionCache(ttl=0.1, stale_ttl=0.1, refresh_ahead=0.0)
+
+    async def run():
+        assert await cache.lookup("/bot1") == (None, False)
+        cache.set("/bot1", "https://b.example/")
+        fresh = await cache.lookup("/bot1")
+        await asyncio.sleep(0.12)
+        stale = await cache.lookup("/bot1")
+        await asyncio.sleep(0.1)
+        expired = await cache.lookup("/bot1")
+        return fresh, stale, expired
+
+    fresh, stale, expired = asyncio.run(run())
+    assert fresh == ("https://b.example/", False)
+    assert stale == ("https://b.example/", True) # (stale 窗口内：先返回旧值，调用方触发后台刷新)
+    assert expired == (None, False)
+    assert (cache.hits, cache.stale_hits, cache.misses) == (1, 1, 2)
+
+
+def test_shared_hit_is_not_counted_as_miss(monkeypatch):
+    backend = main.MemoryStateBackend()
+    backend.shared = True
+    monkeypatch.setattr(main, "STATE", backend)
+    worker_a = main.LinkResolutionCache(ttl=60, stale_ttl=60, refresh_ahead=0)
+    worker_b = main.LinkResolutionCache(ttl=60, stale_ttl=60, refresh_ahead=0)
+
+    async def run():
+        worker_a.set("/bot1", "https://b.example/")
+        await asyncio.sleep(0) # (写入共享后端在后台任务中进行)
+        return await worker_b.lookup("/bot1"), await worker_b.lookup("/bot2")
+
+    shared, missing = asyncio.run(run())
+    assert shared == ("https://b.example/", False)
+    assert missing == (None, False)
+    assert (worker_b.shared_hits, worker_b.misses, worker_b.hits) == (1, 1, 0)
+
+
+def test_background_refresh_runs_once_and_replaces_entry(monkeypatch):
+    cache = main.LinkResolutionCache(ttl=60, stale_ttl=60, refresh_ahead=0)
+    monkeypatch.setattr(main, "LINK_CACHE", cache)
+    monkeypatch.setattr(main, "RESOLVE_FLIGHTS", main.SingleFlight())
+    calls = []
+
+    async def fake_resolve(api_url, bot=""):
+        calls.append(api_url)
+        await asyncio.sleep(0.01)
+        return "https://new.example/"
+
+    monkeypatch.setattr(main, "resolve_domain_b", fake_resolve)
+
+    async def run():
+        cache.set("/bot1", "https://old.example/")
+        cache.revalidate("/bot1", "http://api.example/")
+        cache.revalidate("/bot1", "http://api.example/") # (同一路径同时只刷新一次)
+        await asyncio.sleep(0.05)
+        return await cache.lookup("/bot1")
+
+    assert asyncio.run(run()) == ("https://new.example/", False)
+    assert calls == ["http://api.example/"]
+    assert (cache.refreshes, cache.refresh_errors) == (1, 0)
+
+
+def test_background_refresh_error_keeps_old_entry(monkeypatch):
+    cache = main.LinkResolutionCache(ttl=60, stale_ttl=60, refresh_ahead=0)
+    monkeypatch.setattr(main, "LINK_CACHE", cache)
+    monkeypatch.setattr(main, "RESOLVE_FLIGHTS", main.SingleFlight())
+
+    async def failing_resolve(api_url, bot=""):
+        raise main.LinkResolveError("API 未返回有效链接")
+
+    monkeypatch.setattr(main, "resolve_domain_b", failing_resolve)
+
+    async def run():
+        cache.set("/bot1", "https://old.example/")
+        cache.revalidate("/bot1", "http://api.example/")
+        await asyncio.sleep(0.02)
+        return await cache.lookup("/bot1")
+
+    assert asyncio.run(run()) == ("https://old.example/", False)
+    assert cache.refresh_errors == 1
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import main
+
+
+def test_workers_merge_file_ids_instead_of_overwriting(tmp_path):
+    path = str(tmp_path / "media.json")
+
+    async def run():
+        worker_a, worker_b = main.MediaFileIdCache(path), main.MediaFileIdCache(path)
+        worker_a.load()
+        worker_b.load()
+        worker_a.put("1", "photo", "https://x/a.png", "file-a")
+        worker_b.put("1", "video", "https://x/b.mp4", "file-b")
+        await worker_a.flush()
+        await worker_b.flush()
+        return worker_a, worker_b
+
+    worker_a, worker_b = asyncio.run(run())
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"1": {"photo|https://x/a.png": "file-a", "video|https://x/b.mp4": "file-b"}}
+    assert worker_b.get("1", "photo", "https://x/a.png") == "file-a" # (合并时读到了另一个 worker 的 file_id)
+
+
+def test_drop_is_persisted(tmp_path):
+    path = str(tmp_path / "media.json")
+
+    async def run():
+        cache = main.MediaFileIdCache(path)
+        cache.put("1", "photo", "https://x/a.png", "file-a")
+        await cache.flush()
+        other = main.MediaFileIdCache(path)
+        other.load()
+        other.drop("1", "photo", "https://x/a.png")
+        await other.flush()
+        cache.put("1", "photo", "https://x/c.png", "file-c")
+        await cache.flush()
+
+    asyncio.run(run())
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"1": {"photo|https://x/c.png": "file-c"}}
+
+
+def test_puts_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "MEDIA_CACHE_SAVE_DELAY", 0.05)
+    cache = main.MediaFileIdCache(str(tmp_path / "media.json"))
+    writes = []
+    merge = cache._merge_into_file
+    monkeypatch.setattr(cache, "_merge_into_file", lambda pending: writes.append(dict(pending)) or merge(pending))
+
+    async def run():
+        for i in range(20):
+            cache.put("1", "photo", f"https://x/{i}.png", f"file-{i}")
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert len(writes) == 1 and len(writes[0]) == 20
+    assert cache.stats()["unsaved_changes"] == 0
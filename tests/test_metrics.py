@@ -0,0 +1,15 @@
+import main
+
+
+def test_label_values_are_escaped():
+    counter = main.Counter("test_total", "测试", ("bot", "handler"))
+    counter.inc(("/webhook/bot1", 'say "hi"\\now\nnext'))
+    line = counter.render()[-1]
+    assert line == 'test_total{bot="/webhook/bot1",handler="say \\"hi\\"\\\\now\\nnext"} 1.0'
+    assert "\n" not in line
+
+
+def test_histogram_labels_are_escaped():
+    histogram = main.Histogram("test_seconds", "测试", ("handler",), buckets=(1.0,))
+    histogram.observe(0.5, ('指南"1"',))
+    assert all('handler="指南\\"1\\""' in line for line in histogram.render()[2:])
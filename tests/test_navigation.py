@@ -0,0 +1,50 @@
+import asyncio
+
+import main
+
+
+class FakePage:
+    """只实现 navigate_until_settled 用到的接口：goto 之后停在 landing_url，load 事件在 load_delay 秒后完成"""
+
+    def __init__(self, landing_url, load_delay=0.05):
+        self.url = "about:blank"
+        self.main_frame = object()
+        self.landing_url = landing_url
+        self.load_delay = load_delay
+        self._listeners = []
+
+    def on(self, event, callback):
+        self._listeners.append(callback)
+
+    def remove_listener(self, event, callback):
+        self._listeners.remove(callback)
+
+    async def goto(self, url, wait_until=None):
+        self.url = self.landing_url
+        for callback in list(self._listeners):
+            callback(self.main_frame)
+
+    async def wait_for_load_state(self, state):
+        await asyncio.sleep(self.load_delay)
+
+
+def navigate(monkeypatch, domain_a, landing_url):
+    monkeypatch.setattr(main, "BROWSER_SETTLE_MS", 10)
+    page = FakePage(landing_url, load_delay=0.2)
+    return asyncio.run(main.navigate_until_settled(page, domain_a, main.url_host(domain_a)))
+
+
+def test_mixed_case_and_default_port_still_on_domain_a(monkeypatch):
+    # (Chromium 会把主机转成小写并去掉默认端口)
+    url, early_exit = navigate(monkeypatch, "http://A.Example.com:80/go", "http://a.example.com/go")
+    assert (url, early_exit) == ("http://a.example.com/go", False)
+
+
+def test_left_domain_a_returns_after_settle(monkeypatch):
+    url, early_exit = navigate(monkeypatch, "http://a.example.com/go", "https://b.example.com/landing")
+    assert (url, early_exit) == ("https://b.example.com/landing", True)
+
+
+def test_url_host_normalizes():
+    assert main.url_host("http://A.Example.COM:8080/x") == "a.example.com"
+    assert main.url_host("not a url") == ""
@@ -0,0 +1,50 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def config(monkeypatch):
+    index = main.compile_content({"links": {"universal": ["链接"]}}, None).index
+    monkeypatch.setattr(main, "KEYWORD_INDEX", index)
+    return main.BotConfig(
+        1, "bot1_webhook", "abcd", "token", None, None, None,
+        main.normalize_allowlist(["-1001234567890"]), 1,
+        main.RateLimit(0, 0), main.RateLimit(0, 0),
+    )
+
+
+def update(text, chat_id=-1001234567890, key="message"):
+    return {"update_id": 1, key: {"message_id": 1, "chat": {"id": chat_id}, "text": text}}
+
+
+def test_keyword_from_supergroup_passes(config):
+    assert main.prefilter_update(config, update(" 链接 ")) is None
+
+
+def test_short_form_of_supergroup_id_is_allowed(config):
+    # (白名单中配置 -100xxx 时，-xxx 形式同样放行)
+    assert main.prefilter_update(config, update("链接", chat_id=-1234567890)) is None
+
+
+def test_unauthorized_chat(config):
+    assert main.prefilter_update(config, update("链接", chat_id=-1009999999999)) == "unauthorized"
+
+
+def test_start_command_passes(config):
+    assert main.prefilter_update(config, update("/start")) is None
+    assert main.prefilter_update(config, update("/start@bench_bot hello")) is None
+    assert main.prefilter_update(config, update("/started")) == "not_keyword"
+
+
+def test_edited_message_and_non_text_are_skipped(config):
+    assert main.prefilter_update(config, update("链接", key="edited_message")) == "no_message"
+    assert main.prefilter_update(config, {"update_id": 1, "message": {"chat": {"id": -1001234567890}, "photo": []}}) == "no_text"
+
+
+def test_chatter_is_skipped(config):
+    assert main.prefilter_update(config, update("今天几点开始")) == "not_keyword"
+
+
+def test_malformed_payload_is_left_to_normal_handling(config):
+    assert main.prefilter_update(config, ["not", "a", "dict"]) is None
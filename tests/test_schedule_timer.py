@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+
+import main
+
+UTC = datetime.timezone.utc
+SLOT = datetime.datetime(2026, 3, 1, 8, 0, tzinfo=UTC)
+
+
+def scheduled(timer):
+    return [(datetime.datetime.fromtimestamp(ts, UTC), path, hhmm) for ts, path, hhmm in sorted(timer._heap)]
+
+
+def setup(monkeypatch, catchup="skip"):
+    monkeypatch.setattr(main, "BOT_SCHEDULES", {"bot1_webhook": {"times": ["08:00"], "chat_ids": ["-1001"], "message": "hi"}})
+    monkeypatch.setattr(main, "SCHEDULE_CATCHUP", catchup)
+    monkeypatch.setattr(main, "SCHEDULE_CATCHUP_WINDOW", 3600.0)
+
+
+def test_slot_inside_grace_window_still_fires(monkeypatch, tmp_path):
+    setup(monkeypatch)
+    timer = main.ScheduleTimer(str(tmp_path / "state.json"))
+    timer.build(SLOT + datetime.timedelta(seconds=30))
+    assert scheduled(timer) == [(SLOT, "bot1_webhook", "08:00")]
+    assert timer.caught_up == 0
+
+
+def test_missed_slot_is_skipped_by_default(monkeypatch, tmp_path):
+    setup(monkeypatch)
+    timer = main.ScheduleTimer(str(tmp_path / "state.json"))
+    timer.build(SLOT + datetime.timedelta(minutes=5))
+    assert scheduled(timer) == [(SLOT + datetime.timedelta(days=1), "bot1_webhook", "08:00")]
+
+
+def test_missed_slot_is_caught_up_once(monkeypatch, tmp_path):
+    setup(monkeypatch, catchup="once")
+    timer = main.ScheduleTimer(str(tmp_path / "state.json"))
+    timer.build(SLOT + datetime.timedelta(minutes=5))
+    assert scheduled(timer) == [(SLOT, "bot1_webhook", "08:00")]
+    assert timer.caught_up == 1
+    timer.build(SLOT + datetime.timedelta(hours=2)) # (超出补发窗口)
+    assert scheduled(timer) == [(SLOT + datetime.timedelta(days=1), "bot1_webhook", "08:00")]
+
+
+def test_fired_slot_is_not_resent_after_restart(monkeypatch, tmp_path):
+    setup(monkeypatch, catchup="once")
+    sent = []
+
+    async def fake_send(webhook_path, schedule):
+        sent.append(webhook_path)
+
+    monkeypatch.setattr(main, "send_scheduled_message", fake_send)
+    state_file = str(tmp_path / "state.json")
+
+    async def run():
+        before = main.ScheduleTimer(state_file)
+        await before.load_state()
+        await before._fire("bot1_webhook", "08:00", SLOT)
+        await before._fire("bot1_webhook", "08:00", SLOT) # (补发与正常触发重叠)
+
+        after = main.ScheduleTimer(state_file) # (重启)
+        await after.load_state()
+        after.build(SLOT + datetime.timedelta(seconds=30))
+        return after
+
+    after = asyncio.run(run())
+    assert sent == ["bot1_webhook"]
+    assert scheduled(after) == [(SLOT + datetime.timedelta(days=1), "bot1_webhook", "08:00")]
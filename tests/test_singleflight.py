@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def test_concurrent_callers_share_one_execution():
+    flights = main.SingleFlight()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "domain-b"
+
+    async def run():
+        results = await asyncio.gather(*(flights.do("path", factory) for _ in range(5)))
+        return results, len(flights)
+
+    results, in_flight_after = asyncio.run(run())
+    assert results == ["domain-b"] * 5
+    assert calls == [1]
+    assert flights.stats() == {"in_flight": 0, "executions": 1, "coalesced": 4}
+    assert in_flight_after == 0
+
+
+def test_error_reaches_every_waiter():
+    flights = main.SingleFlight()
+
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise main.LinkResolveError("API 未返回有效链接")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("path", factory) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, main.LinkResolveError) for e in errors)
+    assert errors[0] is errors[1] is errors[2]
+    assert not flights.in_flight("path")
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    flights = main.SingleFlight()
+
+    async def factory():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("path", factory))
+        second = asyncio.ensure_future(flights.do("path", factory))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "ok"
+
+
+def test_next_call_after_completion_runs_again():
+    flights = main.SingleFlight()
+    counter = iter(range(10))
+
+    async def factory():
+        return next(counter)
+
+    async def run():
+        return await flights.do("k", factory), await flights.do("k", factory)
+
+    assert asyncio.run(run()) == (0, 1)
+    assert flights.executions == 2
@@ -0,0 +1,54 @@
+import asyncio
+import sqlite3
+import time
+
+import main
+
+
+def test_sqlite_backend_purges_expired_rows(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        backend = main.SqliteStateBackend(path)
+        backend.PURGE_EVERY = 50
+        for i in range(40):
+            assert await backend.add(f"update:{i}", 1, ttl=0.01)
+        await backend.set("scheduler", "keep")
+        time.sleep(0.05)
+        for i in range(40, 50):
+            assert await backend.add(f"update:{i}", 1, ttl=60)
+        await backend.close()
+
+    asyncio.run(run())
+    conn = sqlite3.connect(path)
+    keys = {row[0] for row in conn.execute("SELECT key FROM kv")}
+    conn.close()
+    assert keys == {"scheduler"} | {f"update:{i}" for i in range(40, 50)}
+
+
+def test_sqlite_backend_add_reuses_expired_key(tmp_path):
+    async def run():
+        backend = main.SqliteStateBackend(str(tmp_path / "state.sqlite3"))
+        assert await backend.add("update:1", 1, ttl=0.2)
+        assert not await backend.add("update:1", 1, ttl=0.2)
+        time.sleep(0.3)
+        assert await backend.add("update:1", 2, ttl=60)
+        assert await backend.get("update:1") == 2
+        assert await backend.purge_expired() == 0
+        await backend.close()
+
+    asyncio.run(run())
+
+
+def test_memory_backend_purges_expired_keys():
+    async def run():
+        backend = main.MemoryStateBackend()
+        backend.PURGE_EVERY = 20
+        for i in range(19):
+            await backend.add(f"update:{i}", 1, ttl=0.01)
+        time.sleep(0.05)
+        await backend.set("scheduler", "keep")
+        return backend
+
+    backend = asyncio.run(run())
+    assert list(backend._data) == ["scheduler"]
@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, Forbidden
+
+import main
+
+
+class FailingMessage:
+    chat_id = -1001
+
+    def __init__(self, error):
+        self.error = error
+
+    async def reply_html(self, text):
+        raise self.error
+
+
+def make_context(webhook_path, error=None):
+    config = SimpleNamespace(webhook_path=webhook_path, allowed_chat_ids=frozenset())
+    return SimpleNamespace(
+        bot_data={main.BOT_CONFIG_KEY: config},
+        application=SimpleNamespace(bot=SimpleNamespace(token="123:abcd")),
+        error=error,
+    )
+
+
+def errors(bot, name):
+    return main.TELEGRAM_ERRORS._values.get((bot, name), 0.0)
+
+
+def test_send_guide_records_caught_error(monkeypatch):
+    monkeypatch.setattr(main, "is_chat_allowed", lambda context, chat_id: True)
+    update = SimpleNamespace(message=FailingMessage(Forbidden("bot was blocked by the user")))
+    guide = main.GuideReply("测试指南", "<b>hi</b>")
+    before = errors("/webhook/guide", "Forbidden")
+    asyncio.run(main.send_guide(guide, update, make_context("/webhook/guide")))
+    assert errors("/webhook/guide", "Forbidden") == before + 1
+
+
+def test_error_handler_records_uncaught_error():
+    before = errors("/webhook/start", "BadRequest")
+    asyncio.run(main.on_handler_error(None, make_context("/webhook/start", BadRequest("Chat not found"))))
+    asyncio.run(main.on_handler_error(None, make_context("/webhook/start", ValueError("not telegram"))))
+    assert errors("/webhook/start", "BadRequest") == before + 1
+    assert errors("/webhook/start", "ValueError") == 0
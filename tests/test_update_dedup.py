@@ -0,0 +1,35 @@
+import main
+
+
+def test_redelivery_inside_window_is_duplicate():
+    dedup = main.UpdateDeduplicator(window=3)
+    assert [dedup.is_duplicate(i) for i in (10, 11, 10, 12, 11)] == [False, False, True, False, True]
+    assert dedup.stats() == {"checked": 5, "duplicates_dropped": 2, "high_water_update_id": 12}
+
+
+def test_ring_evicts_oldest_and_remembers_high_water():
+    dedup = main.UpdateDeduplicator(window=2)
+    for update_id in (1, 2, 3, 4): # (1、2 被淘汰)
+        assert not dedup.is_duplicate(update_id)
+    assert len(dedup._ring) == len(dedup._seen) == 2
+    assert dedup.evicted_high_water == 2
+    assert dedup.is_duplicate(1) # (比已淘汰的最高水位更旧：视为重复)
+    assert dedup.is_duplicate(2)
+    assert dedup.is_duplicate(4)
+    assert not dedup.is_duplicate(5)
+
+
+def test_out_of_order_ids_only_raise_high_water():
+    dedup = main.UpdateDeduplicator(window=2)
+    for update_id in (7, 5, 6): # (淘汰 7)
+        dedup.is_duplicate(update_id)
+    assert dedup.evicted_high_water == 7
+    assert dedup.high_water == 7
+    assert dedup.is_duplicate(6)
+
+
+def test_forget_allows_redelivery():
+    dedup = main.UpdateDeduplicator(window=10)
+    assert not dedup.is_duplicate(42)
+    dedup.forget(42) # (处理失败)
+    assert not dedup.is_duplicate(42)